@@ -2,11 +2,12 @@ import os
 import time
 import json
 import base64
-from datetime import datetime, timezone
-from flask import Flask, request, jsonify
+from datetime import datetime, timezone, timedelta
+from flask import Flask, request, jsonify, g, has_request_context
 from flask_restful import Api, Resource
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from flask_mqtt import Mqtt
 from twilio.rest import Client
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
@@ -18,6 +19,9 @@ from flask_bcrypt import Bcrypt
 from twilio.base.exceptions import TwilioRestException
 from dotenv import load_dotenv
 import ssl
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from contextlib import contextmanager
 
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s [%(levelname)s] %(message)s")
 
@@ -40,7 +44,7 @@ CORS(app, resources={
     r"/api/*": {
         "origins": ["https://siaudvytisbenas.dev", "http://localhost:19006", "exp://localhost:19000"],
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "X-Trace-Id"]
     }
 })
 api = Api(app, prefix='/api')
@@ -60,6 +64,89 @@ app.config['MQTT_TLS_KEYFILE']  = os.getenv('MQTT_CLIENT_KEY', None)
 print(f"[DEBUG] Attempting to connect to MQTT broker at {MQTT_BROKER_URL}: {app.config['MQTT_BROKER_PORT']}")
 mqtt = Mqtt(app)
 
+## Request tracing
+# A door entry's trace id arrives in the X-Trace-Id header (Pi requests) or in
+# an MQTT payload's "trace_id". Spans of each hop (HTTP requests, Twilio calls,
+# MQTT publishes) are appended to TRACE_FILE in the Chrome trace format; the
+# Pi's tracing.py merges this file with its own into one timeline. Requests
+# without a trace id (e.g. from the mobile app) are not traced. Past
+# TRACE_MAX_BYTES the file is rotated to .1, like the Pi's.
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_FILE = os.getenv("TRACE_FILE", "backend_trace.json")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 20 * 1024 * 1024))
+TRACE_PID = 2  # The Pi's spans use pid 1
+trace_lock = threading.Lock()
+
+def current_trace_id():
+    """Trace id of the request being handled, or None outside a request"""
+    return g.get("trace_id") if has_request_context() else None
+
+def record_span(name, category, start, end, trace_id=None, **args):
+    """Append a finished span to the trace file"""
+    trace_id = trace_id or current_trace_id()
+    if not trace_id:
+        return
+    event = {
+        "name": name, "cat": category, "ph": "X",
+        "ts": int(start * 1e6), "dur": max(int((end - start) * 1e6), 1),
+        "pid": TRACE_PID, "tid": threading.get_ident(),
+        "args": dict(args, trace_id=trace_id)
+    }
+    try:
+        with trace_lock:
+            new_file = not os.path.exists(TRACE_FILE) or os.path.getsize(TRACE_FILE) == 0
+            with open(TRACE_FILE, "a") as trace_file:
+                if new_file:
+                    # JSON array format: the closing bracket is optional, so events can be appended
+                    trace_file.write("[\n")
+                    trace_file.write(json.dumps({"name": "process_name", "ph": "M", "pid": TRACE_PID,
+                                                 "args": {"name": "Backend"}}) + ",\n")
+                trace_file.write(json.dumps(event) + ",\n")
+                rotate = trace_file.tell() > TRACE_MAX_BYTES
+            if rotate:
+                # Keep one previous file, so a busy door can't fill the disk
+                os.replace(TRACE_FILE, TRACE_FILE + ".1")
+    except Exception as e:
+        print(f"[ERROR] Failed to write trace event: {e}")
+
+@contextmanager
+def trace_span(name, category, trace_id=None, **args):
+    """Record the body of a with-block as a span"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, category, start, time.time(), trace_id, **args)
+
+def send_sms_otp(phone_number, trace_id=None):
+    """Send an OTP by SMS through Twilio Verify"""
+    with trace_span("twilio send OTP", "sms", trace_id):
+        return twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
+            .verifications \
+            .create(to=phone_number, channel="sms")
+
+def check_sms_otp(phone_number, code, trace_id=None):
+    """Check an OTP through Twilio Verify"""
+    with trace_span("twilio check OTP", "sms", trace_id):
+        return twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
+            .verification_checks \
+            .create(to=phone_number, code=code)
+
+@app.before_request
+def start_request_trace():
+    # Only door entries carry a trace id; other requests are not traced
+    g.trace_id = request.headers.get(TRACE_HEADER)
+    g.trace_started_at = time.time()
+
+@app.after_request
+def record_request_trace(response):
+    if g.get("trace_id"):
+        record_span(f"{request.method} {request.path}", "backend", g.trace_started_at, time.time(),
+                    status=response.status_code)
+        response.headers[TRACE_HEADER] = g.trace_id
+    return response
+
 ## JWT Setup
 app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = 3600  # Token expires in 1 hour
@@ -80,6 +167,7 @@ class AccessLog(db.Model):
     method = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(20), nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    clip_url = db.Column(db.String(255), nullable=True)  # Incident clip recorded by the Pi, if any
     def __repr__(self):
         return f"<AccessLog {self.user} - {self.status}>"
 
@@ -108,6 +196,7 @@ class User(db.Model):
     face_encodings = db.Column(db.Text, nullable=True) # Multiple face encodings stored as JSON
     face_registered = db.Column(db.Boolean, default=False) # Whether face has been registered
     low_security = db.Column(db.Boolean, default=False) # Whether user can bypass OTP verification
+    face_encoder = db.Column(db.String(32), nullable=True) # Encoder that produced face_encodings
 
 ## Door schedule database model
 
@@ -133,23 +222,372 @@ class UserSchedule(db.Model):
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        db.Index("ix_user_schedule_window", "user_id", "start_date", "end_date"),
+    )
     
     def __repr__(self):
         return f"<UserSchedule {self.user_id} {self.start_date} to {self.end_date}>"
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "start_date": self.start_date.isoformat(),
+            "end_date": self.end_date.isoformat(),
+            "created_at": self.created_at.isoformat()
+        }
+
+## In-process user directory cache
+
+# Immutable snapshot of the User columns the door decision path needs
+CachedUser = namedtuple("CachedUser", ["id", "name", "phone_number", "is_allowed", "low_security", "face_registered"])
+
+class UserDirectoryCache:
+    """Read-through cache of user rows keyed by phone number.
+
+    Snapshots are shared between request threads and the MQTT callback thread,
+    so every code path that writes a User must call invalidate() after commit.
+    Misses are not cached, so newly created users need no invalidation.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, phone_number):
+        if not phone_number:
+            return None
+        with self._lock:
+            cached = self._entries.get(phone_number)
+            generation = self._generation
+        if cached is not None:
+            return cached
+
+        user = User.query.filter_by(phone_number=phone_number).first()
+        if not user:
+            return None
+        cached = CachedUser(
+            id=user.id,
+            name=user.name,
+            phone_number=user.phone_number,
+            is_allowed=bool(user.is_allowed),
+            low_security=bool(user.low_security),
+            face_registered=bool(user.face_registered)
+        )
+        with self._lock:
+            # Skip storing if an invalidation raced with the load above
+            if generation == self._generation:
+                self._entries[phone_number] = cached
+        return cached
+
+    def invalidate(self, phone_number=None):
+        """Drop one phone number from the cache, or everything if none is given"""
+        with self._lock:
+            self._generation += 1
+            if phone_number is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(phone_number, None)
+
+user_cache = UserDirectoryCache()
+
+## Compiled global schedule
+
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+class CompiledSchedule:
+    """Weekly door schedule compiled from Schedule rows.
+
+    state_at() is a single per-weekday table lookup. next_transition() bisects a
+    precomputed list of open/close boundaries, which holds at most two entries per
+    day, so both answers are constant time and never touch the database.
+    """
+
+    def __init__(self, entries):
+        # Serialized rows, served as-is by ScheduleAPI.get
+        self.entries = entries
+        # Weekday index -> (force_unlocked, open_seconds, close_seconds)
+        self._days = {}
+        for entry in entries:
+            if entry["day"] not in DAYS_OF_WEEK:
+                continue
+            self._days[DAYS_OF_WEEK.index(entry["day"])] = (
+                bool(entry.get("forceUnlocked")),
+                self._seconds(entry.get("open_time")),
+                self._seconds(entry.get("close_time"))
+            )
+        self._boundaries, self._states = self._compile_boundaries()
+
+    @staticmethod
+    def _seconds(value):
+        if not value:
+            return None
+        parsed = datetime.strptime(value, "%H:%M")
+        return parsed.hour * 3600 + parsed.minute * 60
+
+    def _open_intervals(self):
+        """Yield [start, end) open intervals in seconds since Monday 00:00"""
+        for day in range(7):
+            force_unlocked, open_s, close_s = self._days.get(day, (False, None, None))
+            base = day * SECONDS_PER_DAY
+            if force_unlocked:
+                yield base, base + SECONDS_PER_DAY
+            elif open_s is not None and close_s is not None and open_s <= close_s:
+                # Closing time is inclusive, matching the original comparison
+                yield base + open_s, base + close_s + 1
+
+    def _compile_boundaries(self):
+        merged = []
+        for start, end in self._open_intervals():
+            if merged and merged[-1][1] >= start:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        boundaries = []
+        states = []
+        for start, end in merged:
+            boundaries.extend([start, end])
+            states.extend([True, False])
+        return boundaries, states
+
+    def state_at(self, when):
+        """Return (is_open, reason) where reason is "force_unlocked", "schedule_hours" or None"""
+        force_unlocked, open_s, close_s = self._days.get(when.weekday(), (False, None, None))
+        if force_unlocked:
+            return True, "force_unlocked"
+        if open_s is not None and close_s is not None:
+            now_s = when.hour * 3600 + when.minute * 60 + when.second + when.microsecond / 1e6
+            if open_s <= now_s <= close_s:
+                return True, "schedule_hours"
+        return False, None
+
+    def next_transition(self, when):
+        """Return (datetime, is_open_after) for the next schedule change, or None if it never changes"""
+        # A schedule that is open all week or never open has no real transitions
+        if not self._boundaries or self._boundaries == [0, SECONDS_PER_WEEK]:
+            return None
+        week_start = (when - timedelta(days=when.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        offset = (when - week_start).total_seconds()
+        # Open across Sunday midnight into Monday: the week-end boundary is not a real change
+        wraps = self._boundaries[0] == 0 and self._boundaries[-1] == SECONDS_PER_WEEK
+        index = bisect_right(self._boundaries, offset)
+        if wraps and index == len(self._boundaries) - 1:
+            index = len(self._boundaries)
+        if index < len(self._boundaries):
+            boundary = self._boundaries[index]
+            is_open_after = self._states[index]
+        else:
+            first = 1 if wraps else 0
+            boundary = self._boundaries[first] + SECONDS_PER_WEEK
+            is_open_after = self._states[first]
+        return week_start + timedelta(seconds=boundary), is_open_after
+
+class ScheduleCache:
+    """Holds the compiled schedule; rebuilt only when the Schedule table changes"""
+
+    def __init__(self):
+        self._compiled = CompiledSchedule([])
+        self.is_built = False
+
+    def rebuild(self):
+        entries = [entry.to_dict() for entry in Schedule.query.all()]
+        self._compiled = CompiledSchedule(entries)
+        self.is_built = True
+        logging.info(f"Compiled global schedule with {len(entries)} days")
+        return self._compiled
+
+    def get(self):
+        return self._compiled
+
+schedule_cache = ScheduleCache()
+
+## Retained policy snapshot for the Raspberry Pi
+
+POLICY_TOPIC = "door/policy"
+policy_version = 0
+policy_lock = threading.Lock()
+
+def publish_policy_snapshot():
+    """Publish the Pi policy state as a versioned, retained MQTT message.
+
+    The broker hands the latest snapshot to the Pi as soon as it subscribes, so a
+    Pi that boots or reconnects never needs a REST round trip to catch up.
+    """
+    global policy_version
+    # MQTT may connect before the schedule is loaded; never retain an empty schedule
+    if not schedule_cache.is_built:
+        return
+    with policy_lock:
+        # Millisecond timestamps keep versions increasing across backend restarts
+        policy_version = max(policy_version + 1, int(time.time() * 1000))
+        snapshot = {
+            "version": policy_version,
+            "schedule": schedule_cache.get().entries
+        }
+    mqtt.publish(POLICY_TOPIC, json.dumps(snapshot), qos=1, retain=True)
+    print(f"[DEBUG] Published retained policy snapshot version {snapshot['version']}")
+
+## Per-user access window index
+
+def to_naive_utc(value):
+    """Normalize a datetime to naive UTC so stored and request values compare safely"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+class UserScheduleIndex:
+    """In-memory interval index over UserSchedule windows.
+
+    UserScheduleAPI.post rejects overlapping windows, so each user's windows are
+    disjoint and, sorted by start, also sorted by end. That lets "active now" and
+    overlap checks bisect the start list, and lets expiry pruning drop a prefix.
+    The index always mirrors the table: expired windows are only pruned by
+    prune_expired(), which deletes the rows and the index entries together.
+    """
+
+    def __init__(self):
+        # user_id -> sorted list of (start_date, end_date, schedule_id)
+        self._windows = {}
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            self._windows.clear()
+            self._starts.clear()
+        for schedule in UserSchedule.query.all():
+            self.add(schedule)
+        logging.info(f"Indexed user schedules for {len(self._windows)} users")
+
+    def add(self, schedule):
+        window = (to_naive_utc(schedule.start_date), to_naive_utc(schedule.end_date), schedule.id)
+        with self._lock:
+            windows = self._windows.setdefault(schedule.user_id, [])
+            position = bisect_right(windows, window)
+            windows.insert(position, window)
+            self._starts.setdefault(schedule.user_id, []).insert(position, window[0])
+
+    def remove(self, schedule):
+        window = (to_naive_utc(schedule.start_date), to_naive_utc(schedule.end_date), schedule.id)
+        with self._lock:
+            windows = self._windows.get(schedule.user_id, [])
+            position = bisect_left(windows, window)
+            if position < len(windows) and windows[position] == window:
+                del windows[position]
+                del self._starts[schedule.user_id][position]
+
+    def drop_user(self, user_id):
+        with self._lock:
+            self._windows.pop(user_id, None)
+            self._starts.pop(user_id, None)
+
+    def _prune_user(self, user_id, now):
+        """Drop windows that ended before now; caller must hold the lock"""
+        windows = self._windows.get(user_id)
+        if not windows:
+            return 0
+        expired = 0
+        while expired < len(windows) and windows[expired][1] < now:
+            expired += 1
+        if expired == len(windows):
+            del self._windows[user_id]
+            del self._starts[user_id]
+        elif expired:
+            del windows[:expired]
+            del self._starts[user_id][:expired]
+        return expired
+
+    def prune_expired(self, now=None):
+        """Delete windows that ended before now from the table and the index, and return how many"""
+        now = to_naive_utc(now or datetime.now(timezone.utc))
+        with self._lock:
+            # One transaction under the index lock, so no request sees the two disagree
+            try:
+                removed = UserSchedule.query.filter(UserSchedule.end_date < now) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            pruned = sum(self._prune_user(user_id, now) for user_id in list(self._windows))
+        if pruned != removed:
+            logging.warning(f"Pruned {removed} expired schedules but {pruned} index entries; reloading")
+            self.load()
+        return removed
+
+    def active_window(self, user_id, when):
+        """Return the schedule id of the window covering `when`, or None"""
+        when = to_naive_utc(when)
+        with self._lock:
+            starts = self._starts.get(user_id)
+            if not starts:
+                return None
+            position = bisect_right(starts, when) - 1
+            if position >= 0:
+                start, end, schedule_id = self._windows[user_id][position]
+                if start <= when <= end:
+                    return schedule_id
+        return None
+
+    def find_overlap(self, user_id, start, end):
+        """Return the id of a window overlapping [start, end], or None"""
+        start, end = to_naive_utc(start), to_naive_utc(end)
+        with self._lock:
+            starts = self._starts.get(user_id)
+            if not starts:
+                return None
+            windows = self._windows[user_id]
+            # Only the window starting just before `end` can overlap, since ends are sorted too
+            position = bisect_right(starts, end) - 1
+            if position >= 0 and windows[position][1] >= start:
+                return windows[position][2]
+        return None
+
+user_schedule_index = UserScheduleIndex()
+
+## Schema migrations
+
+# Encoder assumed for face encodings registered before encoders were tagged
+DEFAULT_FACE_ENCODER = "dlib_resnet"
+
+def add_missing_column(model, column_name, ddl):
+    """Add a column that create_all() cannot add to an existing table"""
+    table = model.__tablename__
+    existing = {column["name"] for column in inspect(db.engine).get_columns(table)}
+    if column_name in existing:
+        return
+    with db.engine.begin() as connection:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column_name} {ddl}"))
+    print(f"[DEBUG] Added column {table}.{column_name}")
+
 # Create the database tables if they don't exist
 with app.app_context():
     db.create_all()
+    add_missing_column(User, "face_encoder", "VARCHAR(32)")
+    add_missing_column(AccessLog, "clip_url", "VARCHAR(255)")
     # Insert default schedule if none exists
-    days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
     if Schedule.query.count() == 0:
-        for day in days:
+        for day in DAYS_OF_WEEK:
             open_time = datetime.strptime("09:00", "%H:%M").time()
             close_time = datetime.strptime("13:00", "%H:%M").time()
             new_schedule = Schedule(day=day, open_time=open_time, close_time=close_time, force_unlocked=False)
             db.session.add(new_schedule)
         db.session.commit()
         print("Default schedule added.")
+    schedule_cache.rebuild()
+    # create_all() skips indexes on tables that already exist
+    for index in UserSchedule.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    user_schedule_index.load()
+    print(f"[DEBUG] Pruned {user_schedule_index.prune_expired()} expired user schedules")
+
+# Covers a broker connection that completed before the schedule was loaded
+publish_policy_snapshot()
 
 # Handles login request for admin. Checks username and password
 class LoginResource(Resource):
@@ -166,9 +604,7 @@ class LoginResource(Resource):
             return {"error": "Invalid credentials"}, 401
         # Credentials are valid, send OTP to user's phone
         try:
-            verification = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-                .verifications \
-                .create(to=admin.phone_number, channel="sms")
+            verification = send_sms_otp(admin.phone_number)
             # Return OK to let client proceed 
             return {
                 "status": "OK",
@@ -195,9 +631,7 @@ class CheckVerification(Resource):
             return {"error": "User not found"}, 404
 
         try:
-            verification_check = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-                .verification_checks \
-                .create(to=admin.phone_number, code=code)
+            verification_check = check_sms_otp(admin.phone_number, code)
 
             if verification_check.status == "approved":
                 # Log successful admin login
@@ -235,12 +669,10 @@ class CheckVerification(Resource):
 def send_otp(phone_number):
     try:
         # Send the OTP code via Twilio Verify
-        verification = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-            .verifications \
-            .create(to=phone_number, channel ="sms")
+        verification = send_sms_otp(phone_number)
 
         # Get user name if available
-        user = User.query.filter_by(phone_number=phone_number).first()
+        user = user_cache.get(phone_number)
         user_name = user.name if user else None
 
         new_log = AccessLog(
@@ -298,13 +730,11 @@ class CheckVerificationRPI(Resource):
             return {"error": "phone_number and otp_code are required"}, 400
         
         try:
-            verification_check = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-                .verification_checks \
-                .create(to=phone_number, code=otp_code)
+            verification_check = check_sms_otp(phone_number, otp_code)
             
             if verification_check.status == "approved":
                 # Log successful OTP verification
-                user = User.query.filter_by(phone_number=phone_number).first()
+                user = user_cache.get(phone_number)
                 user_name = user.name if user else None
                 
                 new_log = AccessLog(
@@ -319,7 +749,7 @@ class CheckVerificationRPI(Resource):
                 return {"status": "approved"}, 200
             else:
                 # Log invalid OTP attempt
-                user = User.query.filter_by(phone_number=phone_number).first()
+                user = user_cache.get(phone_number)
                 user_name = user.name if user else None
                 
                 new_log = AccessLog(
@@ -342,7 +772,7 @@ class DoorEntryAPI(Resource):
         data = request.get_json()
         phone_number = data.get("phone_number")
 
-        user = User.query.filter_by(phone_number=phone_number).first()
+        user = user_cache.get(phone_number)
         
         if not user:
             # Create a pending user
@@ -363,9 +793,7 @@ class DoorEntryAPI(Resource):
             
         # User exists and is allowed access, send OTP
         try:
-            verification = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-                .verifications \
-                .create(to=phone_number, channel="sms")
+            verification = send_sms_otp(phone_number)
             
             # Log the OTP request
             new_log = AccessLog(
@@ -404,7 +832,8 @@ class GetAccessLogs(Resource):
                     "user_name": log.user_name,  # Include user_name in response
                     "method": log.method,
                     "status": log.status,
-                    "timestamp": log.timestamp.isoformat()
+                    "timestamp": log.timestamp.isoformat(),
+                    "clip_url": log.clip_url
                 }
                 for log in logs
             ]
@@ -420,10 +849,7 @@ class GetAccessLogs(Resource):
 ## Handles the setting of door schedule
 class ScheduleAPI(Resource):
     def get(self):
-        schedule = Schedule.query.all()
-        schedule_list = [entry.to_dict() for entry in schedule]
-        print(f"Schedule data: {schedule_list}")  # Add logging
-        return jsonify(schedule_list)
+        return jsonify(schedule_cache.get().entries)
 
     def put(self):
         data = request.get_json()
@@ -446,12 +872,26 @@ class ScheduleAPI(Resource):
             else:
                 db.session.add(Schedule(day=entry["day"], open_time=open_time, close_time=close_time, force_unlocked=force_unlocked))
         db.session.commit()
+        schedule_cache.rebuild()
 
-        # Send schedule update via MQTT
-        mqtt_payload = json.dumps(data)
-        mqtt.publish("door/schedule", mqtt_payload)
+        # The Pi receives the schedule in the versioned policy snapshot
+        publish_policy_snapshot()
 
         return {"message": "Schedule updated successfully"}, 200
+
+## Reports whether the global schedule has the door open right now
+class ScheduleStatusAPI(Resource):
+    def get(self):
+        now = datetime.now(timezone.utc)
+        compiled = schedule_cache.get()
+        is_open, reason = compiled.state_at(now)
+        transition = compiled.next_transition(now)
+        return {
+            "open": is_open,
+            "reason": reason,
+            "next_transition": transition[0].isoformat() if transition else None,
+            "open_after_transition": transition[1] if transition else None
+        }, 200
     
 # API resource to manage users
 class UserManagementAPI(Resource):
@@ -487,6 +927,7 @@ class UserManagementAPI(Resource):
         if "low_security" in data:
             user.low_security = data["low_security"]
         db.session.commit()
+        user_cache.invalidate(user.phone_number)
         return {"message": "User updated successfully"}, 200    
     
     def post(self):
@@ -507,6 +948,7 @@ class UserManagementAPI(Resource):
         )
         db.session.add(new_user)
         db.session.commit()
+        user_cache.invalidate(phone_number)
         return {"id": new_user.id,
                 "name": new_user.name,
                 "phone_number": new_user.phone_number,
@@ -521,8 +963,11 @@ class UserManagementAPI(Resource):
         user = User.query.get(user_id)
         if not user:
             return {"error": "User not found"}, 404
+        phone_number = user.phone_number
         db.session.delete(user)
         db.session.commit()
+        user_cache.invalidate(phone_number)
+        user_schedule_index.drop_user(user.id)
         return{"message": "User deleted successfully"}, 200
 
 class UpdateUserNameAPI(Resource):
@@ -537,6 +982,7 @@ class UpdateUserNameAPI(Resource):
             return {"error": "User not found"}, 404
         user.name = name
         db.session.commit()
+        user_cache.invalidate(phone_number)
         return {"status": "success", "message": "Name updated"}, 200
 
 ## MQTT Resources
@@ -556,11 +1002,11 @@ def handle_connect(client, userdata, flags, rc):
     if rc == 0:
         mqtt.subscribe([
             ("door/commands", 1),
-            ("door/schedule", 1),
             ("door/otp/verify", 1),
             (f"door/otp/response/+", 1)
         ])
         print("[DEBUG] Successfully subscribed to MQTT topics")
+        publish_policy_snapshot()
     else:
         print(f"[ERROR] MQTT connection failed with rc: {rc}")
 
@@ -584,29 +1030,30 @@ def handle_logging(client, userdata, level, buf):
 @mqtt.on_message()
 def handle_otp_verification(client, userdata, message):
     if message.topic == "door/otp/verify":
+        trace_id = None
         try:
             payload = message.payload.decode()
             data = json.loads(payload)
             phone_number = data.get("phone_number")
             otp_code = data.get("otp_code")
+            trace_id = data.get("trace_id")
             print(f"[DEBUG] Received OTP verification request for {phone_number}")
 
             # Get user name if available
-            user = User.query.filter_by(phone_number=phone_number).first()
+            user = user_cache.get(phone_number)
             if not user:
                 res = {"phone_number": phone_number, "status": "denied", "message": "User not found"}
-                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(res), qos=1)
+                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(dict(res, trace_id=trace_id)), qos=1)
                 return
 
             user_name = user.name if user else None
 
             # 1. Check global schedule first
             current_time = datetime.now(timezone.utc)
-            current_day = current_time.strftime("%A")  # Get current day name
-            global_schedule = Schedule.query.filter_by(day=current_day).first()
+            _, schedule_reason = schedule_cache.get().state_at(current_time)
             
             # If door is force unlocked globally, allow direct access
-            if global_schedule and global_schedule.force_unlocked:
+            if schedule_reason == "force_unlocked":
                 # Log the access attempt
                 new_log = AccessLog(
                     user=phone_number,
@@ -617,32 +1064,28 @@ def handle_otp_verification(client, userdata, message):
                 db.session.add(new_log)
                 db.session.commit()
                 res = {"phone_number": phone_number, "status": "approved", "message": "Door is globally unlocked"}
-                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(res), qos=1)
+                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(dict(res, trace_id=trace_id)), qos=1)
                 return
 
             # If within global schedule hours, allow direct access
-            if global_schedule and global_schedule.open_time and global_schedule.close_time:
-                current_time_only = current_time.time()
-                if global_schedule.open_time <= current_time_only <= global_schedule.close_time:
-                    # Log the access attempt
-                    new_log = AccessLog(
-                        user=phone_number,
-                        user_name=user_name,
-                        method="Global Schedule Hours",
-                        status="Door Unlocked"
-                    )
-                    db.session.add(new_log)
-                    db.session.commit()
-                    res = {"phone_number": phone_number, "status": "approved", "message": "Within global schedule hours"}
-                    mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(res), qos=1)
-                    return
+            if schedule_reason == "schedule_hours":
+                # Log the access attempt
+                new_log = AccessLog(
+                    user=phone_number,
+                    user_name=user_name,
+                    method="Global Schedule Hours",
+                    status="Door Unlocked"
+                )
+                db.session.add(new_log)
+                db.session.commit()
+                res = {"phone_number": phone_number, "status": "approved", "message": "Within global schedule hours"}
+                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(dict(res, trace_id=trace_id)), qos=1)
+                return
 
             # 2. If not globally accessible, check if user is allowed
             if user.is_allowed:
                 # User is allowed, require OTP verification
-                verification_check = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-                    .verification_checks \
-                    .create(to=phone_number, code=otp_code)
+                verification_check = check_sms_otp(phone_number, otp_code, trace_id)
                 
                 if verification_check.status == "approved":
                     new_log = AccessLog(
@@ -665,21 +1108,15 @@ def handle_otp_verification(client, userdata, message):
                     db.session.add(new_log)
                     db.session.commit()
                     res = {"phone_number": phone_number, "status": "denied", "message": "Invalid OTP"}
-                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(res), qos=1)
+                mqtt.publish(f"door/otp/response/{phone_number}", json.dumps(dict(res, trace_id=trace_id)), qos=1)
                 return
 
             # 3. If user is not allowed, check their schedule
-            user_schedule = UserSchedule.query.filter(
-                UserSchedule.user_id == user.id,
-                UserSchedule.start_date <= current_time,
-                UserSchedule.end_date >= current_time
-            ).first()
+            user_schedule = user_schedule_index.active_window(user.id, current_time)
 
             if user_schedule:
                 # User has valid schedule, require OTP verification
-                verification_check = twilio_client.verify.v2.services(TWILIO_VERIFY_SID) \
-                    .verification_checks \
-                    .create(to=phone_number, code=otp_code)
+                verification_check = check_sms_otp(phone_number, otp_code, trace_id)
                 
                 if verification_check.status == "approved":
                     new_log = AccessLog(
@@ -702,32 +1139,54 @@ def handle_otp_verification(client, userdata, message):
 
         # Publish the verification response
         response_topic = f"door/otp/response/{phone_number}"
-        mqtt.publish(response_topic, json.dumps(res), qos=1)
+        res["trace_id"] = trace_id
+        with trace_span(f"mqtt publish {response_topic}", "mqtt", trace_id):
+            mqtt.publish(response_topic, json.dumps(res), qos=1)
         print(f"[DEBUG] Published OTP verification result to {response_topic}")
 
 # Resource to manage user schedules
 class UserScheduleAPI(Resource):
+    DEFAULT_PAGE_SIZE = 100
+    MAX_PAGE_SIZE = 500
+
     def get(self):
+        """List schedules, optionally filtered by ?user_id= and ?active=true, paginated by ?page=&per_page="""
         try:
-            schedules = UserSchedule.query.all()
-            schedule_list = [
-                {
-                    "id": schedule.id,
-                    "user_id": schedule.user_id,
-                    "start_date": schedule.start_date.isoformat(),
-                    "end_date": schedule.end_date.isoformat(),
-                    "created_at": schedule.created_at.isoformat()
-                }
-                for schedule in schedules
-            ]
-            return jsonify(schedule_list)
+            user_id = request.args.get("user_id", type=int)
+            active_only = request.args.get("active", "").lower() in ("1", "true", "yes")
+            page = max(request.args.get("page", 1, type=int), 1)
+            per_page = request.args.get("per_page", self.DEFAULT_PAGE_SIZE, type=int)
+            per_page = min(max(per_page, 1), self.MAX_PAGE_SIZE)
+
+            query = UserSchedule.query
+            if user_id is not None:
+                query = query.filter(UserSchedule.user_id == user_id)
+            if active_only:
+                now = to_naive_utc(datetime.now(timezone.utc))
+                query = query.filter(UserSchedule.start_date <= now, UserSchedule.end_date >= now)
+
+            total = query.count()
+            schedules = query.order_by(UserSchedule.start_date) \
+                .offset((page - 1) * per_page) \
+                .limit(per_page) \
+                .all()
+
+            response = jsonify([schedule.to_dict() for schedule in schedules])
+            response.headers["X-Total-Count"] = str(total)
+            response.headers["X-Page"] = str(page)
+            response.headers["X-Per-Page"] = str(per_page)
+            return response
         except Exception as e:
             return {"error": str(e)}, 500
 
     def post(self):
         try:
             data = request.get_json()
-            user_id = data.get("user_id")
+            try:
+                # The index is keyed by integer ids; a string id would miss every overlap
+                user_id = int(data.get("user_id"))
+            except (TypeError, ValueError):
+                return {"error": "user_id must be an integer"}, 400
             start_date = datetime.fromisoformat(data.get("start_date"))
             end_date = datetime.fromisoformat(data.get("end_date"))
 
@@ -740,13 +1199,7 @@ class UserScheduleAPI(Resource):
                 return {"error": "User not found"}, 404
 
             # Check for overlapping schedules
-            existing_schedule = UserSchedule.query.filter(
-                UserSchedule.user_id == user_id,
-                UserSchedule.start_date <= end_date,
-                UserSchedule.end_date >= start_date
-            ).first()
-
-            if existing_schedule:
+            if user_schedule_index.find_overlap(user_id, start_date, end_date) is not None:
                 return {"error": "Schedule overlaps with existing schedule"}, 400
 
             new_schedule = UserSchedule(
@@ -756,14 +1209,9 @@ class UserScheduleAPI(Resource):
             )
             db.session.add(new_schedule)
             db.session.commit()
+            user_schedule_index.add(new_schedule)
 
-            return {
-                "id": new_schedule.id,
-                "user_id": new_schedule.user_id,
-                "start_date": new_schedule.start_date.isoformat(),
-                "end_date": new_schedule.end_date.isoformat(),
-                "created_at": new_schedule.created_at.isoformat()
-            }, 201
+            return new_schedule.to_dict(), 201
 
         except Exception as e:
             return {"error": str(e)}, 500
@@ -782,11 +1230,22 @@ class UserScheduleAPI(Resource):
 
             db.session.delete(schedule)
             db.session.commit()
+            user_schedule_index.remove(schedule)
 
             return {"message": "Schedule deleted successfully"}, 200
 
         except Exception as e:
             return {"error": str(e)}, 500
+
+# Resource to delete expired user schedules
+class UserSchedulePruneAPI(Resource):
+    def post(self):
+        """Delete every schedule that has ended, from the database and the index together"""
+        try:
+            removed = user_schedule_index.prune_expired()
+            return {"message": f"Deleted {removed} expired schedules", "deleted": removed}, 200
+        except Exception as e:
+            return {"error": str(e)}, 500
         
 # MQTT Resource to unlock door with RPI
 class UnlockDoor(Resource):
@@ -831,7 +1290,9 @@ class UnlockDoor(Resource):
         # Send the command to unlock the door
         print(f"[DEBUG] Publishing MQTT message to topic 'door/commands': {command}")
         try:
-            mqtt.publish("door/commands", command, qos=1)
+            # JSON so the Pi can continue the request's trace
+            with trace_span("mqtt publish door/commands", "mqtt"):
+                mqtt.publish("door/commands", json.dumps({"command": command, "trace_id": g.trace_id}), qos=1)
             print(f"[DEBUG] MQTT message published successfully")
         except Exception as e:
             print(f"[ERROR] Failed to publish MQTT message: {str(e)}")
@@ -843,7 +1304,7 @@ class UnlockDoor(Resource):
 class LockDoor(Resource):
     def post(self):
         # Send the lock door command via MQTT
-        mqtt.publish("door/commands", "lock_door")
+        mqtt.publish("door/commands", json.dumps({"command": "lock_door", "trace_id": g.trace_id}))
         return {"message": "Lock door command sent"}, 200
 
 # New resource for logging door access events
@@ -855,11 +1316,12 @@ class LogDoorAccess(Resource):
         method = data.get("method", "Unknown")
         status = data.get("status", "Unknown")
         details = data.get("details", "")
+        clip_url = data.get("clip_url")
         
         # Get user name if available and user is a phone number
         user_name = None
         if user != "Schedule System":
-            user_obj = User.query.filter_by(phone_number=user).first()
+            user_obj = user_cache.get(user)
             if user_obj:
                 user_name = user_obj.name
         
@@ -868,7 +1330,8 @@ class LogDoorAccess(Resource):
             user=user,
             user_name=user_name,
             method=method,
-            status=status
+            status=status,
+            clip_url=clip_url
         )
         
         try:
@@ -887,6 +1350,7 @@ class RegisterFaceAPI(Resource):
         face_encoding_base64 = data.get("face_encoding")
         name = data.get("name", "")  # Get name with empty string as default
         is_additional = data.get("is_additional", False) # Flag to indicate if this is an additional encoding
+        encoder = data.get("encoder") or DEFAULT_FACE_ENCODER # Encoder that produced the encoding
         
         if not phone_number or not face_encoding_base64:
             return {"error": "Phone number and face encoding required"}, 400
@@ -897,9 +1361,17 @@ class RegisterFaceAPI(Resource):
             
             if user:
                 # Update existing user
+                current_encoder = user.face_encoder or DEFAULT_FACE_ENCODER
+                encoder_changed = bool(user.face_encodings) and current_encoder != encoder
+                if encoder_changed and is_additional:
+                    # Encodings from different encoders can't be compared, so never mix them
+                    return {"error": f"User's face gallery uses the {current_encoder} encoder, not {encoder}"}, 409
                 
                 # If this is legacy data, migrate it
-                if is_additional or user.face_encodings:
+                if encoder_changed:
+                    # Re-registration with a new encoder replaces the old gallery
+                    user.face_encodings = json.dumps([face_encoding_base64])
+                elif is_additional or user.face_encodings:
                     # Handle multiple encodings case - store as JSON
                     
                     # Load existing encodings if any
@@ -924,8 +1396,10 @@ class RegisterFaceAPI(Resource):
                 if name and (user.name is None or user.name == ""):
                     user.name = name
                     
+                user.face_encoder = encoder
                 user.face_registered = True
                 db.session.commit()
+                user_cache.invalidate(phone_number)
                 
                 # Log the update
                 status = "Updated (Added Face)" if is_additional else "Updated"
@@ -946,10 +1420,12 @@ class RegisterFaceAPI(Resource):
                     phone_number=phone_number,
                     is_allowed=False,  # Require admin approval
                     face_encodings=json.dumps([face_encoding_base64]),  # Store as JSON array
+                    face_encoder=encoder,
                     face_registered=True
                 )
                 db.session.add(new_user)
                 db.session.commit()
+                user_cache.invalidate(phone_number)
                 
                 # Log the registration
                 log = AccessLog(
@@ -983,7 +1459,8 @@ class GetFaceDataAPI(Resource):
                         for encoding in encodings_list:
                             face_data.append({
                                 "phone_number": user.phone_number,
-                                "face_encoding": encoding
+                                "face_encoding": encoding,
+                                "encoder": user.face_encoder or DEFAULT_FACE_ENCODER
                             })
                     except Exception as e:
                         print(f"Error parsing face encodings for user {user.phone_number}: {e}")
@@ -1037,7 +1514,8 @@ class GetUserEncodingsAPI(Resource):
                                     "phone_number": user.phone_number,
                                     "is_allowed": user.is_allowed,  # Include approval status
                                     "low_security": getattr(user, "low_security", False),  # Handle existing users safely
-                                    "face_encoding": processed_encodings[0]  # Just use the first encoding for now
+                                    "face_encoding": processed_encodings[0],  # Just use the first encoding for now
+                                    "encoder": user.face_encoder or DEFAULT_FACE_ENCODER
                                 })
                     except Exception as e:
                         print(f"Error processing encodings for user {user.phone_number}: {e}")
@@ -1059,11 +1537,13 @@ api.add_resource(StartVerificationRPI, "/start-verification")
 api.add_resource(CheckVerificationRPI, "/check-verification-RPI")
 api.add_resource(UnlockDoor, '/unlock')
 api.add_resource(ScheduleAPI, "/schedule")
+api.add_resource(ScheduleStatusAPI, "/schedule/status")
 api.add_resource(GetAccessLogs, "/access-logs")
 api.add_resource(DoorEntryAPI, "/door-entry")
 api.add_resource(UserManagementAPI, "/users")
 api.add_resource(UpdateUserNameAPI, "/update-user-name")
 api.add_resource(UserScheduleAPI, '/user-schedule')
+api.add_resource(UserSchedulePruneAPI, '/user-schedule/prune')
 api.add_resource(LockDoor, '/lock')
 api.add_resource(LogDoorAccess, '/log-door-access')
 api.add_resource(RegisterFaceAPI, '/register-face')
@@ -1,5 +1,5 @@
 import React, { useState, useCallback } from "react";
-import { View, FlatList, Text, StyleSheet, ActivityIndicator, Alert } from "react-native";
+import { View, FlatList, Text, StyleSheet, ActivityIndicator, Alert, Linking } from "react-native";
 import { useFocusEffect } from "@react-navigation/native";
 
 const backendIP = process.env.EXPO_PUBLIC_BACKEND_IP;
@@ -11,6 +11,7 @@ type AccessLog = {
   method: string;
   status: string;
   timestamp: string;
+  clip_url: string | null;
 };
 
 export default function AccessLogs() {
@@ -59,6 +60,11 @@ export default function AccessLogs() {
               {item.method} - {item.status}
             </Text>
             <Text style={styles.timestamp}>{new Date(item.timestamp).toLocaleString()}</Text>
+            {item.clip_url && (
+              <Text style={styles.clipLink} onPress={() => Linking.openURL(item.clip_url as string)}>
+                View clip
+              </Text>
+            )}
           </View>
         )}
       />
@@ -97,4 +103,9 @@ const styles = StyleSheet.create({
     fontSize: 12,
     color: "#888",
   },
+  clipLink: {
+    marginTop: 8,
+    fontSize: 14,
+    color: "#007AFF",
+  },
 });
\ No newline at end of file
@@ -0,0 +1,133 @@
+"""
+Burst liveness evaluation for the recognition pipeline.
+Liveness-checks the same face in every frame of a capture burst on a small
+worker pool and combines the per-frame verdicts with a voting or mean-score
+rule. Also measures how much the face changes between frames: a printed photo
+or a still image on a screen shows (almost) no inter-frame gradient variance,
+while a live face always moves a little.
+"""
+import math
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from camera_config import (
+    LIVENESS_BURST_RULE, LIVENESS_VOTE_RATIO, LIVENESS_MEAN_THRESHOLD,
+    LIVENESS_MIN_TEMPORAL_VARIANCE, LIVENESS_BURST_WORKERS
+)
+from frame_context import FrameContext
+
+logger = logging.getLogger("BurstLiveness")
+
+# Side length the face ROIs are resized to before comparing them across frames
+TEMPORAL_SIZE = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """Create the shared liveness worker threads on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=LIVENESS_BURST_WORKERS, thread_name_prefix="Liveness")
+        return _pool
+
+
+def _check_one(liveness_detector, frame, location):
+    try:
+        return liveness_detector.check_face_liveness(frame, location)
+    except Exception as e:
+        logger.error(f"Error during liveness check: {e}")
+        return {"is_live": False, "error": str(e)}
+
+
+def temporal_gradient_variance(samples):
+    """
+    Mean per-pixel variance of the face's gradient magnitude across frames.
+
+    Args:
+        samples: List of (frame or FrameContext, face location) pairs
+
+    Returns:
+        float: The variance, or None if fewer than two faces could be compared
+    """
+    magnitudes = []
+    for frame, location in samples:
+        roi = FrameContext.of(frame).roi(location, "gray")
+        if roi is None or roi.size == 0:
+            continue
+        roi = cv2.resize(roi, (TEMPORAL_SIZE, TEMPORAL_SIZE), interpolation=cv2.INTER_AREA)
+        # Blur first so sensor noise alone doesn't look like movement
+        roi = cv2.GaussianBlur(roi, (3, 3), 0).astype(np.float32)
+        sobelx = cv2.Sobel(roi, cv2.CV_32F, 1, 0, ksize=3)
+        sobely = cv2.Sobel(roi, cv2.CV_32F, 0, 1, ksize=3)
+        magnitudes.append(cv2.magnitude(sobelx, sobely))
+    if len(magnitudes) < 2:
+        return None
+    return float(np.var(np.stack(magnitudes), axis=0).mean())
+
+
+def check_burst_liveness(samples, liveness_detector, known_results=None, rule=None):
+    """
+    Liveness-check one face across a burst of frames.
+
+    Args:
+        samples: List of (frame or FrameContext, face location) pairs, best face first
+        liveness_detector: LivenessDetector to use
+        known_results: Optional dict of sample index -> liveness result already computed
+        rule: "vote" or "mean"; defaults to LIVENESS_BURST_RULE
+
+    Returns:
+        dict: Liveness result for the burst. The best face's metrics are kept
+              alongside the burst fields (frames_checked, frames_live,
+              confidence_score, temporal_gradient_variance, rule)
+    """
+    rule = (rule or LIVENESS_BURST_RULE).lower()
+    if rule not in ("vote", "mean"):
+        logger.warning(f"Unknown liveness burst rule '{rule}', using vote")
+        rule = "vote"
+    if not samples:
+        return {"is_live": False, "error": "No faces to check"}
+    known_results = known_results or {}
+
+    pool = _get_pool()
+    futures = {
+        index: pool.submit(_check_one, liveness_detector, frame, location)
+        for index, (frame, location) in enumerate(samples)
+        if index not in known_results
+    }
+    temporal_future = pool.submit(temporal_gradient_variance, samples)
+    results = [known_results[index] if index in known_results else futures[index].result()
+               for index in range(len(samples))]
+    temporal_variance = temporal_future.result()
+
+    frames_live = sum(1 for result in results if result.get("is_live", False))
+    mean_confidence = sum(float(result.get("confidence_score", 1.0 if result.get("is_live") else 0.0))
+                          for result in results) / len(results)
+    if rule == "mean":
+        frames_ok = mean_confidence >= LIVENESS_MEAN_THRESHOLD
+    else:
+        frames_ok = frames_live >= math.ceil(LIVENESS_VOTE_RATIO * len(results))
+    temporal_ok = temporal_variance is None or temporal_variance >= LIVENESS_MIN_TEMPORAL_VARIANCE
+
+    burst = {key: value for key, value in results[0].items() if isinstance(value, float)}
+    burst.update({
+        "is_live": bool(frames_ok and temporal_ok),
+        "rule": rule,
+        "frames_checked": len(results),
+        "frames_live": frames_live,
+        "confidence_score": mean_confidence,
+        "temporal_gradient_variance": temporal_variance
+    })
+    if not frames_ok:
+        burst["rejected_by"] = rule
+    elif not temporal_ok:
+        burst["rejected_by"] = "temporal"
+
+    temporal_text = f"{temporal_variance:.2f}" if temporal_variance is not None else "n/a"
+    logger.info(f"Burst liveness ({rule}): {frames_live}/{len(results)} frames live, "
+                f"mean confidence={mean_confidence:.2f}, temporal variance={temporal_text}, live={burst['is_live']}")
+    return burst
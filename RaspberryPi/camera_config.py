@@ -2,6 +2,7 @@
 Camera configuration for face recognition system.
 This file contains settings related to the camera setup.
 """
+import os
 
 # The camera index to use (0 is usually the built-in webcam)
 # This value might need adjustment based on your specific hardware setup
@@ -11,6 +12,91 @@ CAMERA_INDEX = 0
 MIN_FACE_WIDTH = 100  # Minimum width in pixels
 MIN_FACE_HEIGHT = 100  # Minimum height in pixels
 
+# Face detector backend: "hog" (dlib HOG), "haar" (OpenCV Haar cascade),
+# "dnn" (OpenCV DNN SSD, needs the model files below) or "cascade"
+# (Haar prefilter followed by dlib HOG on the candidate regions)
+FACE_DETECTOR_BACKEND = "cascade"
+
+# Face detection cascade: a Haar prefilter runs on the frame downscaled by
+# DETECTION_SCALE, then dlib HOG runs on each candidate region expanded by
+# DETECTION_ROI_MARGIN, upsampling at most DETECTION_MAX_UPSAMPLE times
+DETECTION_SCALE = 0.5
+DETECTION_ROI_MARGIN = 0.3
+DETECTION_MAX_UPSAMPLE = 2
+
+# OpenCV DNN face detector (ResNet-10 SSD), see models/README.md
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+DNN_DETECTOR_MODEL = os.path.join(MODELS_DIR, "res10_300x300_ssd_iter_140000_fp16.caffemodel")
+DNN_DETECTOR_CONFIG = os.path.join(MODELS_DIR, "deploy.prototxt")
+DNN_DETECTOR_CONFIDENCE = 0.6
+
+# Face encoder: "dlib_resnet" (default) or "openface" (OpenFace nn4.small2
+# through OpenCV DNN, see models/README.md). Galleries are tagged with the
+# encoder that produced them; switching encoders requires users to re-register.
+FACE_ENCODER_BACKEND = "dlib_resnet"
+DNN_ENCODER_MODEL = os.path.join(MODELS_DIR, "nn4.small2.v1.t7")
+DNN_ENCODER_INPUT_SIZE = 96
+DNN_ENCODER_TOLERANCE = 0.8
+
+# Staged recognition pipeline: "thread" runs detection and encoding on threads
+# in the web process, "process" on worker processes (use if the installed dlib
+# build holds the GIL). Queues between stages hold PIPELINE_QUEUE_SIZE items
+# and drop the oldest one when full. Before the camera is released, the capture
+# stage gets PIPELINE_STOP_TIMEOUT seconds to finish its current read.
+PIPELINE_EXECUTOR = "thread"
+PIPELINE_DETECT_WORKERS = 2
+PIPELINE_ANALYSIS_WORKERS = 2
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_CAPTURE_FPS = 15
+PIPELINE_STOP_TIMEOUT = 2.0
+
+# Number of frames (the best one plus the next best views of the same person)
+# whose encodings are fused into one embedding before matching; 1 disables fusion
+FUSION_FRAMES = 3
+
+# Side length (pixels) every face ROI is resized to before the liveness checks,
+# close to the typical face size at the door so the tuned thresholds still apply
+LIVENESS_ANALYSIS_SIZE = 160
+
+# Burst liveness: every frame of the burst showing the person is liveness-checked
+# on LIVENESS_BURST_WORKERS threads and the results combined by LIVENESS_BURST_RULE:
+# "vote" needs at least LIVENESS_VOTE_RATIO of the frames to pass, "mean" needs
+# the average confidence score to reach LIVENESS_MEAN_THRESHOLD. The face must
+# also change between frames by at least LIVENESS_MIN_TEMPORAL_VARIANCE (mean
+# per-pixel variance of the gradient magnitude), which a still photo can't do.
+LIVENESS_BURST_RULE = "vote"
+LIVENESS_VOTE_RATIO = 0.5
+LIVENESS_MEAN_THRESHOLD = 0.75
+LIVENESS_MIN_TEMPORAL_VARIANCE = 4.0
+LIVENESS_BURST_WORKERS = 2
+# Frames read by run_face_recognition for the burst liveness check
+LIVENESS_BURST_FRAMES = 4
+
+# Face tracking on the live feed: full detection runs every TRACKER_DETECT_INTERVAL
+# frames, or sooner when a track's correlation score drops below
+# TRACKER_MIN_CONFIDENCE. In between, faces are followed by template matching on
+# the frame downscaled by TRACKER_SCALE. A track missing from TRACKER_MAX_MISSES
+# detections in a row is dropped.
+TRACKER_DETECT_INTERVAL = 5
+TRACKER_SCALE = 0.5
+TRACKER_MIN_CONFIDENCE = 0.6
+TRACKER_MAX_MISSES = 2
+
+# Hands-free mode: watch the camera in the background and recognize people
+# without the kiosk button. While idle, frames are read at HANDS_FREE_IDLE_FPS
+# and compared at HANDS_FREE_MOTION_WIDTH pixels wide; motion is a change of more
+# than HANDS_FREE_PIXEL_DELTA gray levels in at least HANDS_FREE_MOTION_THRESHOLD
+# of the pixels. Motion escalates to face tracking at HANDS_FREE_ACTIVE_FPS, and
+# a tracked face of at least MIN_FACE_WIDTH x MIN_FACE_HEIGHT to recognition.
+# After HANDS_FREE_IDLE_TIMEOUT seconds without motion or faces it drops back to idle.
+HANDS_FREE_ENABLED = False
+HANDS_FREE_IDLE_FPS = 2
+HANDS_FREE_ACTIVE_FPS = 8
+HANDS_FREE_MOTION_WIDTH = 160
+HANDS_FREE_PIXEL_DELTA = 25
+HANDS_FREE_MOTION_THRESHOLD = 0.01
+HANDS_FREE_IDLE_TIMEOUT = 10.0
+
 # Camera resolution for face recognition
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
@@ -19,4 +105,65 @@ CAMERA_HEIGHT = 480
 DISPLAY_FRAMES = 75
 
 # Minimum number of blinks required for liveness detection
-MIN_BLINKS_REQUIRED = 2 
\ No newline at end of file
+MIN_BLINKS_REQUIRED = 2
+
+# Blink liveness on the live video feed: an eye counts as closed while its eye
+# aspect ratio is below BLINK_EAR_THRESHOLD; closures longer than
+# BLINK_MAX_CLOSED_FRAMES frames are not blinks. A face that blinked
+# MIN_BLINKS_REQUIRED times within DISPLAY_FRAMES frames is live, and that
+# verdict satisfies liveness for recognition attempts started within
+# BLINK_VERDICT_MAX_AGE seconds whose recognized face overlaps the blinking
+# face's last tracked box by at least BLINK_VERDICT_MIN_IOU.
+BLINK_EAR_THRESHOLD = 0.21
+BLINK_MAX_CLOSED_FRAMES = 8
+BLINK_VERDICT_MAX_AGE = 10.0
+BLINK_VERDICT_MIN_IOU = 0.3
+
+# Recognition jobs: finished attempts (and their results) are kept for
+# JOB_RESULT_TTL seconds, and at most MAX_STORED_JOBS of them. A superseded
+# attempt is cancelled at its next checkpoint; its successor waits up to
+# JOB_SUPERSEDE_WAIT seconds for it to stop before using the camera.
+JOB_RESULT_TTL = 300
+MAX_STORED_JOBS = 20
+JOB_SUPERSEDE_WAIT = 5.0
+
+# End-to-end deadline of a recognition attempt in seconds, from the button press
+# to the result. Frame capture stops early enough to leave
+# DEADLINE_ANALYSIS_RESERVE seconds for encoding, liveness and matching, and no
+# backend request is started with less than BACKEND_MIN_TIMEOUT seconds left.
+RECOGNITION_DEADLINE = 5.0
+DEADLINE_ANALYSIS_RESERVE = 1.5
+BACKEND_MIN_TIMEOUT = 0.5
+
+# Debug frames are JPEG-encoded at DEBUG_JPEG_QUALITY and written in the
+# background; at most DEBUG_QUEUE_SIZE frames wait to be written (more are
+# dropped). static/debug_frames is kept within DEBUG_MAX_FILES files and
+# DEBUG_MAX_BYTES bytes, oldest deleted first. The last PREVIEW_STORE_SIZE
+# preview frames are kept in memory only.
+DEBUG_JPEG_QUALITY = 80
+DEBUG_QUEUE_SIZE = 8
+DEBUG_MAX_FILES = 200
+DEBUG_MAX_BYTES = 50 * 1024 * 1024
+PREVIEW_STORE_SIZE = 4
+
+# Incident clips: camera frames are sampled at INCIDENT_FPS, downscaled to
+# INCIDENT_WIDTH pixels wide and kept as JPEGs (INCIDENT_JPEG_QUALITY) for the
+# last INCIDENT_PRE_SECONDS. On a denial, failed liveness check or unlock by
+# command, those frames and the next INCIDENT_POST_SECONDS are written to one
+# clip; only the newest INCIDENT_MAX_CLIPS clips are kept.
+INCIDENT_FPS = 5
+INCIDENT_PRE_SECONDS = 5.0
+INCIDENT_POST_SECONDS = 3.0
+INCIDENT_WIDTH = 320
+INCIDENT_JPEG_QUALITY = 60
+INCIDENT_MAX_CLIPS = 50
+
+# Latency metrics (served at /metrics): quantiles are computed over the last
+# METRICS_WINDOW samples of each stage
+METRICS_WINDOW = 1000
+METRICS_QUANTILES = (0.5, 0.95, 0.99)
+
+# Tracing: spans of each door entry are appended to traces/pi_trace.json in the
+# Chrome trace format; past TRACE_MAX_BYTES the file is rotated to .1
+TRACE_ENABLED = True
+TRACE_MAX_BYTES = 20 * 1024 * 1024
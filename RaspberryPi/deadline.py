@@ -0,0 +1,88 @@
+"""
+End-to-end deadlines for recognition attempts.
+A Deadline is created when an attempt starts and handed to every stage, which
+derives its own timeouts, sleeps and retry decisions from the time that is left
+instead of using fixed per-stage timeouts that add up. A stage that runs out of
+budget either degrades (e.g. fuses fewer frames) or raises DeadlineExceeded.
+"""
+import time
+import logging
+
+logger = logging.getLogger("Deadline")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage can't finish within the attempt's deadline"""
+
+
+class Deadline:
+    """Fixed point in time by which a recognition attempt must respond"""
+
+    def __init__(self, budget):
+        """
+        Args:
+            budget: Seconds from now until the deadline
+        """
+        self.budget = float(budget)
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + self.budget
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def remaining(self):
+        """Seconds left before the deadline (never negative)"""
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    @property
+    def expired(self):
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap=None):
+        """
+        Timeout for a blocking call made now.
+
+        Args:
+            cap: Optional upper bound, e.g. a request's usual timeout
+
+        Returns:
+            float: The remaining budget, limited to cap
+        """
+        remaining = self.remaining()
+        return remaining if cap is None else min(remaining, cap)
+
+    def reserve(self, seconds):
+        """
+        Earlier deadline for a stage that must leave time for the stages after it.
+
+        Args:
+            seconds: Time to keep in reserve for later stages
+
+        Returns:
+            Deadline: Expires `seconds` before this one (or now, if less is left)
+        """
+        return Deadline(max(self.remaining() - seconds, 0.0))
+
+    def sleep(self, seconds):
+        """
+        Sleep without overrunning the deadline.
+
+        Returns:
+            bool: True if there is budget left after sleeping
+        """
+        time.sleep(min(seconds, self.remaining()))
+        return not self.expired
+
+    def check(self, stage):
+        """
+        Raise if the deadline has passed.
+
+        Args:
+            stage: Name of the stage about to start, for the error message
+
+        Raises:
+            DeadlineExceeded: If no budget is left
+        """
+        if self.expired:
+            logger.warning(f"Deadline of {self.budget:.1f}s exceeded before {stage}")
+            raise DeadlineExceeded(f"Recognition deadline of {self.budget:.1f}s exceeded before {stage}")
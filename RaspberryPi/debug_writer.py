@@ -0,0 +1,185 @@
+"""
+Asynchronous debug-frame writer and in-memory preview store.
+Debug frames are JPEG-encoded and written to the SD card by a background thread,
+so recognition and request handlers never wait on disk I/O. The writer's queue is
+bounded: under load new frames are dropped rather than delaying the caller. The
+debug directory is kept within DEBUG_MAX_FILES files and DEBUG_MAX_BYTES bytes by
+deleting the oldest frames. Preview frames are only ever shown once, so they are
+kept in memory and never touch the card.
+"""
+import os
+import glob
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+import cv2
+from camera_config import DEBUG_JPEG_QUALITY, DEBUG_MAX_FILES, DEBUG_MAX_BYTES, DEBUG_QUEUE_SIZE, PREVIEW_STORE_SIZE
+
+logger = logging.getLogger("DebugWriter")
+
+DEBUG_FRAMES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static', 'debug_frames')
+
+
+def encode_jpeg(image, quality=DEBUG_JPEG_QUALITY):
+    """
+    JPEG-encode an image.
+
+    Args:
+        image: OpenCV BGR image
+        quality: JPEG quality (0-100)
+
+    Returns:
+        bytes: The encoded image, or None if encoding failed
+    """
+    ok, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return buffer.tobytes() if ok else None
+
+
+class DebugFrameWriter:
+    """Background JPEG writer with a bounded queue and a disk quota"""
+
+    def __init__(self, directory=DEBUG_FRAMES_DIR, quality=DEBUG_JPEG_QUALITY, max_files=DEBUG_MAX_FILES,
+                 max_bytes=DEBUG_MAX_BYTES, queue_size=DEBUG_QUEUE_SIZE):
+        self.directory = directory
+        self.quality = quality
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._files = deque()  # (path, size) of written frames, oldest first
+        self._total_bytes = 0
+        self.written = 0
+        self.dropped = 0
+        self._scan_existing()
+        self._thread = threading.Thread(target=self._run, name="DebugWriter", daemon=True)
+        self._thread.start()
+
+    def _scan_existing(self):
+        """Take over frames left by earlier runs so they count against the quota"""
+        os.makedirs(self.directory, exist_ok=True)
+        existing = []
+        for path in glob.glob(os.path.join(self.directory, '*.jpg')):
+            try:
+                stat = os.stat(path)
+                existing.append((stat.st_mtime, path, stat.st_size))
+            except OSError:
+                continue
+        for _, path, size in sorted(existing):
+            self._files.append((path, size))
+            self._total_bytes += size
+        self._prune()
+
+    def save(self, image, filename):
+        """
+        Queue a frame for writing.
+
+        The writer keeps a reference to the image, so it must not be modified afterwards.
+
+        Args:
+            image: OpenCV BGR image
+            filename: File name inside the debug directory, or a full path
+
+        Returns:
+            str: The path the frame will be written to, or None if it was dropped
+        """
+        path = filename if os.path.dirname(filename) else os.path.join(self.directory, filename)
+        try:
+            self._queue.put_nowait((image, path))
+        except queue.Full:
+            self.dropped += 1
+            logger.warning(f"Debug writer busy, dropped {os.path.basename(path)} ({self.dropped} dropped so far)")
+            return None
+        return path
+
+    def _run(self):
+        while True:
+            image, path = self._queue.get()
+            try:
+                self._write(image, path)
+            except Exception as e:
+                logger.error(f"Error writing debug frame {path}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, image, path):
+        data = encode_jpeg(image, self.quality)
+        if data is None:
+            logger.error(f"Could not encode debug frame {path}")
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output:
+            output.write(data)
+        self._files.append((path, len(data)))
+        self._total_bytes += len(data)
+        self.written += 1
+        logger.info(f"Saved debug frame to {path}")
+        self._prune()
+
+    def _prune(self):
+        """Delete the oldest frames until the directory is within its quota"""
+        while self._files and (len(self._files) > self.max_files or self._total_bytes > self.max_bytes):
+            path, size = self._files.popleft()
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def flush(self, timeout=None):
+        """Wait until every queued frame has been written (mainly for shutdown)"""
+        with self._queue.all_tasks_done:
+            if self._queue.unfinished_tasks:
+                self._queue.all_tasks_done.wait(timeout)
+
+    def stats(self):
+        return {
+            "files": len(self._files),
+            "bytes": self._total_bytes,
+            "written": self.written,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize()
+        }
+
+
+class PreviewStore:
+    """The most recent preview frames as JPEG bytes, kept in memory"""
+
+    def __init__(self, size=PREVIEW_STORE_SIZE, quality=DEBUG_JPEG_QUALITY):
+        self.size = size
+        self.quality = quality
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, name, image):
+        """
+        Encode and store a preview frame, evicting the oldest beyond the store size.
+
+        Returns:
+            bool: True if the frame could be encoded
+        """
+        data = encode_jpeg(image, self.quality)
+        if data is None:
+            return False
+        with self._lock:
+            self._frames[name] = data
+            while len(self._frames) > self.size:
+                self._frames.popitem(last=False)
+        return True
+
+    def get(self, name):
+        """JPEG bytes of a stored preview frame, or None"""
+        with self._lock:
+            return self._frames.get(name)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_debug_writer():
+    """Shared debug writer, started on first use"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DebugFrameWriter()
+        return _writer
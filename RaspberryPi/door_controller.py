@@ -1,32 +1,66 @@
 import RPi.GPIO as GPIO
 from threading import Timer
+from metrics import stage_metrics
 
 class DoorController:
     def __init__(self, door_pin=17):
         self.door_pin = door_pin
+        self.held_open = False  # True while the schedule keeps the door unlocked
+        self.on_hold_ended = None  # Called when a manual lock ends a schedule hold
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.door_pin, GPIO.OUT)
 
     def unlock_door(self, duration=10):
         print("[DEBUG] Unlocking door...")
         try:
-            GPIO.output(self.door_pin, GPIO.HIGH)  # Activate door relay
+            with stage_metrics.time("relay_actuation"):
+                GPIO.output(self.door_pin, GPIO.HIGH)  # Activate door relay
             print("[DEBUG] Door unlocked - GPIO pin set to HIGH")
             
             # Schedule the door to lock after the specified duration
             print(f"[DEBUG] Scheduling door to lock after {duration} seconds")
-            Timer(duration, self.lock_door).start()
+            Timer(duration, self._auto_lock).start()
             print(f"[DEBUG] Lock timer started")
         except Exception as e:
             print(f"[ERROR] Failed to unlock door: {str(e)}")
 
     def lock_door(self):
+        """Lock the door now; a manual lock during a schedule hold also ends the hold"""
+        if self.held_open:
+            self.held_open = False
+            print("[DEBUG] Manual lock ends the schedule hold")
+            if self.on_hold_ended is not None:
+                self.on_hold_ended()
+        self._lock_relay()
+
+    def _lock_relay(self):
         try:
             GPIO.output(self.door_pin, GPIO.LOW)  # Deactivate door relay
             print("[DEBUG] Door locked - GPIO pin set to LOW")
         except Exception as e:
             print(f"[ERROR] Failed to lock door: {str(e)}")
 
+    def _auto_lock(self):
+        # Don't let a visitor's unlock timer re-lock a door the schedule holds open
+        if self.held_open:
+            print("[DEBUG] Skipping auto-lock - door is held open by schedule")
+            return
+        self._lock_relay()
+
+    def hold_open(self):
+        """Keep the door unlocked until release_hold() is called"""
+        self.held_open = True
+        try:
+            GPIO.output(self.door_pin, GPIO.HIGH)
+            print("[DEBUG] Door held open - GPIO pin set to HIGH")
+        except Exception as e:
+            print(f"[ERROR] Failed to hold door open: {str(e)}")
+
+    def release_hold(self):
+        """End a schedule hold and lock the door"""
+        self.held_open = False
+        self._lock_relay()
+
     def cleanup(self):
         GPIO.cleanup()
         print("[DEBUG] GPIO cleanup completed") 
\ No newline at end of file
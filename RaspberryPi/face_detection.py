@@ -0,0 +1,270 @@
+"""
+Face detection backends for the recognition pipeline.
+Every backend implements the same FaceDetector interface and records its own
+timing, so the detector can be chosen per device through FACE_DETECTOR_BACKEND
+in camera_config.py without code changes:
+
+- hog:     dlib HOG through face_recognition (accurate, slowest on the Pi)
+- haar:    OpenCV Haar cascade shipped with cv2 (fastest, more false positives)
+- dnn:     OpenCV DNN ResNet-10 SSD loaded from the vendored model files
+- cascade: Haar prefilter on a downscaled frame, dlib HOG on candidate ROIs
+"""
+import os
+import time
+import logging
+import cv2
+import numpy as np
+import face_recognition
+from frame_context import FrameContext
+from camera_config import (
+    FACE_DETECTOR_BACKEND, DETECTION_SCALE, DETECTION_ROI_MARGIN, DETECTION_MAX_UPSAMPLE,
+    DNN_DETECTOR_MODEL, DNN_DETECTOR_CONFIG, DNN_DETECTOR_CONFIDENCE, MIN_FACE_WIDTH
+)
+
+logger = logging.getLogger("FaceDetection")
+
+# Number of recent detections kept for the rolling timing average
+TIMING_WINDOW = 50
+
+
+def box_iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    if bottom <= top or right <= left:
+        return 0.0
+    intersection = (bottom - top) * (right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    return intersection / float(area_a + area_b - intersection)
+
+
+def _dedupe(boxes, threshold=0.5):
+    """Drop boxes that overlap an earlier box by more than the IoU threshold"""
+    kept = []
+    for box in boxes:
+        if all(box_iou(box, existing) < threshold for existing in kept):
+            kept.append(box)
+    return kept
+
+
+class FaceDetector:
+    """
+    Common interface for face detectors.
+    Subclasses implement _detect(); detect() wraps it with timing.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.last_detection_time = None
+        self.detection_count = 0
+        self._recent_times = []
+
+    def detect(self, frame):
+        """
+        Detect faces in a BGR frame.
+
+        Args:
+            frame: OpenCV BGR image or FrameContext
+
+        Returns:
+            list: Face locations as (top, right, bottom, left) in frame coordinates
+        """
+        if frame is None:
+            return []
+        context = FrameContext.of(frame)
+        if context.frame is None or context.frame.size == 0:
+            return []
+        start = time.perf_counter()
+        try:
+            return self._detect(context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.last_detection_time = elapsed
+            self.detection_count += 1
+            self._recent_times.append(elapsed)
+            if len(self._recent_times) > TIMING_WINDOW:
+                self._recent_times.pop(0)
+
+    def _detect(self, context):
+        raise NotImplementedError
+
+    @property
+    def average_detection_time(self):
+        if not self._recent_times:
+            return None
+        return sum(self._recent_times) / len(self._recent_times)
+
+    def timing_stats(self):
+        """Return timing information for this backend in milliseconds"""
+        last = self.last_detection_time
+        average = self.average_detection_time
+        return {
+            "backend": self.name,
+            "detections": self.detection_count,
+            "last_ms": round(last * 1000, 1) if last is not None else None,
+            "average_ms": round(average * 1000, 1) if average is not None else None
+        }
+
+
+class HogFaceDetector(FaceDetector):
+    """dlib HOG detector through face_recognition"""
+    name = "hog"
+
+    def __init__(self, upsample=1):
+        super().__init__()
+        self.upsample = upsample
+
+    def _detect(self, context):
+        return face_recognition.face_locations(context.rgb, number_of_times_to_upsample=self.upsample, model="hog")
+
+
+class HaarFaceDetector(FaceDetector):
+    """OpenCV Haar cascade using the frontal face model shipped with cv2"""
+    name = "haar"
+
+    def __init__(self, scale=DETECTION_SCALE, min_size=None):
+        super().__init__()
+        if not hasattr(cv2, "CascadeClassifier"):
+            raise RuntimeError("This OpenCV build does not provide CascadeClassifier")
+        self.classifier = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+        if self.classifier.empty():
+            raise RuntimeError("Haar cascade haarcascade_frontalface_default.xml could not be loaded")
+        self.scale = scale
+        if min_size is None:
+            # Allow faces down to half the minimum usable size at this scale
+            min_side = max(int(MIN_FACE_WIDTH * scale * 0.5), 20)
+            min_size = (min_side, min_side)
+        self.min_size = min_size
+
+    def _detect(self, context):
+        gray = context.cached(("equalized", self.scale), lambda: cv2.equalizeHist(context.small(self.scale, "gray")))
+        boxes = self.classifier.detectMultiScale(gray, scaleFactor=1.15, minNeighbors=3, minSize=self.min_size)
+        return [
+            (int(y / self.scale), int((x + w) / self.scale), int((y + h) / self.scale), int(x / self.scale))
+            for (x, y, w, h) in boxes
+        ]
+
+
+class DnnFaceDetector(FaceDetector):
+    """OpenCV DNN ResNet-10 SSD face detector (300x300 Caffe model)"""
+    name = "dnn"
+
+    def __init__(self, model_path=DNN_DETECTOR_MODEL, config_path=DNN_DETECTOR_CONFIG, confidence=DNN_DETECTOR_CONFIDENCE):
+        super().__init__()
+        for path in (model_path, config_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"DNN face detector file not found: {path}")
+        self.net = cv2.dnn.readNetFromCaffe(config_path, model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence = confidence
+
+    def _detect(self, context):
+        height, width = context.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(context.frame, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        detections = self.net.forward()
+
+        boxes = []
+        for i in range(detections.shape[2]):
+            if detections[0, 0, i, 2] < self.confidence:
+                continue
+            x1, y1, x2, y2 = detections[0, 0, i, 3:7] * np.array([width, height, width, height])
+            top, left = max(int(y1), 0), max(int(x1), 0)
+            bottom, right = min(int(y2), height), min(int(x2), width)
+            if bottom > top and right > left:
+                boxes.append((top, right, bottom, left))
+        return boxes
+
+
+class CascadeFaceDetector(FaceDetector):
+    """Haar prefilter on a downscaled frame followed by dlib HOG on candidate ROIs"""
+    name = "cascade"
+
+    def __init__(self, scale=DETECTION_SCALE, roi_margin=DETECTION_ROI_MARGIN, max_upsample=DETECTION_MAX_UPSAMPLE):
+        super().__init__()
+        self.scale = scale
+        self.roi_margin = roi_margin
+        self.max_upsample = max_upsample
+        try:
+            self.prefilter = HaarFaceDetector(scale=scale)
+        except RuntimeError as e:
+            logger.warning(f"Haar prefilter unavailable ({e}); detection will fall back to dlib HOG only")
+            self.prefilter = None
+
+    def _detect(self, context):
+        candidates = self.prefilter._detect(context) if self.prefilter is not None else []
+
+        faces = []
+        for candidate in candidates:
+            faces.extend(self._refine(context, candidate))
+        if faces:
+            return _dedupe(faces)
+
+        # Nothing confirmed from the prefilter: run HOG on the downscaled frame,
+        # escalating upsampling only while nothing has been found
+        small_rgb = context.small(self.scale, "rgb")
+        for upsample in range(1, self.max_upsample + 1):
+            locations = face_recognition.face_locations(small_rgb, number_of_times_to_upsample=upsample, model="hog")
+            if locations:
+                return [self._scale_up(location, context.shape) for location in locations]
+        return []
+
+    def _refine(self, context, candidate):
+        """Run dlib HOG on an expanded ROI around a candidate box"""
+        top, right, bottom, left = candidate
+        margin_y = int((bottom - top) * self.roi_margin)
+        margin_x = int((right - left) * self.roi_margin)
+        roi_top = max(top - margin_y, 0)
+        roi_left = max(left - margin_x, 0)
+        roi_bottom = min(bottom + margin_y, context.shape[0])
+        roi_right = min(right + margin_x, context.shape[1])
+
+        roi = context.roi((roi_top, roi_right, roi_bottom, roi_left), "rgb")
+        for upsample in range(0, self.max_upsample + 1):
+            locations = face_recognition.face_locations(roi, number_of_times_to_upsample=upsample, model="hog")
+            if locations:
+                return [(t + roi_top, r + roi_left, b + roi_top, l + roi_left) for (t, r, b, l) in locations]
+        return []
+
+    def _scale_up(self, location, shape):
+        top, right, bottom, left = location
+        return (
+            max(int(top / self.scale), 0),
+            min(int(right / self.scale), shape[1]),
+            min(int(bottom / self.scale), shape[0]),
+            max(int(left / self.scale), 0)
+        )
+
+
+DETECTOR_BACKENDS = {
+    "hog": HogFaceDetector,
+    "haar": HaarFaceDetector,
+    "dnn": DnnFaceDetector,
+    "cascade": CascadeFaceDetector
+}
+
+
+def create_face_detector(backend=None):
+    """
+    Create the configured face detector.
+
+    Args:
+        backend: Backend name; defaults to FACE_DETECTOR_BACKEND
+
+    Returns:
+        FaceDetector: The requested detector, or dlib HOG if it cannot be created
+    """
+    backend = (backend or FACE_DETECTOR_BACKEND).lower()
+    detector_class = DETECTOR_BACKENDS.get(backend)
+    if detector_class is None:
+        logger.warning(f"Unknown face detector backend '{backend}', using hog")
+        return HogFaceDetector()
+    try:
+        detector = detector_class()
+        logger.info(f"Using {detector.name} face detector")
+        return detector
+    except Exception as e:
+        logger.warning(f"Could not create {backend} face detector ({e}), using hog")
+        return HogFaceDetector()
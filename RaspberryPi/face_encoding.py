@@ -0,0 +1,164 @@
+"""
+Face embedding encoders for the recognition pipeline.
+Each encoder turns face crops into fixed-length embeddings compared by
+Euclidean distance. Embeddings from different encoders live in different
+spaces, so every gallery entry is tagged with the encoder name that produced
+it and only entries from the active encoder are ever compared.
+
+- dlib_resnet: dlib ResNet through face_recognition (128-d, default)
+- openface:    OpenFace nn4.small2 run through OpenCV's DNN module (128-d)
+"""
+import os
+import time
+import logging
+import cv2
+import numpy as np
+import face_recognition
+from frame_context import FrameContext
+from camera_config import FACE_ENCODER_BACKEND, DNN_ENCODER_MODEL, DNN_ENCODER_INPUT_SIZE, DNN_ENCODER_TOLERANCE
+
+logger = logging.getLogger("FaceEncoding")
+
+# Encoder name assumed for galleries enrolled before encoders were tagged
+DEFAULT_ENCODER = "dlib_resnet"
+
+# Number of recent encodings kept for the rolling timing average
+TIMING_WINDOW = 50
+
+
+class FaceEncoder:
+    """
+    Common interface for face encoders.
+    Subclasses implement _encode(); encode() wraps it with timing.
+    """
+    name = "base"
+    dimension = 128
+    tolerance = 0.6  # Maximum Euclidean distance accepted as a match
+
+    def __init__(self):
+        self.last_encoding_time = None
+        self._recent_times = []
+
+    def encode(self, image, face_locations):
+        """
+        Compute one embedding per face location.
+
+        Args:
+            image: OpenCV BGR image or FrameContext
+            face_locations: List of (top, right, bottom, left) tuples
+
+        Returns:
+            list: One numpy embedding per location, in the same order; None where
+                  the face could not be encoded
+        """
+        if image is None or not face_locations:
+            return []
+        context = FrameContext.of(image)
+        start = time.perf_counter()
+        try:
+            return self._encode(context, face_locations)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.last_encoding_time = elapsed
+            self._recent_times.append(elapsed)
+            if len(self._recent_times) > TIMING_WINDOW:
+                self._recent_times.pop(0)
+
+    def _encode(self, context, face_locations):
+        raise NotImplementedError
+
+    def accepts(self, encoding):
+        """Check that an embedding has this encoder's dimension"""
+        return np.asarray(encoding).size == self.dimension
+
+    def timing_stats(self):
+        """Return timing information for this encoder in milliseconds"""
+        average = sum(self._recent_times) / len(self._recent_times) if self._recent_times else None
+        return {
+            "encoder": self.name,
+            "last_ms": round(self.last_encoding_time * 1000, 1) if self.last_encoding_time is not None else None,
+            "average_ms": round(average * 1000, 1) if average is not None else None
+        }
+
+
+class DlibFaceEncoder(FaceEncoder):
+    """dlib ResNet encoder through face_recognition"""
+    name = "dlib_resnet"
+    dimension = 128
+    tolerance = 0.6
+
+    def _encode(self, context, face_locations):
+        # Same as face_recognition.face_encodings, but reusing the frame's RGB view
+        # and any landmarks already computed for these faces
+        return [
+            np.array(face_recognition.api.face_encoder.compute_face_descriptor(
+                context.rgb, context.raw_landmarks(location, "small"), 1))
+            for location in face_locations
+        ]
+
+
+class DnnFaceEncoder(FaceEncoder):
+    """Lightweight embedding model (OpenFace nn4.small2 by default) run through OpenCV DNN"""
+    name = "openface"
+    dimension = 128
+
+    def __init__(self, model_path=DNN_ENCODER_MODEL, input_size=DNN_ENCODER_INPUT_SIZE, tolerance=DNN_ENCODER_TOLERANCE):
+        super().__init__()
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"DNN face encoder model not found: {model_path}")
+        # readNet picks the importer from the extension (.t7 Torch, .onnx ONNX)
+        self.net = cv2.dnn.readNet(model_path)
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.input_size = input_size
+        self.tolerance = tolerance
+
+    def _encode(self, context, face_locations):
+        crops = [context.roi(location, "rgb") for location in face_locations]
+        # Faces at the frame edge or with degenerate boxes have no crop; they keep
+        # a None slot so the results stay aligned with face_locations
+        valid = [i for i, crop in enumerate(crops) if crop is not None]
+        results = [None] * len(face_locations)
+        if not valid:
+            return results
+
+        # One forward pass for all faces in the frame
+        blob = cv2.dnn.blobFromImages([crops[i] for i in valid], 1.0 / 255, (self.input_size, self.input_size),
+                                      (0, 0, 0), swapRB=False, crop=False)
+        self.net.setInput(blob)
+        embeddings = self.net.forward().reshape(len(valid), -1).astype(np.float64)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        for i, embedding in zip(valid, embeddings / norms):
+            results[i] = embedding
+        return results
+
+
+ENCODER_BACKENDS = {
+    "dlib_resnet": DlibFaceEncoder,
+    "openface": DnnFaceEncoder
+}
+
+
+def create_face_encoder(backend=None):
+    """
+    Create the configured face encoder.
+
+    Args:
+        backend: Encoder name; defaults to FACE_ENCODER_BACKEND
+
+    Returns:
+        FaceEncoder: The requested encoder, or the dlib encoder if it cannot be created
+    """
+    backend = (backend or FACE_ENCODER_BACKEND).lower()
+    encoder_class = ENCODER_BACKENDS.get(backend)
+    if encoder_class is None:
+        logger.warning(f"Unknown face encoder '{backend}', using {DEFAULT_ENCODER}")
+        return DlibFaceEncoder()
+    try:
+        encoder = encoder_class()
+        logger.info(f"Using {encoder.name} face encoder")
+        return encoder
+    except Exception as e:
+        logger.warning(f"Could not create {backend} face encoder ({e}), using {DEFAULT_ENCODER}")
+        return DlibFaceEncoder()
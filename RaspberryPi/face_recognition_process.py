@@ -13,7 +13,13 @@ import face_recognition
 import base64
 import requests
 from datetime import datetime
-from camera_config import CAMERA_INDEX, MIN_FACE_WIDTH, MIN_FACE_HEIGHT
+from concurrent.futures import ThreadPoolExecutor
+from camera_config import CAMERA_INDEX, MIN_FACE_WIDTH, MIN_FACE_HEIGHT, LIVENESS_ANALYSIS_SIZE, LIVENESS_BURST_FRAMES
+from face_detection import create_face_detector
+from face_encoding import create_face_encoder, DEFAULT_ENCODER
+from frame_context import FrameContext
+from burst_liveness import check_burst_liveness
+from debug_writer import get_debug_writer
 import pickle
 
 # Configure logging
@@ -28,6 +34,28 @@ logging.basicConfig(
 
 logger = logging.getLogger("FaceRecognitionProcess")
 
+# Face detector and encoder are created on first use so each model is only loaded once
+_face_detector = None
+_face_encoder = None
+
+
+def _get_face_detector():
+    global _face_detector
+    if _face_detector is None:
+        _face_detector = create_face_detector()
+    return _face_detector
+
+
+def _get_face_encoder():
+    global _face_encoder
+    if _face_encoder is None:
+        _face_encoder = create_face_encoder()
+    return _face_encoder
+
+# Liveness checks in the order the cascade runs them
+LIVENESS_CASCADE_STAGES = ("reflection", "gradient", "texture")
+
+
 class LivenessDetector:
     """Enhanced liveness detection for face recognition with anti-spoofing measures"""
     
@@ -49,61 +77,82 @@ class LivenessDetector:
         self.min_gradient_variance = 1000.0  # Increased based on logs (real faces >1200, fake faces <600)
         self.min_color_std = 22.0  # Real faces typically have higher color variation
         self.entropy_balance_threshold = 0.3  # Balance between texture and direction entropy
+        # Every face is analysed at this fixed size
+        self.analysis_size = LIVENESS_ANALYSIS_SIZE
     
     def check_liveness(self, frame):
         """
         Simplified liveness check: only Entropy, Gradient, Gradient Variation, and Reflection
         """
         # Validate input frame
-        if frame is None or frame.size == 0:
+        if frame is None:
+            return {"is_live": False, "error": "Invalid frame"}
+        context = FrameContext.of(frame)
+        if context.frame is None or context.frame.size == 0:
             return {"is_live": False, "error": "Invalid frame"}
-        if frame.shape[0] < 32 or frame.shape[1] < 32:
+        return self._check_gray(context.gray)
+
+    def _check_gray(self, gray):
+        """
+        Run the liveness checks on a grayscale face image as a cascade.
+
+        The face is resized to a fixed analysis size so cost doesn't depend on
+        how close the person stands, then checks run cheapest first: reflection
+        (phone and tablet screens fail here), gradient statistics, and only if
+        both pass the LBP texture entropy. Metrics of checks that never ran are
+        left out of the result; rejected_by names the check that failed and
+        confidence_score is the fraction of checks passed.
+        """
+        if gray.shape[0] < 32 or gray.shape[1] < 32:
             return {"is_live": False, "error": "Frame too small"}
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        size = self.analysis_size
+        if gray.shape[:2] != (size, size):
+            interpolation = cv2.INTER_AREA if gray.shape[0] > size else cv2.INTER_LINEAR
+            gray = cv2.resize(gray, (size, size), interpolation=interpolation)
+        result = {"is_live": False}
+
+        # Stage 1: specular reflections, two thresholds and a count
+        pixel_count = float(gray.size)
+        bright_spot_ratio_high = cv2.countNonZero(cv2.threshold(gray, 220, 255, cv2.THRESH_BINARY)[1]) / pixel_count
+        bright_spot_ratio_med = cv2.countNonZero(cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)[1]) / pixel_count
+        bright_spot_ratio = float(bright_spot_ratio_high * 2 + bright_spot_ratio_med)
+        result["bright_spot_ratio"] = bright_spot_ratio
+        if bright_spot_ratio >= self.reflection_threshold:
+            return self._reject(result, "reflection")
+
+        # Stage 2: gradient statistics on float32 Sobel responses
+        sobelx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+        sobely = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+        gradient_mean, gradient_std = cv2.meanStdDev(cv2.magnitude(sobelx, sobely))
+        mean_gradient = float(gradient_mean[0][0])
+        gradient_variance = float(gradient_std[0][0]) ** 2
+        result["mean_gradient"] = mean_gradient
+        result["gradient_variance"] = gradient_variance
+        if mean_gradient <= self.gradient_threshold or gradient_variance <= self.gradient_variance_threshold:
+            return self._reject(result, "gradient")
+
+        # Stage 3: LBP texture entropy, the most expensive check
         lbp_image = self._calculate_lbp(gray)
-        hist, _ = np.histogram(lbp_image.ravel(), bins=256, range=[0, 256])
-        hist = hist / float(hist.sum() + 1e-10)
-        texture_entropy = -np.sum(hist * np.log2(hist + 1e-10))
-
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
-        mean_gradient = np.mean(gradient_magnitude)
-        gradient_variance = np.var(gradient_magnitude)
-
-        _, bright_spots_high = cv2.threshold(gray, 220, 255, cv2.THRESH_BINARY)
-        _, bright_spots_med = cv2.threshold(gray, 200, 255, cv2.THRESH_BINARY)
-        bright_spot_count_high = cv2.countNonZero(bright_spots_high)
-        bright_spot_count_med = cv2.countNonZero(bright_spots_med)
-        bright_spot_ratio_high = bright_spot_count_high / (gray.shape[0] * gray.shape[1])
-        bright_spot_ratio_med = bright_spot_count_med / (gray.shape[0] * gray.shape[1])
-        bright_spot_ratio = bright_spot_ratio_high * 2 + bright_spot_ratio_med
-
-        # Convert to scalars
-        texture_entropy_scalar = float(texture_entropy)
-        mean_gradient_scalar = float(mean_gradient)
-        gradient_variance_scalar = float(gradient_variance)
-        bright_spot_ratio_scalar = float(bright_spot_ratio)
-
-        # Evaluate only the main liveness checks
-        entropy_ok = texture_entropy_scalar > self.entropy_threshold
-        gradient_ok = mean_gradient_scalar > self.gradient_threshold
-        gradient_variation_ok = gradient_variance_scalar > self.gradient_variance_threshold
-        reflection_ok = bright_spot_ratio_scalar < self.reflection_threshold
-
-        # Liveness: must pass all four checks
-        is_live = entropy_ok and gradient_ok and gradient_variation_ok and reflection_ok
-
-        logger.info(f"Liveness (simplified): entropy={texture_entropy_scalar:.2f}, gradient={mean_gradient_scalar:.2f}, grad_var={gradient_variance_scalar:.2f}, reflection={bright_spot_ratio_scalar:.4f}, live={is_live}")
-
-        return {
-            "texture_entropy": texture_entropy_scalar,
-            "mean_gradient": mean_gradient_scalar,
-            "gradient_variance": gradient_variance_scalar,
-            "bright_spot_ratio": bright_spot_ratio_scalar,
-            "is_live": bool(is_live)
-        }
+        hist = np.bincount(lbp_image.ravel(), minlength=256)[:256].astype(np.float32)
+        hist /= hist.sum() + 1e-10
+        texture_entropy = float(-np.sum(hist * np.log2(hist + 1e-10)))
+        result["texture_entropy"] = texture_entropy
+        if texture_entropy <= self.entropy_threshold:
+            return self._reject(result, "texture")
+
+        result["is_live"] = True
+        result["confidence_score"] = 1.0
+        logger.info(f"Liveness: entropy={texture_entropy:.2f}, gradient={mean_gradient:.2f}, grad_var={gradient_variance:.2f}, reflection={bright_spot_ratio:.4f}, live=True")
+        return result
+
+    def _reject(self, result, stage):
+        """Finish a cascade run that failed at the given stage"""
+        result["rejected_by"] = stage
+        result["confidence_score"] = LIVENESS_CASCADE_STAGES.index(stage) / float(len(LIVENESS_CASCADE_STAGES))
+        metrics = ", ".join(f"{key}={value:.4f}" for key, value in result.items() if isinstance(value, float))
+        logger.info(f"Liveness rejected by {stage} check: {metrics}")
+        return result
     
     def _calculate_lbp(self, img, radius=1, num_points=8):
         """
@@ -117,31 +166,23 @@ class LivenessDetector:
         Returns:
             numpy.ndarray: LBP image
         """
-        # Use float32 to avoid uint8 overflow
-        lbp = np.zeros_like(img, dtype=np.uint16)
-        for i in range(radius, img.shape[0] - radius):
-            for j in range(radius, img.shape[1] - radius):
-                center = img[i, j]
-                binary_pattern = 0
-                
-                # Sample points around center pixel
-                for k in range(num_points):
-                    angle = 2 * np.pi * k / num_points
-                    x = j + radius * np.cos(angle)
-                    y = i - radius * np.sin(angle)
-                    
-                    # Get nearest pixel
-                    x_floor, y_floor = int(np.floor(x)), int(np.floor(y))
-                    
-                    if 0 <= x_floor < img.shape[1] and 0 <= y_floor < img.shape[0]:
-                        value = img[y_floor, x_floor]
-                        if value >= center:
-                            # Use modulo to prevent overflow if num_points is large
-                            if k < 16:  # Ensure we don't exceed 16 bits
-                                binary_pattern |= (1 << k)
-                
-                lbp[i, j] = binary_pattern
-        
+        height, width = img.shape[:2]
+        lbp = np.zeros((height, width), dtype=np.uint16)
+        if height <= 2 * radius or width <= 2 * radius:
+            return lbp
+
+        center = img[radius:height - radius, radius:width - radius]
+        pattern = np.zeros(center.shape, dtype=np.uint16)
+        # Compare whole shifted images at once; each sample point uses the
+        # nearest (floored) pixel, as in the original per-pixel loop
+        for k in range(min(num_points, 16)):  # Ensure we don't exceed 16 bits
+            angle = 2 * np.pi * k / num_points
+            dx = int(np.floor(round(radius * np.cos(angle), 9)))
+            dy = int(np.floor(round(-radius * np.sin(angle), 9)))
+            neighbour = img[radius + dy:height - radius + dy, radius + dx:width - radius + dx]
+            pattern |= (neighbour >= center).astype(np.uint16) << k
+
+        lbp[radius:height - radius, radius:width - radius] = pattern
         return lbp
         
     def check_face_liveness(self, frame, face_location=None):
@@ -149,7 +190,7 @@ class LivenessDetector:
         Check liveness for a specific face in the frame
         
         Args:
-            frame: OpenCV BGR image
+            frame: OpenCV BGR image or FrameContext
             face_location: Optional face location tuple (top, right, bottom, left)
             
         Returns:
@@ -158,29 +199,29 @@ class LivenessDetector:
         if face_location is None:
             return self.check_liveness(frame)
             
-        # Extract face region
-        top, right, bottom, left = face_location
-        face_img = frame[top:bottom, left:right]
+        # Extract face region (grayscale, shared with other stages through the context)
+        face_gray = FrameContext.of(frame).roi(face_location, "gray")
         
         # Ensure face region is valid
-        if face_img.size == 0:
+        if face_gray is None or face_gray.size == 0:
             logger.warning("Invalid face region for liveness check")
             return {"is_live": False, "error": "Invalid face region"}
         
-        return self.check_liveness(face_img)
+        return self._check_gray(face_gray)
         
     def check_multiple_faces(self, frame, face_locations):
         """
         Perform liveness detection for all faces in frame
         
         Args:
-            frame: OpenCV BGR image
+            frame: OpenCV BGR image or FrameContext
             face_locations: List of face location tuples
             
         Returns:
             list: Liveness check results for each face
         """
         results = []
+        frame = FrameContext.of(frame)
         
         for face_loc in face_locations:
             try:
@@ -217,7 +258,8 @@ class WebRecognition:
         logger.info("Initializing WebRecognition")
         self.known_face_encodings = []
         self.known_face_names = []
-        self.detection_threshold = 0.6  # Lower values are more strict
+        self.encoder = _get_face_encoder()
+        self.detection_threshold = self.encoder.tolerance  # Lower values are more strict
         self.liveness_detector = LivenessDetector()
         
     def load_encodings(self, encodings, names):
@@ -237,7 +279,7 @@ class WebRecognition:
         Identify a face in the given frame or using provided encoding
         
         Args:
-            frame: Optional OpenCV BGR image
+            frame: Optional OpenCV BGR image or FrameContext
             face_location: Optional face location tuple (top, right, bottom, left)
             face_encoding: Optional face encoding directly provided
             
@@ -250,12 +292,12 @@ class WebRecognition:
             if isinstance(face_encoding, list):
                 face_encoding = np.array(face_encoding)
         elif frame is not None:
-            # Convert to RGB (face_recognition uses RGB)
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Detection and encoding share the frame's converted views
+            frame = FrameContext.of(frame)
             
             # If face location not provided, detect faces
             if face_location is None:
-                face_locations = face_recognition.face_locations(rgb_frame)
+                face_locations = _get_face_detector().detect(frame)
                 if not face_locations:
                     return None
                 face_location = face_locations[0]  # Use first detected face
@@ -263,9 +305,9 @@ class WebRecognition:
                 face_locations = [face_location]
                 
             # Get face encodings
-            face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
+            face_encodings = self.encoder.encode(frame, face_locations)
             
-            if not face_encodings:
+            if not face_encodings or face_encodings[0] is None:
                 logger.warning("Could not encode detected face")
                 return None
                 
@@ -456,17 +498,17 @@ class WebRecognition:
 
 def save_debug_frame(frame, filename, faces=None, liveness_results=None, matches=None):
     """
-    Save a debug frame with detection visualization
+    Save a debug frame with detection visualization (written in the background)
     
     Args:
-        frame: OpenCV BGR image
+        frame: OpenCV BGR image or FrameContext
         filename: Output filename
         faces: List of face locations (top, right, bottom, left)
         liveness_results: Liveness check results
         matches: Match information
     """
-    # Make a copy to avoid modifying the original
-    debug_frame = frame.copy()
+    # Make a copy to avoid modifying the original; each saved snapshot gets its own overlays
+    debug_frame = FrameContext.of(frame).frame.copy()
     
     # Draw face boxes if provided
     if faces:
@@ -518,10 +560,8 @@ def save_debug_frame(frame, filename, faces=None, liveness_results=None, matches
     # cv2.putText(debug_frame, timestamp, (10, 30), 
     #            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
     
-    # Save the image
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    cv2.imwrite(filename, debug_frame)
-    logger.info(f"Saved debug frame to {filename}")
+    # Hand the image to the background writer
+    get_debug_writer().save(debug_frame, filename)
 
 
 def load_known_faces(backend_url):
@@ -558,6 +598,11 @@ def load_known_faces(backend_url):
         face_data = data.get("face_data", [])
         logger.info(f"Retrieved {len(face_data)} faces from backend")
         
+        # Galleries from a different encoder live in a different embedding space
+        encoder = _get_face_encoder()
+        face_data = [entry for entry in face_data if entry.get("encoder", DEFAULT_ENCODER) == encoder.name]
+        logger.info(f"{len(face_data)} faces were enrolled with the {encoder.name} encoder")
+        
         # Process face data
         encodings = []
         names = []
@@ -589,7 +634,7 @@ def load_known_faces(backend_url):
                         # Last resort - try directly decoding as a pickle
                         encoding = pickle.loads(base64.b64decode(face_encoding_b64))
                 
-                if isinstance(encoding, np.ndarray) and encoding.size == 128:  # Standard face encoding length
+                if isinstance(encoding, np.ndarray) and encoder.accepts(encoding):
                     logger.info(f"Decoded face encoding for {phone_number} (shape: {encoding.shape})")
                     encodings.append(encoding)
                     # Try to get user information from the database
@@ -692,9 +737,10 @@ def run_face_recognition(camera_index=0, backend_url=None, skip_liveness=False,
         if debug_dir:
             save_debug_frame(frame, f"{debug_dir}/frame_initial_{timestamp}.jpg")
         
-        # Detect faces in the frame
-        # Use a higher upsample value to detect smaller/more distant faces
-        face_locations = face_recognition.face_locations(frame, model="hog", number_of_times_to_upsample=2)
+        # Detect faces in the frame with the configured detector backend; detection,
+        # encoding and liveness all reuse the same converted views of the frame
+        context = FrameContext(frame)
+        face_locations = _get_face_detector().detect(context)
         
         if not face_locations:
             logger.warning("No faces detected in frame")
@@ -750,8 +796,16 @@ def run_face_recognition(camera_index=0, backend_url=None, skip_liveness=False,
                                 faces=face_locations)
             return result
         
-        # Extract face encodings
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
+        # Extract face encodings while the rest of the liveness burst is read
+        burst_contexts = [context]
+        with ThreadPoolExecutor(max_workers=1) as encode_pool:
+            encode_future = encode_pool.submit(recognition.encoder.encode, context, face_locations)
+            if not skip_liveness:
+                for _ in range(LIVENESS_BURST_FRAMES - 1):
+                    ret, burst_frame = camera.read()
+                    if ret and burst_frame is not None:
+                        burst_contexts.append(FrameContext(burst_frame))
+            face_encodings = encode_future.result()
         if not face_encodings:
             logger.warning("Failed to extract face encodings")
             if debug_dir:
@@ -770,7 +824,12 @@ def run_face_recognition(camera_index=0, backend_url=None, skip_liveness=False,
         # Perform liveness check if not skipped
         liveness_results = None
         if not skip_liveness:
-            liveness_results = recognition.liveness_detector.check_multiple_faces(frame, face_locations)
+            # The person barely moves during the burst, so each face keeps its location
+            liveness_results = [
+                check_burst_liveness([(burst_context, face_loc) for burst_context in burst_contexts],
+                                     recognition.liveness_detector)
+                for face_loc in face_locations
+            ]
             
             # Check if any face passes liveness
             all_fake = all(not result.get("is_live", False) for result in liveness_results)
@@ -0,0 +1,192 @@
+"""
+Face tracking for continuous use of the camera.
+Runs the (expensive) face detector only every few frames and follows faces in
+between with normalized cross-correlation template matching on a downscaled
+grayscale frame. Every tracked face keeps a stable id, so results such as
+recognition can be attached to the person once instead of recomputed per frame.
+"""
+import logging
+import threading
+import cv2
+from camera_config import TRACKER_DETECT_INTERVAL, TRACKER_SCALE, TRACKER_MIN_CONFIDENCE, TRACKER_MAX_MISSES
+from face_detection import box_iou
+from frame_context import FrameContext
+
+logger = logging.getLogger("FaceTracker")
+
+# Search window around the last position, as a fraction of the face size per side
+SEARCH_MARGIN = 0.5
+# Minimum box overlap for a detection to continue an existing track
+MATCH_MIN_IOU = 0.3
+
+
+class Track:
+    """One face followed across frames"""
+
+    def __init__(self, track_id, location):
+        self.track_id = track_id
+        self.location = location
+        self.confidence = 1.0
+        self.misses = 0
+        self.frames = 0
+        self.template = None
+        self.recognition = None  # Attached recognition result, if any
+
+    @property
+    def area(self):
+        top, right, bottom, left = self.location
+        return (bottom - top) * (right - left)
+
+
+class FaceTracker:
+    """Detect-every-N-frames face tracker with stable track ids"""
+
+    def __init__(self, detector, detect_interval=TRACKER_DETECT_INTERVAL, scale=TRACKER_SCALE,
+                 min_confidence=TRACKER_MIN_CONFIDENCE, max_misses=TRACKER_MAX_MISSES):
+        self.detector = detector
+        self.detect_interval = max(int(detect_interval), 1)
+        self.scale = scale
+        self.min_confidence = min_confidence
+        self.max_misses = max_misses
+        self.tracks = []
+        self._next_id = 1
+        # Start due for a detection so the first frame is searched
+        self._frames_since_detection = self.detect_interval
+        self.frame_count = 0
+        self.detection_count = 0
+        self._lock = threading.Lock()
+
+    def update(self, frame):
+        """
+        Track faces in the next frame.
+
+        Args:
+            frame: OpenCV BGR image or FrameContext
+
+        Returns:
+            list: Active Track objects with locations in this frame
+        """
+        context = FrameContext.of(frame)
+        gray = context.small(self.scale, "gray")
+        with self._lock:
+            self.frame_count += 1
+            self._frames_since_detection += 1
+            # With nobody in view, detection still only runs every detect_interval frames
+            need_detection = self._frames_since_detection >= self.detect_interval
+            if not need_detection:
+                for track in self.tracks:
+                    self._follow(track, gray, context.shape)
+                    if track.confidence < self.min_confidence:
+                        need_detection = True
+            if need_detection:
+                self._detect(context, gray)
+            return list(self.tracks)
+
+    def _to_small(self, location):
+        return [int(round(v * self.scale)) for v in location]
+
+    def _from_small(self, location, shape):
+        top, right, bottom, left = [int(round(v / self.scale)) for v in location]
+        return max(top, 0), min(right, shape[1]), min(bottom, shape[0]), max(left, 0)
+
+    def _set_template(self, track, gray):
+        top, right, bottom, left = self._to_small(track.location)
+        top, left = max(top, 0), max(left, 0)
+        template = gray[top:bottom, left:right]
+        track.template = template.copy() if template.size else None
+
+    def _follow(self, track, gray, shape):
+        """Move a track to the best template match near its last position"""
+        if track.template is None:
+            track.confidence = 0.0
+            return
+        top, right, bottom, left = self._to_small(track.location)
+        height, width = track.template.shape[:2]
+        margin_y, margin_x = int(height * SEARCH_MARGIN), int(width * SEARCH_MARGIN)
+        window_top, window_left = max(top - margin_y, 0), max(left - margin_x, 0)
+        window = gray[window_top:min(bottom + margin_y, gray.shape[0]), window_left:min(right + margin_x, gray.shape[1])]
+        if window.shape[0] < height or window.shape[1] < width:
+            track.confidence = 0.0
+            return
+
+        scores = cv2.matchTemplate(window, track.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (x, y) = cv2.minMaxLoc(scores)
+        track.confidence = float(score)
+        if score >= self.min_confidence:
+            new_top, new_left = window_top + y, window_left + x
+            track.location = self._from_small((new_top, new_left + width, new_top + height, new_left), shape)
+            track.frames += 1
+
+    def _detect(self, context, gray):
+        """Run full detection and reconcile the detections with the current tracks"""
+        self._frames_since_detection = 0
+        self.detection_count += 1
+        try:
+            locations = self.detector.detect(context)
+        except Exception as e:
+            logger.error(f"Error during face detection: {e}")
+            return
+
+        # Greedily pair detections with tracks by box overlap
+        pairs = sorted(
+            ((box_iou(track.location, location), t, d)
+             for t, track in enumerate(self.tracks) for d, location in enumerate(locations)),
+            reverse=True
+        )
+        matched_tracks, matched_detections = set(), set()
+        for iou, t, d in pairs:
+            if iou < MATCH_MIN_IOU:
+                break
+            if t in matched_tracks or d in matched_detections:
+                continue
+            matched_tracks.add(t)
+            matched_detections.add(d)
+            track = self.tracks[t]
+            track.location = tuple(locations[d])
+            track.confidence = 1.0
+            track.misses = 0
+            track.frames += 1
+            self._set_template(track, gray)
+
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    logger.info(f"Lost track {track.track_id}")
+                    continue
+            kept.append(track)
+        for d, location in enumerate(locations):
+            if d not in matched_detections:
+                track = Track(self._next_id, tuple(location))
+                self._next_id += 1
+                self._set_template(track, gray)
+                kept.append(track)
+                logger.info(f"New track {track.track_id} at {track.location}")
+        self.tracks = kept
+
+    def primary_track(self):
+        """The largest tracked face, usually the person closest to the door"""
+        with self._lock:
+            return max(self.tracks, key=lambda track: track.area) if self.tracks else None
+
+    def attach(self, track_id, recognition):
+        """Attach a recognition result to a track so the person isn't recognized again"""
+        with self._lock:
+            for track in self.tracks:
+                if track.track_id == track_id:
+                    track.recognition = recognition
+                    return True
+        return False
+
+    def stats(self):
+        return {
+            "frames": self.frame_count,
+            "detections": self.detection_count,
+            "tracks": len(self.tracks)
+        }
+
+    def reset(self):
+        with self._lock:
+            self.tracks = []
+            self._frames_since_detection = self.detect_interval
@@ -0,0 +1,148 @@
+"""
+Per-frame analysis context shared by detection, encoding, liveness and debug rendering.
+Wraps one BGR camera frame and lazily computes and memoizes every derived view
+(gray, RGB, downscaled, face ROIs and dlib landmarks), so each frame is
+converted at most once per representation no matter how many stages look at it.
+"""
+import threading
+import logging
+import cv2
+import face_recognition
+
+logger = logging.getLogger("FrameContext")
+
+_CONVERSIONS = {
+    "gray": cv2.COLOR_BGR2GRAY,
+    "rgb": cv2.COLOR_BGR2RGB
+}
+
+
+def _location_key(location):
+    return tuple(int(v) for v in location)
+
+
+class FrameContext:
+    """Lazily computed, memoized views of a single BGR frame"""
+
+    def __init__(self, frame):
+        self.frame = frame
+        self._views = {}
+        # Stages on different threads may ask for the same view; compute it once
+        self._lock = threading.RLock()
+
+    @classmethod
+    def of(cls, frame):
+        """Return frame unchanged if it already is a FrameContext, otherwise wrap it"""
+        return frame if isinstance(frame, cls) else cls(frame)
+
+    @property
+    def shape(self):
+        return self.frame.shape
+
+    def cached(self, key, compute):
+        """
+        Return the view stored under key, computing it on first use.
+
+        Args:
+            key: Hashable view identifier
+            compute: Callable producing the view
+
+        Returns:
+            The memoized view
+        """
+        with self._lock:
+            if key not in self._views:
+                self._views[key] = compute()
+            return self._views[key]
+
+    def _convert(self, image, representation):
+        if representation == "bgr":
+            return image
+        return cv2.cvtColor(image, _CONVERSIONS[representation])
+
+    @property
+    def gray(self):
+        return self.cached("gray", lambda: self._convert(self.frame, "gray"))
+
+    @property
+    def rgb(self):
+        return self.cached("rgb", lambda: self._convert(self.frame, "rgb"))
+
+    def small(self, scale, representation="bgr"):
+        """
+        Downscaled view of the frame.
+
+        Args:
+            scale: Resize factor applied to both sides
+            representation: "bgr", "gray" or "rgb"
+
+        Returns:
+            numpy.ndarray: The downscaled image
+        """
+        if scale == 1.0:
+            return self.frame if representation == "bgr" else getattr(self, representation)
+        if representation != "bgr":
+            # Convert the (cheaper) downscaled image rather than the full frame
+            return self.cached(("small", scale, representation),
+                               lambda: self._convert(self.small(scale), representation))
+        return self.cached(("small", scale, "bgr"),
+                           lambda: cv2.resize(self.frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA))
+
+    def clip(self, location):
+        """Clip a (top, right, bottom, left) location to the frame bounds"""
+        height, width = self.frame.shape[:2]
+        top, right, bottom, left = _location_key(location)
+        return max(top, 0), min(right, width), min(bottom, height), max(left, 0)
+
+    def roi(self, location, representation="bgr", width=None):
+        """
+        Face region of the frame.
+
+        Args:
+            location: Face location (top, right, bottom, left)
+            representation: "bgr", "gray" or "rgb"
+            width: Optional width to resize the ROI to, keeping its aspect ratio
+
+        Returns:
+            numpy.ndarray: The ROI, or None if the location lies outside the frame
+        """
+        top, right, bottom, left = self.clip(location)
+        if bottom <= top or right <= left:
+            return None
+        key = ("roi", (top, right, bottom, left), representation, width)
+
+        def compute():
+            if width is not None:
+                roi = self.roi((top, right, bottom, left), representation)
+                height = max(int(round((bottom - top) * width / float(right - left))), 1)
+                return cv2.resize(roi, (width, height), interpolation=cv2.INTER_AREA)
+            if representation in self._views:
+                # Slice an existing full-frame conversion instead of converting again
+                return self._views[representation][top:bottom, left:right]
+            return self._convert(self.frame[top:bottom, left:right], representation)
+
+        return self.cached(key, compute)
+
+    def raw_landmarks(self, location, model="small"):
+        """
+        dlib landmark shape for a face, as used by the dlib encoder.
+
+        Args:
+            location: Face location (top, right, bottom, left)
+            model: "small" (5 points) or "large" (68 points)
+
+        Returns:
+            dlib.full_object_detection: The landmark shape
+        """
+        key = ("landmarks", _location_key(location), model)
+        return self.cached(key, lambda: face_recognition.api._raw_face_landmarks(
+            self.rgb, [_location_key(location)], model=model)[0])
+
+    def landmark_points(self, location, model="large"):
+        """Landmarks of a face as a list of (x, y) points"""
+        shape = self.raw_landmarks(location, model)
+        return [(point.x, point.y) for point in shape.parts()]
+
+    def debug_canvas(self):
+        """Copy of the frame for debug drawing, made at most once per frame"""
+        return self.cached("debug_canvas", self.frame.copy)
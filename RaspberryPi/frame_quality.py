@@ -0,0 +1,142 @@
+"""
+Frame quality scoring for the recognition pipeline.
+Scores each detected face on its own ROI (sharpness, exposure, size and
+centering) so the expensive encoder and liveness checks only run on the
+best frame of a burst instead of whichever frame had the largest box.
+"""
+import logging
+from collections import namedtuple
+import cv2
+import numpy as np
+from camera_config import MIN_FACE_WIDTH, MIN_FACE_HEIGHT
+from face_detection import box_iou
+from frame_context import FrameContext
+
+logger = logging.getLogger("FrameQuality")
+
+# Laplacian variance at which a face ROI counts as fully sharp
+SHARPNESS_TARGET = 150.0
+# Face side length (relative to the minimum usable size) that earns full size score
+SIZE_TARGET_FACTOR = 2.0
+# Fraction of clipped pixels at which the exposure score reaches zero
+CLIPPING_LIMIT = 0.25
+# Width the ROI is resized to before scoring, so cost doesn't depend on distance
+ANALYSIS_WIDTH = 96
+
+QUALITY_WEIGHTS = {
+    "sharpness": 0.4,
+    "exposure": 0.25,
+    "size": 0.2,
+    "centering": 0.15
+}
+
+FaceQuality = namedtuple("FaceQuality", ["score", "frame_index", "face_index", "location", "sharpness", "exposure", "size", "centering"])
+
+
+def score_face(frame, location):
+    """
+    Score a single face ROI.
+
+    Args:
+        frame: OpenCV BGR image or FrameContext
+        location: Face location (top, right, bottom, left)
+
+    Returns:
+        dict: Component scores and the weighted total, each in [0, 1]
+    """
+    context = FrameContext.of(frame)
+    height, width = context.shape[:2]
+    top, right, bottom, left = context.clip(location)
+    face_width, face_height = right - left, bottom - top
+    if face_width <= 0 or face_height <= 0:
+        return {"score": 0.0, "sharpness": 0.0, "exposure": 0.0, "size": 0.0, "centering": 0.0}
+
+    gray = context.roi(location, "gray", width=ANALYSIS_WIDTH)
+
+    sharpness = min(cv2.Laplacian(gray, cv2.CV_32F).var() / SHARPNESS_TARGET, 1.0)
+
+    mean = float(gray.mean())
+    clipped = float(np.count_nonzero((gray < 10) | (gray > 245))) / gray.size
+    exposure = max(1.0 - abs(mean - 128.0) / 128.0 - clipped / CLIPPING_LIMIT, 0.0)
+
+    size = min(min(face_width / (MIN_FACE_WIDTH * SIZE_TARGET_FACTOR),
+                   face_height / (MIN_FACE_HEIGHT * SIZE_TARGET_FACTOR)), 1.0)
+
+    offset_x = ((left + right) / 2.0 - width / 2.0) / (width / 2.0)
+    offset_y = ((top + bottom) / 2.0 - height / 2.0) / (height / 2.0)
+    centering = max(1.0 - np.hypot(offset_x, offset_y) / np.sqrt(2.0), 0.0)
+
+    components = {"sharpness": float(sharpness), "exposure": float(exposure), "size": float(size), "centering": float(centering)}
+    components["score"] = sum(QUALITY_WEIGHTS[name] * value for name, value in components.items())
+    return components
+
+
+def is_usable_size(quality):
+    """Check whether a scored face meets the minimum size for reliable recognition"""
+    return quality.size >= 1.0 / SIZE_TARGET_FACTOR
+
+
+def rank_faces(frames, face_locations, top_k=1):
+    """
+    Rank every detected face across a burst of frames by quality.
+
+    Args:
+        frames: List of OpenCV BGR images or FrameContexts
+        face_locations: Per-frame lists of face locations
+        top_k: Number of best faces to return
+
+    Returns:
+        list: FaceQuality entries sorted from best to worst
+    """
+    ranked = []
+    for frame_index, (frame, locations) in enumerate(zip(frames, face_locations)):
+        for face_index, location in enumerate(locations or []):
+            try:
+                quality = score_face(frame, location)
+            except Exception as e:
+                logger.error(f"Error scoring face quality: {e}")
+                continue
+            ranked.append(FaceQuality(
+                score=quality["score"],
+                frame_index=frame_index,
+                face_index=face_index,
+                location=location,
+                sharpness=quality["sharpness"],
+                exposure=quality["exposure"],
+                size=quality["size"],
+                centering=quality["centering"]
+            ))
+    # Faces big enough to recognize always outrank smaller ones (e.g. people in the background)
+    ranked.sort(key=lambda entry: (is_usable_size(entry), entry.score), reverse=True)
+    return ranked[:top_k]
+
+
+def select_fusion_faces(frames, face_locations, best, count, min_iou=0.3):
+    """
+    Pick the best faces from other frames that show the same person as `best`.
+
+    The person at the door barely moves during a burst, so a face counts as the
+    same person when its box overlaps the best face's box.
+
+    Args:
+        frames: List of OpenCV BGR images or FrameContexts
+        face_locations: Per-frame lists of face locations
+        best: FaceQuality of the best face
+        count: Maximum number of faces to return, including `best`
+        min_iou: Minimum box overlap with the best face
+
+    Returns:
+        list: FaceQuality entries, starting with `best`, at most one per frame
+    """
+    selected = [best]
+    used_frames = {best.frame_index}
+    for entry in rank_faces(frames, face_locations, top_k=sum(len(l or []) for l in face_locations)):
+        if len(selected) >= count:
+            break
+        if entry.frame_index in used_frames or not is_usable_size(entry):
+            continue
+        if box_iou(entry.location, best.location) < min_iou:
+            continue
+        selected.append(entry)
+        used_frames.add(entry.frame_index)
+    return selected
@@ -0,0 +1,162 @@
+"""
+Hands-free recognition mode.
+Watches the camera in the background so people can be recognized without
+touching the kiosk. Work escalates only as far as the scene requires:
+
+- idle:        a few frames per second, cheap frame differencing on a tiny gray image
+- watching:    motion seen; faces are tracked (full detection every few frames)
+- recognizing: a tracked face is big enough; full recognition and liveness run once per track
+
+The monitor drops back to idle once the scene has been static and empty for
+HANDS_FREE_IDLE_TIMEOUT seconds, keeping CPU load and temperature low when
+nobody is at the door.
+"""
+import time
+import logging
+import threading
+import cv2
+from camera_config import (
+    HANDS_FREE_IDLE_FPS, HANDS_FREE_ACTIVE_FPS, HANDS_FREE_MOTION_WIDTH, HANDS_FREE_PIXEL_DELTA,
+    HANDS_FREE_MOTION_THRESHOLD, HANDS_FREE_IDLE_TIMEOUT, MIN_FACE_WIDTH, MIN_FACE_HEIGHT
+)
+from frame_context import FrameContext
+
+logger = logging.getLogger("HandsFree")
+
+
+class MotionDetector:
+    """Frame differencing on a heavily downscaled, blurred gray image"""
+
+    def __init__(self, width=HANDS_FREE_MOTION_WIDTH, pixel_delta=HANDS_FREE_PIXEL_DELTA,
+                 threshold=HANDS_FREE_MOTION_THRESHOLD):
+        self.width = width
+        self.pixel_delta = pixel_delta
+        self.threshold = threshold
+        self._previous = None
+
+    def update(self, frame):
+        """
+        Compare a frame with the previous one.
+
+        Args:
+            frame: OpenCV BGR image
+
+        Returns:
+            float: Fraction of pixels that changed (0.0 for the first frame)
+        """
+        height = max(int(frame.shape[0] * self.width / frame.shape[1]), 1)
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        previous, self._previous = self._previous, gray
+        if previous is None:
+            return 0.0
+        changed = cv2.countNonZero(cv2.threshold(cv2.absdiff(gray, previous), self.pixel_delta, 255, cv2.THRESH_BINARY)[1])
+        return changed / float(gray.size)
+
+    def has_motion(self, frame):
+        return self.update(frame) >= self.threshold
+
+    def reset(self):
+        self._previous = None
+
+
+class HandsFreeMonitor:
+    """Background loop escalating from motion detection to tracking to recognition"""
+
+    IDLE = "idle"
+    WATCHING = "watching"
+    RECOGNIZING = "recognizing"
+
+    def __init__(self, read_frame, tracker, recognize, is_busy):
+        """
+        Args:
+            read_frame: Callable returning the next BGR frame from the shared camera, or None
+            tracker: FaceTracker used while watching
+            recognize: Callable taking a list of frames, running a full recognition
+                       attempt and returning its result dict (or None if it couldn't start)
+            is_busy: Callable returning True while a kiosk-initiated attempt is running
+        """
+        self.read_frame = read_frame
+        self.tracker = tracker
+        self.recognize = recognize
+        self.is_busy = is_busy
+        self.motion = MotionDetector()
+        self.state = self.IDLE
+        self._last_activity = 0.0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="HandsFree", daemon=True)
+        self._thread.start()
+        logger.info("Hands-free monitor started")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        logger.info("Hands-free monitor stopped")
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.info(f"Hands-free: {self.state} -> {state}")
+            self.state = state
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            fps = HANDS_FREE_IDLE_FPS if self.state == self.IDLE else HANDS_FREE_ACTIVE_FPS
+            if self._stop_event.wait(1.0 / fps):
+                break
+            if self.is_busy():
+                # Someone is using the kiosk; their frames shouldn't count as motion later
+                self.motion.reset()
+                continue
+            try:
+                frame = self.read_frame()
+                if frame is not None:
+                    self._step(frame)
+            except Exception as e:
+                logger.error(f"Hands-free monitor error: {e}")
+
+    def _step(self, frame):
+        now = time.time()
+        if self.motion.has_motion(frame):
+            self._last_activity = now
+            if self.state == self.IDLE:
+                self._set_state(self.WATCHING)
+        if self.state == self.IDLE:
+            return
+
+        tracks = self.tracker.update(FrameContext(frame))
+        if tracks:
+            self._last_activity = now
+        elif now - self._last_activity > HANDS_FREE_IDLE_TIMEOUT:
+            self.tracker.reset()
+            self._set_state(self.IDLE)
+            return
+
+        # Recognize each person once: the closest face that has no result yet
+        candidates = [track for track in tracks if track.recognition is None and self._big_enough(track)]
+        if not candidates:
+            return
+        track = max(candidates, key=lambda candidate: candidate.area)
+        self._set_state(self.RECOGNIZING)
+        try:
+            result = self.recognize([frame])
+        finally:
+            self._set_state(self.WATCHING)
+            self.motion.reset()
+        if result is not None:
+            self.tracker.attach(track.track_id, {
+                "recognized": result.get("recognized", False),
+                "name": result.get("user_name"),
+                "user_id": result.get("user_id")
+            })
+
+    @staticmethod
+    def _big_enough(track):
+        top, right, bottom, left = track.location
+        return right - left >= MIN_FACE_WIDTH and bottom - top >= MIN_FACE_HEIGHT
@@ -0,0 +1,162 @@
+"""
+Incident clip recording.
+Keeps the last few seconds of camera frames in memory as small JPEGs and, when
+something worth reviewing happens (access denied, failed liveness check, door
+unlocked by command), writes the seconds before and after it to one short MJPEG
+clip in static/incident_clips. The clip's URL is sent along with the backend
+access-log entry so the event can be reviewed with its context; that needs
+PI_PUBLIC_URL, the address the mobile app reaches the Pi's web server at.
+"""
+import os
+import glob
+import time
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+import cv2
+import numpy as np
+from camera_config import (
+    INCIDENT_FPS, INCIDENT_PRE_SECONDS, INCIDENT_POST_SECONDS, INCIDENT_WIDTH,
+    INCIDENT_JPEG_QUALITY, INCIDENT_MAX_CLIPS
+)
+
+logger = logging.getLogger("IncidentRecorder")
+
+INCIDENT_CLIPS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static', 'incident_clips')
+
+
+def clip_url(name):
+    """
+    URL of a clip as stored in the access log.
+
+    Returns:
+        str: Absolute URL under PI_PUBLIC_URL, or None without a clip or without
+             PI_PUBLIC_URL, since the mobile app can't open a bare path
+    """
+    if not name:
+        return None
+    base = os.getenv("PI_PUBLIC_URL", "").rstrip("/")
+    if not base:
+        logger.warning(f"PI_PUBLIC_URL is not set; clip {name} is kept on the Pi but not linked in the access log")
+        return None
+    return f"{base}/incident-clips/{name}"
+
+
+class _Incident:
+    def __init__(self, name, kind, frames):
+        self.name = name
+        self.kind = kind
+        self.frames = frames  # (timestamp, jpeg bytes), oldest first
+
+
+class IncidentRecorder:
+    """In-memory pre/post ring buffer of camera frames that writes incident clips"""
+
+    def __init__(self, directory=INCIDENT_CLIPS_DIR, fps=INCIDENT_FPS, pre_seconds=INCIDENT_PRE_SECONDS,
+                 post_seconds=INCIDENT_POST_SECONDS, width=INCIDENT_WIDTH, quality=INCIDENT_JPEG_QUALITY,
+                 max_clips=INCIDENT_MAX_CLIPS):
+        self.directory = directory
+        self.fps = fps
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.width = width
+        self.quality = quality
+        self.max_clips = max_clips
+        self._ring = deque(maxlen=max(int(pre_seconds * fps), 1))
+        self._recording = []  # Incidents still collecting frames after the event
+        self._last_frame_time = 0.0
+        self._lock = threading.Lock()
+
+    def add_frame(self, frame):
+        """
+        Offer a camera frame. Frames are sampled at the recorder's fps, downscaled
+        and JPEG-compressed, so this is cheap to call for every frame read.
+
+        Args:
+            frame: OpenCV BGR image
+        """
+        now = time.time()
+        if now - self._last_frame_time < 1.0 / self.fps:
+            return
+        self._last_frame_time = now
+        try:
+            height = max(int(frame.shape[0] * self.width / frame.shape[1]), 1)
+            small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+            ok, buffer = cv2.imencode('.jpg', small, [int(cv2.IMWRITE_JPEG_QUALITY), int(self.quality)])
+        except Exception as e:
+            logger.error(f"Error compressing frame for the incident buffer: {e}")
+            return
+        if not ok:
+            return
+        entry = (now, buffer.tobytes())
+        with self._lock:
+            self._ring.append(entry)
+            for incident in self._recording:
+                incident.frames.append(entry)
+
+    def record(self, kind):
+        """
+        Start an incident clip: the buffered frames plus the next INCIDENT_POST_SECONDS.
+
+        The clip is written in the background once the post-event window has passed.
+
+        Args:
+            kind: Short event name used in the file name, e.g. "liveness_failed"
+
+        Returns:
+            str: File name the clip will have, or None if the camera hasn't delivered
+                 any frames recently (nothing to record)
+        """
+        name = f"incident_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.avi"
+        since = time.time() - self.pre_seconds
+        with self._lock:
+            frames = [entry for entry in self._ring if entry[0] >= since]
+            if not frames:
+                logger.info(f"No recent camera frames, not recording a clip for {kind}")
+                return None
+            incident = _Incident(name, kind, frames)
+            self._recording.append(incident)
+        logger.info(f"Recording incident clip {name}")
+        # A timer rather than the frame stream ends the clip, as the camera may stop delivering frames
+        timer = threading.Timer(self.post_seconds, self._finish, args=(incident,))
+        timer.daemon = True
+        timer.start()
+        return name
+
+    def _finish(self, incident):
+        with self._lock:
+            if incident in self._recording:
+                self._recording.remove(incident)
+        if not incident.frames:
+            logger.warning(f"No frames buffered for incident clip {incident.name}")
+            return
+        try:
+            self._write_clip(incident)
+            self._prune()
+        except Exception as e:
+            logger.error(f"Error writing incident clip {incident.name}: {e}")
+
+    def _write_clip(self, incident):
+        os.makedirs(self.directory, exist_ok=True)
+        first = cv2.imdecode(np.frombuffer(incident.frames[0][1], dtype=np.uint8), cv2.IMREAD_COLOR)
+        height, width = first.shape[:2]
+        path = os.path.join(self.directory, incident.name)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), float(self.fps), (width, height))
+        try:
+            for _, data in incident.frames:
+                image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                if image is not None and image.shape[:2] == (height, width):
+                    writer.write(image)
+        finally:
+            writer.release()
+        logger.info(f"Saved incident clip {path} ({len(incident.frames)} frames)")
+
+    def _prune(self):
+        """Keep only the newest INCIDENT_MAX_CLIPS clips"""
+        clips = sorted(glob.glob(os.path.join(self.directory, 'incident_*.avi')), key=os.path.getmtime)
+        for path in clips[:max(len(clips) - self.max_clips, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
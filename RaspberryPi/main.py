@@ -16,6 +16,7 @@ import platform
 from door_controller import DoorController
 # Import the correct MQTTHandler class that integrates with Flask and has update_schedule
 from mqtt_handler import MQTTHandler
+from schedule_engine import ScheduleEngine
 from routes import setup_routes
 from utils import create_backend_session
 from camera_config import CAMERA_INDEX
@@ -83,7 +84,8 @@ for var in required_env_vars:
 # Initialize components
 door_controller = DoorController()
 session, backend_url = create_backend_session()
-mqtt_handler = MQTTHandler(app, door_controller)
+schedule_engine = ScheduleEngine(door_controller)
+mqtt_handler = MQTTHandler(app, door_controller, schedule_engine)
 
 # Setup routes
 logger.info("Setting up application routes")
@@ -93,6 +95,10 @@ app_with_routes = setup_routes(app, door_controller, mqtt_handler, session, back
 atexit.register(door_controller.cleanup)
 logger.info("Door controller cleanup registered with atexit")
 
+# Start the schedule engine; registered after GPIO cleanup so it stops first
+schedule_engine.start()
+atexit.register(schedule_engine.stop)
+
 if __name__ == '__main__':
     logger.info("Starting Flask application on port 5000")
     app.run(host='0.0.0.0', port=5000, debug=False) 
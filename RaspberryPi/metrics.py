@@ -0,0 +1,164 @@
+"""
+Per-stage latency metrics for door entries.
+Each stage of an entry (camera acquire, capture, detect, encode, liveness,
+gallery lookup, backend call, relay actuation) records how long it took. The
+last METRICS_WINDOW samples of every stage are kept in memory and served at
+/metrics in the Prometheus text format, as a summary with p50/p95/p99 plus the
+lifetime sum and count. Timed stages are also recorded as spans of the active
+trace (see tracing).
+"""
+import math
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from camera_config import METRICS_WINDOW, METRICS_QUANTILES
+from tracing import record_span
+
+logger = logging.getLogger("Metrics")
+
+# Stages reported even before their first sample, in pipeline order
+STAGES = (
+    "camera_acquire",
+    "capture",
+    "detect",
+    "encode",
+    "liveness",
+    "gallery_lookup",
+    "backend_call",
+    "relay_actuation"
+)
+
+METRIC_NAME = "door_stage_duration_seconds"
+
+
+class StageHistogram:
+    """Latency samples of one stage: a window of recent ones plus lifetime totals"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """
+        Nearest-rank quantile of the recent samples.
+
+        Args:
+            q: Quantile between 0 and 1
+
+        Returns:
+            float: The quantile in seconds, or None without samples
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = min(max(math.ceil(q * len(samples)), 1), len(samples))
+        return samples[rank - 1]
+
+
+class StageMetrics:
+    """Thread-safe registry of per-stage latency histograms"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._histograms = {stage: StageHistogram(window) for stage in STAGES}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def observe(self, stage, seconds):
+        """
+        Record one stage duration.
+
+        Args:
+            stage: Stage name, normally one of STAGES
+            seconds: How long the stage took
+        """
+        captured = getattr(self._local, "captured", None)
+        if captured is not None:
+            captured.append((stage, seconds))
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = StageHistogram(self.window)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Record how long the body of a with-block takes, even if it raises"""
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(stage, elapsed)
+            record_span(stage, "stage", started_at, started_at + elapsed)
+
+    @contextmanager
+    def capture(self):
+        """
+        Collect this thread's observations in a list instead of recording them.
+
+        Used in worker processes, whose samples would otherwise be lost: the worker
+        returns the list and the parent records it with merge().
+        """
+        captured = []
+        self._local.captured = captured
+        try:
+            yield captured
+        finally:
+            self._local.captured = None
+
+    def merge(self, samples):
+        """Record (stage, seconds) samples collected by capture()"""
+        for stage, seconds in samples or []:
+            self.observe(stage, seconds)
+
+    def snapshot(self):
+        """
+        Current quantiles of every stage.
+
+        Returns:
+            dict: stage -> {"count", "sum", and one entry per quantile}
+        """
+        with self._lock:
+            return {
+                stage: dict(
+                    count=histogram.count,
+                    sum=histogram.total,
+                    **{str(q): histogram.quantile(q) for q in METRICS_QUANTILES}
+                )
+                for stage, histogram in self._histograms.items()
+            }
+
+    def render_prometheus(self):
+        """
+        The metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: A summary per stage; quantiles are NaN for stages without samples
+        """
+        lines = [
+            f"# HELP {METRIC_NAME} Duration of each door entry stage in seconds.",
+            f"# TYPE {METRIC_NAME} summary"
+        ]
+        for stage, values in self.snapshot().items():
+            for q in METRICS_QUANTILES:
+                value = values[str(q)]
+                lines.append(f'{METRIC_NAME}{{stage="{stage}",quantile="{q}"}} '
+                             f'{"NaN" if value is None else format(value, ".6f")}')
+            lines.append(f'{METRIC_NAME}_sum{{stage="{stage}"}} {values["sum"]:.6f}')
+            lines.append(f'{METRIC_NAME}_count{{stage="{stage}"}} {values["count"]}')
+        return "\n".join(lines) + "\n"
+
+
+# Global instance
+stage_metrics = StageMetrics()
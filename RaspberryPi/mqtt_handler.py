@@ -7,9 +7,26 @@ import socket
 import paho.mqtt.client as mqtt
 import logging
 from threading import Thread, Event
+from tracing import activate, span, trace_headers
 
 logger = logging.getLogger(__name__)
 
+def parse_door_command(payload):
+    """
+    Split a door command payload into (command, trace_id).
+
+    Commands arrive either as a plain string ("unlock_door") or as JSON with a
+    "command" and the "trace_id" of the entry that sent it.
+    """
+    text = payload.decode() if isinstance(payload, bytes) else payload
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text, None
+    if isinstance(data, dict):
+        return data.get("command"), data.get("trace_id")
+    return text, None
+
 # Define callback functions for MQTT events
 def on_connect(client, userdata, flags, rc, properties=None):
     """Callback for when the client connects to the MQTT broker"""
@@ -54,11 +71,17 @@ def process_door_command(payload):
         # This would integrate with the door control system
 
 class MQTTHandler:
-    def __init__(self, app, door_controller):
+    def __init__(self, app, door_controller, schedule_engine=None):
         self.app = app
         self.door_controller = door_controller
+        self.schedule_engine = schedule_engine
         self.schedule = {}
         self.pending_verifications = {}
+        # Version of the last retained policy snapshot applied from the backend
+        self.policy_version = 0
+        self.policy_received = Event()
+        # Optional callback run after the door is unlocked by an MQTT command
+        self.on_remote_unlock = None
         
         # MQTT Configuration
         self.app.config['MQTT_BROKER_URL'] = os.getenv("MQTT_BROKER_URL")
@@ -88,7 +111,7 @@ class MQTTHandler:
                 print(f"[DEBUG] Attempting to subscribe to door/commands and other topics")
                 self.mqtt.subscribe([
                     ("door/commands", 1),
-                    ("door/schedule", 1),
+                    ("door/policy", 1),
                     (f"door/otp/response/+", 1),
                     ("door/otp/verify", 1)
                 ])
@@ -110,64 +133,71 @@ class MQTTHandler:
                         self.pending_verifications[phone_number]["event"].set()
 
                 elif message.topic == "door/commands":
-                    command = message.payload.decode()
+                    command, trace_id = parse_door_command(message.payload)
                     print(f"[DEBUG] Received door command: {command}")
-                    if command == "unlock_door":
-                        print(f"[DEBUG] Executing unlock_door command")
-                        self.door_controller.unlock_door()
-                        print(f"[DEBUG] Door unlock command executed successfully")
-                    elif command == "lock_door":
-                        print(f"[DEBUG] Executing lock_door command")
-                        self.door_controller.lock_door()
-                        print(f"[DEBUG] Door lock command executed successfully")
-                    else:
-                        print(f"[WARNING] Unknown door command received: {command}")
+                    with activate(trace_id), span(f"mqtt {message.topic}", "mqtt", command=command):
+                        if command == "unlock_door":
+                            print(f"[DEBUG] Executing unlock_door command")
+                            self.door_controller.unlock_door()
+                            print(f"[DEBUG] Door unlock command executed successfully")
+                        elif command == "lock_door":
+                            print(f"[DEBUG] Executing lock_door command")
+                            self.door_controller.lock_door()
+                            print(f"[DEBUG] Door lock command executed successfully")
+                        else:
+                            print(f"[WARNING] Unknown door command received: {command}")
 
-                elif message.topic == "door/schedule":
-                    schedule_data = json.loads(message.payload.decode())
-                    print(f"[DEBUG] Received schedule data: {schedule_data}")
-                    self.update_schedule(schedule_data)
-                    print(f"[DEBUG] Updated schedule: {self.schedule}")
+                elif message.topic == "door/policy":
+                    snapshot = json.loads(message.payload.decode())
+                    self.apply_policy_snapshot(snapshot)
 
                 elif message.topic == "door/otp/verify":
+                    trace_id = None
                     try:
                         payload = json.loads(message.payload.decode())
                         phone_number = payload.get("phone_number")
                         otp_code = payload.get("otp_code")
+                        trace_id = payload.get("trace_id")
                         print(f"[DEBUG] Received OTP verification request for {phone_number}")
 
-                        # Send verification request to backend
-                        response = requests.post(
-                            f"{os.getenv('BACKEND_URL')}/check-verification-RPI",
-                            json={"phone_number": phone_number, "otp_code": otp_code}
-                        )
-                        response_data = response.json()
-                        print(f"[DEBUG] Backend verification response: {response_data}")
+                        with activate(trace_id), span(f"mqtt {message.topic}", "mqtt"):
+                            # Send verification request to backend
+                            with span("POST /check-verification-RPI", "http"):
+                                response = requests.post(
+                                    f"{os.getenv('BACKEND_URL')}/check-verification-RPI",
+                                    json={"phone_number": phone_number, "otp_code": otp_code},
+                                    headers=trace_headers()
+                                )
+                            response_data = response.json()
+                            print(f"[DEBUG] Backend verification response: {response_data}")
 
-                        # Handle different access scenarios
-                        if response_data.get("status") == "approved":
-                            # Door is unlocked (either globally or through verification)
-                            self.door_controller.unlock_door()
-                            # Publish success response
-                            client.publish(f"door/otp/response/{phone_number}", json.dumps({
-                                "phone_number": phone_number,
-                                "status": "approved",
-                                "message": response_data.get("message", "Door unlocked")
-                            }))
-                        else:
-                            # Access denied
-                            client.publish(f"door/otp/response/{phone_number}", json.dumps({
-                                "phone_number": phone_number,
-                                "status": "denied",
-                                "message": response_data.get("message", "Access denied")
-                            }))
+                            # Handle different access scenarios
+                            if response_data.get("status") == "approved":
+                                # Door is unlocked (either globally or through verification)
+                                self.door_controller.unlock_door()
+                                # Publish success response
+                                client.publish(f"door/otp/response/{phone_number}", json.dumps({
+                                    "phone_number": phone_number,
+                                    "status": "approved",
+                                    "message": response_data.get("message", "Door unlocked"),
+                                    "trace_id": trace_id
+                                }))
+                            else:
+                                # Access denied
+                                client.publish(f"door/otp/response/{phone_number}", json.dumps({
+                                    "phone_number": phone_number,
+                                    "status": "denied",
+                                    "message": response_data.get("message", "Access denied"),
+                                    "trace_id": trace_id
+                                }))
 
                     except Exception as e:
                         print(f"[ERROR] Error handling OTP verification: {e}")
                         client.publish(f"door/otp/response/{phone_number}", json.dumps({
                             "phone_number": phone_number,
                             "status": "error",
-                            "message": str(e)
+                            "message": str(e),
+                            "trace_id": trace_id
                         }))
 
             except Exception as e:
@@ -182,22 +212,41 @@ class MQTTHandler:
         @self.mqtt.on_topic('door/commands')
         def handle_door_command(client, userdata, message):
             print(f"[DEBUG] Direct door command received: {message.payload.decode()}")
-            command = message.payload.decode()
+            command, trace_id = parse_door_command(message.payload)
             
             try:
-                if command == "unlock_door":
-                    print(f"[DEBUG] Explicitly unlocking door from dedicated handler")
-                    self.door_controller.unlock_door()
-                    print(f"[DEBUG] Door unlock command executed successfully (dedicated handler)")
-                elif command == "lock_door":
-                    print(f"[DEBUG] Explicitly locking door from dedicated handler")
-                    self.door_controller.lock_door()
-                    print(f"[DEBUG] Door lock command executed successfully (dedicated handler)")
-                else:
-                    print(f"[WARNING] Unknown door command received in dedicated handler: {command}")
+                with activate(trace_id), span(f"mqtt {message.topic}", "mqtt", command=command):
+                    if command == "unlock_door":
+                        print(f"[DEBUG] Explicitly unlocking door from dedicated handler")
+                        self.door_controller.unlock_door()
+                        print(f"[DEBUG] Door unlock command executed successfully (dedicated handler)")
+                        if self.on_remote_unlock:
+                            self.on_remote_unlock()
+                    elif command == "lock_door":
+                        print(f"[DEBUG] Explicitly locking door from dedicated handler")
+                        self.door_controller.lock_door()
+                        print(f"[DEBUG] Door lock command executed successfully (dedicated handler)")
+                    else:
+                        print(f"[WARNING] Unknown door command received in dedicated handler: {command}")
             except Exception as e:
                 print(f"[ERROR] Error executing door command in dedicated handler: {e}")
 
+    def apply_policy_snapshot(self, snapshot):
+        """Apply a retained policy snapshot published by the backend, ignoring stale versions"""
+        version = snapshot.get("version", 0)
+        if version <= self.policy_version:
+            logger.info(f"Ignoring policy snapshot version {version} (current {self.policy_version})")
+            return
+        if "schedule" in snapshot:
+            self.update_schedule(snapshot["schedule"])
+        self.policy_version = version
+        self.policy_received.set()
+        logger.info(f"Applied policy snapshot version {version}")
+
+    def wait_for_policy(self, timeout):
+        """Block until a policy snapshot has been applied; returns False on timeout"""
+        return self.policy_received.wait(timeout)
+
     def update_schedule(self, data):
         try:
             if not isinstance(data, list):
@@ -234,6 +283,8 @@ class MQTTHandler:
             # Update the schedule
             self.schedule = new_schedule
             logger.info(f"Schedule updated with {len(new_schedule)} days")
+            if self.schedule_engine is not None:
+                self.schedule_engine.update(new_schedule)
             return {"status": "success", "message": f"Schedule updated with {len(new_schedule)} days"}, 200
         except Exception as e:
             logger.error(f"Error updating schedule: {e}")
@@ -0,0 +1,343 @@
+"""
+Recognition pipeline helpers for the Pi web routes.
+Holds the pieces of a recognition attempt that don't depend on Flask or the
+shared camera: fetching the face gallery from the backend, encoding and
+liveness-checking a single face, and matching an encoding against the gallery.
+"""
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+import requests
+from camera_config import BACKEND_MIN_TIMEOUT
+from face_encoding import DEFAULT_ENCODER
+from burst_liveness import check_burst_liveness
+from deadline import DeadlineExceeded
+from metrics import stage_metrics
+from tracing import bind, trace_headers
+
+logger = logging.getLogger("RecognitionPipeline")
+
+# Early exit: a face this close to a gallery entry (as a fraction of the
+# encoder's tolerance) is accepted from a single frame without waiting for the burst
+EARLY_EXIT_TOLERANCE_RATIO = 0.75
+# Only faces at least this good are tried for an early exit (see frame_quality)
+EARLY_EXIT_MIN_QUALITY = 0.6
+# Cap on single-frame attempts so a poor match doesn't encode every frame
+EARLY_EXIT_MAX_ATTEMPTS = 2
+
+# Fusion: encodings further than this fraction of the encoder's tolerance from
+# the burst's median embedding are treated as outliers and left out
+FUSION_OUTLIER_RATIO = 0.5
+
+FaceAnalysis = namedtuple("FaceAnalysis", ["encoding", "liveness", "is_live"])
+
+
+class Gallery:
+    """Face gallery for the active encoder, as returned by /get-user-encodings"""
+
+    OK = "ok"
+    EMPTY = "empty"
+    ERROR = "error"
+
+    def __init__(self, status, users=None, error=None):
+        self.status = status
+        self.users = users or []
+        self.error = error
+        self.encodings = None
+        if self.users:
+            self.encodings = np.array([np.asarray(user["face_encoding"], dtype=np.float64) for user in self.users])
+
+    def best_match(self, encoding):
+        """
+        Find the closest gallery entry.
+
+        Args:
+            encoding: Face encoding to match
+
+        Returns:
+            tuple: (index, distance), or (None, None) if the gallery is empty
+        """
+        if self.encodings is None or len(self.encodings) == 0:
+            return None, None
+        with stage_metrics.time("gallery_lookup"):
+            distances = np.linalg.norm(self.encodings - np.asarray(encoding, dtype=np.float64), axis=1)
+            index = int(np.argmin(distances))
+        return index, float(distances[index])
+
+
+def fetch_gallery(api_url, encoder, max_retries=2, timeout=10, deadline=None):
+    """
+    Fetch the users whose faces were enrolled with the active encoder.
+
+    Args:
+        api_url: Backend API URL
+        encoder: Active FaceEncoder; entries from other encoders are skipped
+        max_retries: Number of attempts before giving up
+        timeout: Timeout in seconds for each request
+        deadline: Optional Deadline of the attempt; requests and retries never outlast it
+
+    Returns:
+        Gallery: With status OK, EMPTY (nobody to match against) or ERROR
+    """
+    for attempt in range(max_retries):
+        request_timeout = timeout
+        if deadline is not None:
+            if deadline.remaining() < BACKEND_MIN_TIMEOUT:
+                logger.warning("Not enough time left before the deadline to query the backend")
+                break
+            request_timeout = deadline.timeout(timeout)
+        try:
+            logger.info(f"Attempt {attempt+1} to get known encodings from backend")
+            with stage_metrics.time("backend_call"):
+                response = requests.get(f"{api_url}/get-user-encodings", timeout=request_timeout,
+                                        headers=trace_headers())
+
+            if response.status_code == 200:
+                users = response.json().get('users', [])
+                logger.info(f"Successfully retrieved {len(users)} known face encodings")
+                # Keep only galleries produced by the active encoder with a usable encoding
+                users = [user for user in users
+                         if user.get('encoder', DEFAULT_ENCODER) == encoder.name
+                         and isinstance(user.get('face_encoding'), list)
+                         and encoder.accepts(user['face_encoding'])]
+                if not users:
+                    logger.info(f"No users registered with the {encoder.name} encoder")
+                    return Gallery(Gallery.EMPTY)
+                logger.info(f"Processed {len(users)} face encodings")
+                return Gallery(Gallery.OK, users)
+            elif response.status_code == 404:
+                # No registered users with face encodings in the system
+                logger.info("No users with registered faces found in the system")
+                return Gallery(Gallery.EMPTY)
+            else:
+                logger.error(f"Failed to get known encodings: {response.status_code}, {response.text}")
+        except Exception as e:
+            logger.error(f"Error getting known encodings: {str(e)}")
+
+        if attempt + 1 < max_retries:
+            sleep_time = (attempt + 1) * 2  # progressive backoff
+            if deadline is not None and deadline.remaining() < sleep_time + BACKEND_MIN_TIMEOUT:
+                logger.warning("No time left before the deadline to retry the backend")
+                break
+            logger.info(f"Retrying in {sleep_time} seconds...")
+            time.sleep(sleep_time)
+
+    logger.error("Failed to get known encodings after maximum retries")
+    return Gallery(Gallery.ERROR, error="Failed to get known encodings from backend")
+
+
+def analyse_face(frame, location, encoder, liveness_detector):
+    """
+    Encode and liveness-check one face.
+
+    Args:
+        frame: FrameContext (or BGR image) the face was detected in
+        location: Face location (top, right, bottom, left)
+        encoder: FaceEncoder to use
+        liveness_detector: LivenessDetector to use
+
+    Returns:
+        FaceAnalysis: encoding is None if the face could not be encoded
+    """
+    encoding = None
+    start_time = time.time()
+    try:
+        with stage_metrics.time("encode"):
+            encodings = encoder.encode(frame, [location])
+        if encodings:
+            encoding = encodings[0]
+        logger.info(f"Face encoding completed in {time.time() - start_time:.2f} seconds")
+    except Exception as e:
+        logger.error(f"Error during face encoding: {e}")
+
+    start_time = time.time()
+    try:
+        with stage_metrics.time("liveness"):
+            liveness = liveness_detector.check_face_liveness(frame, location)
+    except Exception as e:
+        logger.error(f"Error during liveness check: {e}")
+        liveness = {"is_live": False, "error": str(e)}
+    logger.info(f"Liveness check completed in {time.time() - start_time:.2f} seconds")
+
+    return FaceAnalysis(encoding, liveness, bool(liveness.get("is_live", False)))
+
+
+def encode_face(frame, location, encoder):
+    """Encode one face, returning None if it could not be encoded"""
+    try:
+        with stage_metrics.time("encode"):
+            encodings = encoder.encode(frame, [location])
+        return encodings[0] if encodings else None
+    except Exception as e:
+        logger.error(f"Error during face encoding: {e}")
+        return None
+
+
+def fuse_encodings(encodings, tolerance):
+    """
+    Fuse several encodings of the same face into one.
+
+    Each encoding is normalized to unit length. Encodings far from the
+    element-wise median (which a single bad frame can't drag around) are rejected
+    as outliers and the rest are averaged. The result is scaled back to the
+    average encoding length so match distances stay comparable.
+
+    Args:
+        encodings: List of encodings of the same person
+        tolerance: The encoder's match tolerance
+
+    Returns:
+        tuple: (fused encoding, number of encodings used), or (None, 0)
+    """
+    encodings = [np.asarray(e, dtype=np.float64) for e in encodings if e is not None]
+    if not encodings:
+        return None, 0
+    if len(encodings) == 1:
+        return encodings[0], 1
+
+    stacked = np.vstack(encodings)
+    norms = np.linalg.norm(stacked, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    unit = stacked / norms
+
+    center = np.median(unit, axis=0)
+    deviations = np.linalg.norm(stacked - center * norms.mean(), axis=1)
+    inliers = deviations <= tolerance * FUSION_OUTLIER_RATIO
+    if not inliers.any():
+        # Nothing agrees with the median; trust the closest encoding alone
+        inliers[np.argmin(deviations)] = True
+    if not inliers.all():
+        logger.info(f"Rejected {int((~inliers).sum())} of {len(encodings)} encodings as outliers")
+
+    fused = unit[inliers].mean(axis=0)
+    fused_norm = np.linalg.norm(fused)
+    if fused_norm > 0:
+        fused = fused / fused_norm * norms[inliers].mean()
+    return fused, int(inliers.sum())
+
+
+def check_burst(frames, faces, liveness_detector, analyses):
+    """
+    Liveness-check the same person across the burst, reusing checks already done.
+
+    Args:
+        frames: List of FrameContexts the faces were detected in
+        faces: FaceQuality entries of the person, best first
+        liveness_detector: LivenessDetector to use
+        analyses: Dict of (frame_index, face_index) -> FaceAnalysis already computed
+
+    Returns:
+        dict: Burst liveness result (see burst_liveness.check_burst_liveness)
+    """
+    samples = [(frames[face.frame_index], face.location) for face in faces]
+    known_results = {}
+    for index, face in enumerate(faces):
+        known = analyses.get((face.frame_index, face.face_index))
+        if known is not None and known.liveness is not None:
+            known_results[index] = known.liveness
+    with stage_metrics.time("liveness"):
+        return check_burst_liveness(samples, liveness_detector, known_results)
+
+
+def _wait(future, deadline):
+    return future.result(timeout=deadline.remaining() if deadline is not None else None)
+
+
+def analyse_fused(frames, faces, encoder, liveness_detector, analyses, liveness_faces=None, deadline=None):
+    """
+    Liveness-check the person and encode all selected faces in parallel.
+
+    With a deadline, faces whose encodings aren't ready in time are left out
+    of the fusion; the best face's encoding and the liveness verdict can't be
+    done without.
+
+    Args:
+        frames: List of FrameContexts the faces were detected in
+        faces: FaceQuality entries to fuse, best first
+        encoder: FaceEncoder to use
+        liveness_detector: LivenessDetector to use
+        analyses: Dict of (frame_index, face_index) -> FaceAnalysis already computed
+        liveness_faces: Optional FaceQuality entries of the person across the whole
+                        burst; if given, liveness is decided over all of them
+        deadline: Optional Deadline of the attempt
+
+    Returns:
+        tuple: (FaceAnalysis with the fused encoding, number of encodings fused)
+
+    Raises:
+        DeadlineExceeded: If the best face or the liveness verdict isn't ready in time
+    """
+    best = faces[0]
+    best_analysis = analyses.get((best.frame_index, best.face_index))
+    encodings = {}
+    pool = ThreadPoolExecutor(max_workers=len(faces) + 1)
+    try:
+        liveness_future = None
+        if liveness_faces:
+            liveness_future = pool.submit(bind(check_burst), frames, liveness_faces, liveness_detector, analyses)
+        best_future = None
+        if best_analysis is None:
+            if liveness_future is None:
+                best_future = pool.submit(bind(analyse_face), frames[best.frame_index], best.location, encoder, liveness_detector)
+            else:
+                best_future = pool.submit(bind(encode_face), frames[best.frame_index], best.location, encoder)
+        futures = {}
+        for face in faces[1:]:
+            known = analyses.get((face.frame_index, face.face_index))
+            if known is not None:
+                encodings[face.frame_index] = known.encoding
+            else:
+                futures[face.frame_index] = pool.submit(bind(encode_face), frames[face.frame_index], face.location, encoder)
+        if best_future is not None:
+            try:
+                best_analysis = _wait(best_future, deadline)
+            except FutureTimeoutError:
+                raise DeadlineExceeded("Recognition deadline exceeded while encoding the best face")
+            if liveness_future is not None:
+                best_analysis = FaceAnalysis(best_analysis, None, False)
+        for frame_index, future in futures.items():
+            try:
+                encodings[frame_index] = _wait(future, deadline)
+            except FutureTimeoutError:
+                logger.warning(f"Encoding of frame {frame_index} not ready before the deadline, fusing without it")
+        if liveness_future is not None:
+            try:
+                liveness = _wait(liveness_future, deadline)
+            except FutureTimeoutError:
+                raise DeadlineExceeded("Recognition deadline exceeded during the liveness check")
+            best_analysis = best_analysis._replace(liveness=liveness, is_live=bool(liveness.get("is_live", False)))
+    finally:
+        # Don't block on work the deadline has given up on
+        pool.shutdown(wait=False)
+
+    if best_analysis.encoding is None:
+        return best_analysis, 0
+    fused, used = fuse_encodings([best_analysis.encoding] + list(encodings.values()), encoder.tolerance)
+    return best_analysis._replace(encoding=fused), used
+
+
+def apply_match(result, gallery, index, distance):
+    """Record the matched gallery user in a recognition result"""
+    user = gallery.users[index]
+    confidence = float(1 - distance)
+    low_security = user.get('low_security', False)
+
+    result["recognized"] = True
+    result["user_name"] = user['name']
+    result["user_id"] = user['id']
+    result["is_allowed"] = user.get('is_allowed', False)
+    result["low_security"] = low_security
+    result["confidence"] = confidence
+    result["match_distance"] = float(distance)
+    result['matched_users'] = [{
+        'name': user['name'],
+        'confidence': confidence,
+        'user_id': user['id'],
+        'phone_number': user.get('phone_number', user['id']),
+        'is_allowed': result["is_allowed"],
+        'low_security': low_security
+    }]
+    result['face_recognized'] = True
+    logger.info(f"Face recognized as {user['name']} (ID: {user['id']}) with confidence {confidence:.2f}, approved: {result['is_allowed']}, low_security: {low_security}")
@@ -1,41 +1,262 @@
 """
 Recognition state management for face recognition
 """
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from camera_config import JOB_RESULT_TTL, MAX_STORED_JOBS, JOB_SUPERSEDE_WAIT, RECOGNITION_DEADLINE
+from deadline import Deadline
+from tracing import current_trace_id, new_trace_id
+
+logger = logging.getLogger("RecognitionState")
+
+
+class RecognitionCancelled(Exception):
+    """Raised at a checkpoint of a recognition job that has been cancelled"""
+
+
+class RecognitionJob:
+    """One recognition attempt with its own id, deadline, progress, result and cancellation token"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+    def __init__(self, state, kind, previous=None):
+        self.state = state
+        self.job_id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.status = self.QUEUED
+        self.progress = None
+        self.result = None
+        self.result_event = None  # Published status payload, replayed to late subscribers
+        self.created_at = time.time()
+        self.deadline = Deadline(RECOGNITION_DEADLINE)  # Restarted once a superseded job has stopped
+        self.trace_id = current_trace_id() or new_trace_id()  # Trace of the door entry
+        self.finished_at = None
+        self.cancel_reason = None
+        self.previous = previous  # Superseded job this one waits for
+        self.face_encoding = None  # Kept for this session's registration
+        self.face_id = None  # Face ID for correlation
+        self._cancel_event = threading.Event()
+        self.done = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self, reason="cancelled"):
+        if self.done.is_set() or self.cancelled or self.result_event is not None:
+            # Finished, or its result is already out: nothing left to stop
+            return
+        self.cancel_reason = reason
+        self._cancel_event.set()
+        logger.info(f"Cancelling recognition job {self.job_id}: {reason}")
+
+    def wait_for_previous(self, timeout=JOB_SUPERSEDE_WAIT):
+        """
+        Wait for the superseded job to stop before taking over the camera.
+
+        The wait is not part of the attempt's budget: the deadline starts afresh once it is over.
+        """
+        if self.previous is not None:
+            if not self.previous.done.wait(timeout):
+                logger.warning(f"Job {self.previous.job_id} still running after {timeout}s, starting {self.job_id} anyway")
+            self.previous = None
+            self.deadline = Deadline(RECOGNITION_DEADLINE)
+        self.checkpoint()
+        self.status = self.RUNNING
+
+    def checkpoint(self, progress=None):
+        """
+        Mark a stage boundary: record progress and stop here if the job was cancelled.
+
+        Args:
+            progress: Optional progress percentage reached
+
+        Raises:
+            RecognitionCancelled: If the job has been cancelled
+        """
+        if self.cancelled:
+            raise RecognitionCancelled(self.cancel_reason)
+        if progress is not None:
+            self.progress = progress
+            self.state._job_progress(self)
+
+    def set_result(self, result):
+        self.result = result
+        self.state._job_result(self)
+
+    def publish_result(self, payload):
+        """Send the job's final status payload to event subscribers"""
+        payload = dict(payload, job_id=self.job_id)
+        self.result_event = payload
+        self.state.publish("result", payload)
+
+    def finish(self):
+        self.status = self.CANCELLED if self.cancelled else self.DONE
+        self.finished_at = time.time()
+        self.done.set()
+        self.state._job_finished(self)
+
 
 class RecognitionState:
     """A centralized state manager for face recognition process"""
-    
+
     def __init__(self):
-        self.recognition_running = False
+        self._subscribers = []
+        self._subscribers_lock = threading.Lock()
+        self._jobs_lock = threading.RLock()
+        self.jobs = OrderedDict()  # job_id -> RecognitionJob, oldest first
+        self.current_job = None
         self.face_recognition_active = False
         self.face_recognition_result = None
         self.recognition_thread = None
         self.face_recognition_progress = None
-        self.temp_face_encoding = None  # Store face encoding temporarily
-        self.temp_face_id = None  # Store face ID for correlation
-        
+
     def reset(self):
-        """Reset the recognition state"""
-        self.recognition_running = False
-        self.face_recognition_active = False
-        self.face_recognition_result = None
-        self.recognition_thread = None
-        self.face_recognition_progress = None
-        # Note: Don't reset temp_face_encoding here as it needs to persist
-        
-    def store_face_encoding(self, face_encoding, face_id=None):
-        """Store face encoding for later use in registration"""
-        self.temp_face_encoding = face_encoding
-        self.temp_face_id = face_id
-        
-    def get_face_encoding(self):
-        """Get stored face encoding"""
-        return self.temp_face_encoding
-        
-    def clear_face_encoding(self):
-        """Clear stored face encoding"""
-        self.temp_face_encoding = None
-        self.temp_face_id = None
-        
+        """Reset the recognition state, cancelling the current job"""
+        with self._jobs_lock:
+            if self.current_job is not None:
+                self.current_job.cancel("recognition state reset")
+            self.current_job = None
+            self.face_recognition_active = False
+            self.face_recognition_result = None
+            self.recognition_thread = None
+            self.face_recognition_progress = None
+        # Stored face encodings live on their jobs, so they survive a reset
+
+    @property
+    def recognition_running(self):
+        """Whether the current job is still queued or running"""
+        job = self.current_job
+        return job is not None and not job.done.is_set()
+
+    def start_job(self, kind="kiosk", supersede=True):
+        """
+        Create a recognition job and make it the current one.
+
+        Args:
+            kind: "kiosk" or "hands_free", for logs
+            supersede: Cancel a running job instead of refusing to start
+
+        Returns:
+            RecognitionJob: The new job, or None if a job is running and supersede is False
+        """
+        with self._jobs_lock:
+            self._prune()
+            previous = self.current_job
+            if previous is not None and not previous.done.is_set():
+                if not supersede:
+                    return None
+                previous.cancel(f"superseded by a new {kind} attempt")
+            else:
+                previous = None
+            job = RecognitionJob(self, kind, previous)
+            self.jobs[job.job_id] = job
+            self.current_job = job
+            self.face_recognition_active = True
+            self.face_recognition_result = None
+            self.face_recognition_progress = None
+        logger.info(f"Started {kind} recognition job {job.job_id}")
+        return job
+
+    def get_job(self, job_id):
+        with self._jobs_lock:
+            self._prune()
+            return self.jobs.get(job_id) if job_id else None
+
+    def cancel_job(self, job_id=None, reason="cancelled"):
+        """Cancel a job by id, or the current job. Returns True if a job was found"""
+        job = self.get_job(job_id) if job_id else self.current_job
+        if job is None:
+            return False
+        job.cancel(reason)
+        return True
+
+    def _prune(self):
+        """Drop finished jobs past their TTL, and the oldest finished ones beyond the size limit"""
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.finished_at is not None]
+        expired = [job for job in finished if now - job.finished_at > JOB_RESULT_TTL]
+        excess = len(self.jobs) - len(expired) - MAX_STORED_JOBS
+        if excess > 0:
+            expired += [job for job in finished if job not in expired][:excess]
+        for job in expired:
+            if job is not self.current_job:
+                del self.jobs[job.job_id]
+
+    # The legacy fields mirror the current job only, so a superseded job
+    # finishing late can't overwrite its successor's state
+
+    def _job_progress(self, job):
+        with self._jobs_lock:
+            if job is self.current_job:
+                self.face_recognition_progress = job.progress
+        self.publish("progress", {"job_id": job.job_id, "progress": job.progress})
+
+    def _job_result(self, job):
+        with self._jobs_lock:
+            if job is self.current_job:
+                self.face_recognition_result = job.result
+                self.face_recognition_active = False
+
+    def _job_finished(self, job):
+        with self._jobs_lock:
+            if job is self.current_job:
+                self.face_recognition_active = False
+        logger.info(f"Recognition job {job.job_id} {job.status}")
+
+    def subscribe(self):
+        """
+        Register for recognition events.
+
+        Returns:
+            queue.Queue: Receives (event, data) tuples as they are published
+        """
+        events = queue.Queue()
+        with self._subscribers_lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events):
+        with self._subscribers_lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+
+    def publish(self, event, data):
+        """Send an event ("progress" or "result") to every subscriber"""
+        with self._subscribers_lock:
+            for events in self._subscribers:
+                events.put((event, data))
+
+    # Face encodings for registration are kept on the job of the session that
+    # produced them, so one kiosk session can't register another's face
+
+    def store_face_encoding(self, job_id, face_encoding, face_id=None):
+        """Store face encoding on a job for later use in registration. Returns False if the job is gone"""
+        job = self.get_job(job_id)
+        if job is None:
+            return False
+        job.face_encoding = face_encoding
+        job.face_id = face_id
+        return True
+
+    def get_face_encoding(self, job_id):
+        """Get the face encoding stored on a job, or None"""
+        job = self.get_job(job_id)
+        return job.face_encoding if job is not None else None
+
+    def clear_face_encoding(self, job_id):
+        """Clear the face encoding stored on a job"""
+        job = self.get_job(job_id)
+        if job is not None:
+            job.face_encoding = None
+            job.face_id = None
+
 # Global instance
-recognition_state = RecognitionState() 
\ No newline at end of file
+recognition_state = RecognitionState()
@@ -1,4 +1,4 @@
-from flask import render_template, request, redirect, url_for, flash, session as flask_session, jsonify, Response, current_app
+from flask import render_template, request, redirect, url_for, flash, session as flask_session, jsonify, Response, current_app, send_from_directory, g
 from datetime import datetime
 import time
 from utils import verify_otp_rest
@@ -8,6 +8,8 @@ import os
 import json
 import base64
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import traceback
 import numpy as np
 import uuid
@@ -16,9 +18,27 @@ import io
 import platform
 import copy
 import requests
-# Rename this import to avoid shadowing with a potential function
-import face_recognition as face_recog
-from recognition_state import recognition_state
+from recognition_state import recognition_state, RecognitionCancelled
+from face_detection import create_face_detector
+from face_encoding import create_face_encoder
+from frame_quality import rank_faces, select_fusion_faces
+from frame_context import FrameContext
+from blink_detector import BlinkDetector, verdict_matches
+from face_tracker import FaceTracker
+from hands_free import HandsFreeMonitor
+from camera_config import (
+    FUSION_FRAMES, MIN_BLINKS_REQUIRED, HANDS_FREE_ENABLED, DEADLINE_ANALYSIS_RESERVE, PIPELINE_STOP_TIMEOUT
+)
+from deadline import DeadlineExceeded
+from debug_writer import get_debug_writer, PreviewStore
+from incident_recorder import IncidentRecorder, INCIDENT_CLIPS_DIR, clip_url
+from metrics import stage_metrics
+from tracing import TRACE_HEADER, start_trace, set_trace_id, current_trace_id, activate, bind, span, record_span
+from staged_pipeline import StagedRecognitionPipeline, DetectionEvent
+from recognition_pipeline import (
+    fetch_gallery, analyse_fused, check_burst, apply_match, Gallery,
+    EARLY_EXIT_TOLERANCE_RATIO, EARLY_EXIT_MIN_QUALITY, EARLY_EXIT_MAX_ATTEMPTS
+)
 import socket
 import pickle
 import gc
@@ -27,6 +47,12 @@ import gc
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("WebRoutes")
 
+# Seconds to wait for the retained MQTT policy snapshot before fetching the schedule over REST
+POLICY_FALLBACK_TIMEOUT = 15
+
+# Seconds between keepalive comments on an idle recognition event stream
+SSE_KEEPALIVE_INTERVAL = 15
+
 def setup_qt_environment():
     """Set up appropriate Qt environment variables based on available plugins"""
     try:
@@ -36,84 +62,36 @@ def setup_qt_environment():
     except Exception as e:
         logger.error(f"Error setting up Qt environment: {e}")
 
-def check_schedule(door_controller, mqtt_handler, backend_session=None, backend_url=None):
-    """Check if door should be unlocked based on current schedule"""
-    now = datetime.now()
-    weekday = now.strftime("%A")
-    logger.info(f"Checking schedule for {weekday}")
-
-    # Safely skip schedule check if handler has no schedule attribute
-    if not hasattr(mqtt_handler, 'schedule'):
-        logger.warning("MQTT handler has no schedule attribute; skipping schedule check")
-        return False
-        
-    # Check if schedule is empty
-    if not mqtt_handler.schedule:
-        logger.info("Schedule is empty; no scheduled unlocks defined")
+def check_schedule(mqtt_handler, backend_session=None, backend_url=None):
+    """
+    Check if the door is unlocked by the schedule.
+    The schedule engine evaluates the schedule at each transition and keeps the
+    door held open, so this only reads its precomputed state.
+    """
+    schedule_engine = getattr(mqtt_handler, 'schedule_engine', None)
+    if schedule_engine is None:
+        logger.warning("MQTT handler has no schedule engine; skipping schedule check")
         return False
 
-    if weekday in mqtt_handler.schedule:
-        entry = mqtt_handler.schedule[weekday]
-        logger.info(f"Found schedule entry for {weekday}: {entry}")
-        
-        open_time_str = entry.get("open_time")
-        close_time_str = entry.get("close_time")
-        force_unlocked = entry.get("forceUnlocked", False)
-
-        if force_unlocked:
-            logger.info(f"Force unlock is enabled for {weekday}. Unlocking door.")
-            door_controller.unlock_door()
-            flash("Door unlocked based on schedule.", "success")
-            
-            # Log door unlock via schedule if session is available
-            if backend_session and backend_url:
-                try:
-                    backend_session.post(f"{backend_url}/log-door-access", json={
-                        "method": "Schedule",
-                        "status": "Unlocked",
-                        "details": "Force unlocked"
-                    })
-                except Exception as e:
-                    logger.error(f"Error logging door access: {e}")
-            
-            return True
+    is_open, detail = schedule_engine.current_state()
+    if not is_open:
+        return False
 
-        if open_time_str and close_time_str:
-            try:
-                open_time = datetime.strptime(open_time_str, "%H:%M").time()
-                close_time = datetime.strptime(close_time_str, "%H:%M").time()
-                logger.info(f"Schedule times: Open={open_time}, Close={close_time}")
-            except ValueError as ve:
-                logger.error(f"Schedule time format error: {ve}")
-                flash("Schedule time format error.", "danger")
-                return False
+    logger.info(f"Door is unlocked by schedule ({detail})")
+    flash("Door unlocked based on schedule.", "success")
 
-            current_time = now.time().replace(second=0, microsecond=0)
-            logger.info(f"Current time: {current_time}")
+    # Log door access via schedule if session is available
+    if backend_session and backend_url:
+        try:
+            backend_session.post(f"{backend_url}/log-door-access", json={
+                "method": "Schedule",
+                "status": "Unlocked",
+                "details": detail
+            })
+        except Exception as e:
+            logger.error(f"Error logging door access: {e}")
 
-            if open_time <= current_time <= close_time:
-                logger.info(f"Door should be unlocked: current time {current_time} is within schedule {open_time}-{close_time}")
-                door_controller.unlock_door()
-                flash("Door unlocked based on schedule.", "success")
-                
-                # Log door unlock via schedule if session is available
-                if backend_session and backend_url:
-                    try:
-                        backend_session.post(f"{backend_url}/log-door-access", json={
-                            "method": "Schedule",
-                            "status": "Unlocked",
-                            "details": f"{weekday} {open_time_str}-{close_time_str}"
-                        })
-                    except Exception as e:
-                        logger.error(f"Error logging door access: {e}")
-                
-                return True
-            else:
-                logger.info(f"Door remains locked: current time {current_time} is outside schedule {open_time}-{close_time}")
-    else:
-        logger.info(f"No schedule entry found for {weekday}")
-        
-    return False
+    return True
 
 def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_url):
     # Set up Qt environment once at startup
@@ -122,20 +100,60 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
     # Define API URL for backend requests
     API_URL = backend_url
     
-    # Initialize schedule from backend
-    try:
-        logger.info("Fetching initial schedule from backend")
-        schedule_response = backend_session.get(f"{backend_url}/schedule")
-        if schedule_response.status_code == 200:
-            schedule_data = schedule_response.json()
-            logger.info(f"Successfully retrieved schedule with {len(schedule_data)} days")
-            mqtt_handler.update_schedule(schedule_data)
-            logger.info("Schedule initialized in MQTT handler")
-        else:
-            logger.warning(f"Failed to fetch initial schedule: {schedule_response.status_code}")
-    except Exception as e:
-        logger.error(f"Error initializing schedule: {e}")
+    # The schedule arrives as a retained MQTT policy snapshot on connect. Only fall
+    # back to REST, off the boot path, if the broker has nothing for us.
+    def fetch_schedule_fallback():
+        if mqtt_handler.wait_for_policy(POLICY_FALLBACK_TIMEOUT):
+            return
+        try:
+            logger.warning("No policy snapshot received over MQTT; fetching schedule from backend")
+            schedule_response = backend_session.get(f"{backend_url}/schedule", timeout=10)
+            if schedule_response.status_code == 200:
+                schedule_data = schedule_response.json()
+                logger.info(f"Successfully retrieved schedule with {len(schedule_data)} days")
+                mqtt_handler.update_schedule(schedule_data)
+            else:
+                logger.warning(f"Failed to fetch fallback schedule: {schedule_response.status_code}")
+        except Exception as e:
+            logger.error(f"Error fetching fallback schedule: {e}")
+
+    threading.Thread(target=fetch_schedule_fallback, daemon=True).start()
+
+    # Tracing: a request continues the trace of the caller (X-Trace-Id header) or of
+    # the entry the kiosk session is in. POSTs are the entry's steps and get a span;
+    # GETs are page loads, polling and streams.
+    @app.before_request
+    def activate_request_trace():
+        set_trace_id(request.headers.get(TRACE_HEADER) or flask_session.get('trace_id'))
+        g.request_started_at = time.time()
+
+    @app.after_request
+    def record_request_span(response):
+        if request.method == 'POST' and current_trace_id():
+            record_span(f"POST {request.path}", "pi", g.request_started_at, time.time(),
+                        status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def clear_request_trace(exception=None):
+        set_trace_id(None)
+
+    def start_entry_trace():
+        """Start the trace of a new door entry and keep it for the kiosk's follow-up requests"""
+        flask_session['trace_id'] = start_trace()
     
+    # Shared face detector and encoder for the recognition pipeline
+    face_detector = create_face_detector()
+    face_encoder = create_face_encoder()
+    # Follows faces on the live video feed (full detection only every few frames) and
+    # counts their blinks so liveness can be settled before the button is pressed
+    face_tracker = FaceTracker(face_detector)
+    blink_detector = BlinkDetector()
+    # Preview frames shown while recognition runs are served from memory
+    preview_store = PreviewStore()
+    # Recent frames kept in memory so denials and forced unlocks get a short clip
+    incident_recorder = IncidentRecorder()
+
     # Add integrated video feed with face recognition
     camera = None
     camera_lock = threading.Lock()
@@ -143,8 +161,13 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
     # Flag to track if cleanup is needed
     camera_needs_cleanup = False
     
-    def get_camera():
-        """Get or initialize camera with proper error handling and fallbacks"""
+    def get_camera(deadline=None):
+        """
+        Get or initialize camera with proper error handling and fallbacks.
+        
+        With a deadline, opening stops once it has passed and None is returned
+        instead of the fake camera.
+        """
         nonlocal camera, camera_needs_cleanup
         
         # If we already have a valid camera, return it
@@ -189,12 +212,18 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         camera_indices = list(dict.fromkeys(camera_indices))
         
         for idx in camera_indices:
+            if deadline is not None and deadline.expired:
+                logger.warning("Recognition deadline passed while opening the camera")
+                return None
             try:
                 logger.info(f"Attempting to open camera at index {idx}")
                 cam = cv2.VideoCapture(idx)
                 
                 # Give camera time to initialize
-                time.sleep(1.0)
+                if deadline is not None:
+                    deadline.sleep(1.0)
+                else:
+                    time.sleep(1.0)
                 
                 # Check if camera opened
                 if cam.isOpened():
@@ -379,11 +408,13 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             else:
                 # No recognition data available, just render the template
                 return render_template("door_unlocked.html")
-        elif response.get("status") == "error":
-            flash(response.get("message", "Incorrect OTP code. Please try again."), "danger")
-            return render_template("otp.html", phone_number=phone_number)
         else:
-            flash("Incorrect OTP code. Please try again.", "danger")
+            record_incident("otp_denied", phone_number, "OTP Verification", "Denied",
+                            response.get("message", "Incorrect OTP code"))
+            if response.get("status") == "error":
+                flash(response.get("message", "Incorrect OTP code. Please try again."), "danger")
+            else:
+                flash("Incorrect OTP code. Please try again.", "danger")
             return render_template("otp.html", phone_number=phone_number)
 
     @app.route('/update_schedule', methods=['POST'])
@@ -422,7 +453,7 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
     @app.route('/door_entry', methods=['GET', 'POST'])
     def door_entry():
         # First check if the door should be unlocked according to schedule
-        should_unlock = check_schedule(door_controller, mqtt_handler, backend_session, backend_url)
+        should_unlock = check_schedule(mqtt_handler, backend_session, backend_url)
         
         if should_unlock:
             # If scheduled unlock, open the door directly
@@ -437,12 +468,13 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
     def phone_entry():
         """Handle the phone number entry flow"""
         # Check schedule first
-        if check_schedule(door_controller, mqtt_handler, backend_session, backend_url):
+        if check_schedule(mqtt_handler, backend_session, backend_url):
             return render_template("door_unlocked.html")
 
         # If we get here, schedule check didn't unlock the door
         if request.method == "POST":
             # Handle POST request for OTP verification
+            start_entry_trace()
             phone_number = request.form.get('phone_number')
             if not phone_number:
                 flash("Phone number is required for verification.", "danger")
@@ -481,6 +513,8 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         
         # Reset recognition state
         reset_recognition_state()
+        face_tracker.reset()
+        blink_detector.reset()
         
         # Set the cleanup flag since we're initializing camera resources
         camera_needs_cleanup = True
@@ -498,6 +532,35 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         # Return the template
         return render_template("face_recognition.html")
     
+    def track_blinks(frame):
+        """Track faces in a live frame, update blink liveness and draw both on the frame"""
+        try:
+            context = FrameContext(frame)
+            tracks = face_tracker.update(context)
+            blink_states = blink_detector.update(context, [(track.track_id, track.location) for track in tracks])
+        except Exception as e:
+            logger.error(f"Error tracking blinks: {e}")
+            return
+        for track in tracks:
+            top, right, bottom, left = track.location
+            blinks, is_live = blink_states.get(track.track_id, (0, False))
+            color = (0, 255, 0) if is_live else (0, 255, 255)
+            label = "Liveness confirmed" if is_live else f"Blink to confirm: {min(blinks, MIN_BLINKS_REQUIRED)}/{MIN_BLINKS_REQUIRED}"
+            if track.recognition and track.recognition.get("name"):
+                label = f"{track.recognition['name']} - {label}"
+            cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+            cv2.putText(frame, label, (left, max(top - 10, 15)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+
+    def attach_recognition(result):
+        """Attach a finished recognition to the face being tracked on the feed"""
+        track = face_tracker.primary_track()
+        if track is not None:
+            face_tracker.attach(track.track_id, {
+                "recognized": result.get("recognized", False),
+                "name": result.get("user_name"),
+                "user_id": result.get("user_id")
+            })
+
     @app.route('/video_feed')
     def video_feed():
         """
@@ -525,6 +588,7 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             try:
                 while True:
                     frame = None
+                    live_frame = False
                     current_time = time.time()
                     
                     # If face recognition is active, don't try to use the camera
@@ -566,6 +630,9 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                                         frame = np.zeros((480, 640, 3), dtype=np.uint8)
                                         cv2.putText(frame, "Failed to read frame", (50, 240), 
                                                    font, font_scale, font_color, line_type)
+                                    else:
+                                        incident_recorder.add_frame(frame)
+                                        live_frame = True
                                 except Exception as e:
                                     logger.error(f"Error reading frame: {e}")
                                     frame = None
@@ -573,6 +640,10 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                                 # No valid camera
                                 frame = None
                         
+                        # Detection and landmarks are slow; don't hold the camera for them
+                        if live_frame:
+                            track_blinks(frame)
+                        
                         # If frame is None, create a placeholder
                         if frame is None:
                             frame = np.zeros((480, 640, 3), dtype=np.uint8)
@@ -609,198 +680,321 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
     
     @app.route('/start-face-recognition', methods=['POST'])
     def start_face_recognition():
-        nonlocal camera, camera_needs_cleanup
+        # A kiosk tap starts a new door entry
+        start_entry_trace()
         
-        # If camera has been released, get a new one
-        with camera_lock:
-            if camera is None or not hasattr(camera, 'isOpened') or not camera.isOpened():
-                logger.info("Getting new camera for face recognition")
-                camera = get_camera()
-                camera_needs_cleanup = True
+        # A new attempt supersedes one that is still running (e.g. abandoned by
+        # another kiosk session); the old job is cancelled at its next checkpoint.
+        # The camera is only touched by the job thread, once the old job has stopped.
+        job = recognition_state.start_job("kiosk")
+        flask_session['recognition_job_id'] = job.job_id
         
-        # Don't start if already running
-        if recognition_state.recognition_running:
+        try:
+            # Start recognition in background thread
+            recognition_state.recognition_thread = threading.Thread(
+                target=run_kiosk_recognition, 
+                args=(job,)
+            )
+            recognition_state.recognition_thread.daemon = True
+            recognition_state.recognition_thread.start()
+            
+            return jsonify({
+                "status": "success", 
+                "message": "Face recognition started",
+                "job_id": job.job_id
+            })
+        except Exception as e:
+            logger.error(f"Error starting face recognition: {e}")
+            job.set_result({"success": False, "error_message": str(e)})
+            job.finish()
             return jsonify({
                 "status": "error",
-                "message": "Recognition process already running"
+                "message": f"Error starting face recognition: {e}"
             })
-        
-        recognition_state.recognition_running = True
-        recognition_state.face_recognition_active = True
+    
+    def capture_kiosk_frames(job):
+        """
+        Capture the first frames of a kiosk attempt, a little apart in time.
+
+        Runs on the job thread after wait_for_previous(), so a superseded job's
+        pipeline is no longer reading the camera.
+
+        Returns:
+            list: BGR frames captured before the analysis reserve of the deadline; may be empty
+        """
+        nonlocal camera, camera_needs_cleanup
         
         # Define how many frames to capture - reduced for faster processing
         num_frames = 5  # Reduced from 10 to 5 frames for faster processing
         
-        # Capture multiple frames
         frames = []
         try:
             for i in range(num_frames):
+                job.checkpoint()
                 # Check if camera is still valid before each frame capture
                 with camera_lock:
                     if camera is None or not hasattr(camera, 'isOpened') or not camera.isOpened():
-                        logger.warning("Camera was released, getting a new one")
-                        camera = get_camera()
+                        logger.info("Getting new camera for face recognition")
+                        with stage_metrics.time("camera_acquire"):
+                            camera = get_camera(job.deadline)
                         camera_needs_cleanup = True
-                
-                # Read frame while holding the lock
-                ret, frame = camera.read()
+                    if camera is None:
+                        break
+                    
+                    # Read frame while holding the lock
+                    with stage_metrics.time("capture"):
+                        ret, frame = camera.read()
             
                 if ret and frame is not None:
                     logger.info(f"Captured frame {i+1}/{num_frames}")
-                    # Convert to RGB for face_recognition library
+                    incident_recorder.add_frame(frame)
+                    # Kept as BGR; run_recognition_background wraps each frame in a FrameContext
                     frames.append(frame)
                 else:
                     logger.warning(f"Failed to capture frame {i+1}")
-                time.sleep(0.3)  # Reduced from 0.5 seconds to 0.3 seconds for faster capture
-        
-            # Start recognition in background thread
-            recognition_state.recognition_thread = threading.Thread(
-                target=run_recognition_background, 
-                args=(frames,)
-            )
-            recognition_state.recognition_thread.daemon = True
-            recognition_state.recognition_thread.start()
-            
-            return jsonify({
-                "status": "success", 
-                "message": "Face recognition started"
-            })
+                # The capture counts against the attempt's deadline; leave time for the analysis
+                if job.deadline.remaining() <= DEADLINE_ANALYSIS_RESERVE:
+                    logger.info(f"Stopping capture after {i+1} frames to meet the recognition deadline")
+                    break
+                job.deadline.sleep(0.3)  # Reduced from 0.5 seconds to 0.3 seconds for faster capture
+        except RecognitionCancelled:
+            raise
         except Exception as e:
-            logger.error(f"Error starting face recognition: {e}")
-            recognition_state.recognition_running = False
-            recognition_state.face_recognition_active = False
-            return jsonify({
-                "status": "error",
-                "message": f"Error starting face recognition: {e}"
-            })
+            # The recognition pipeline captures whatever is missing itself
+            logger.error(f"Error capturing frames for face recognition: {e}")
+        return frames
     
-    @app.route('/check-face-recognition-status', methods=['GET'])
-    def check_face_recognition_status():
-        """Check the status of the face recognition process."""
+    def summarize_recognition_result(result):
+        """
+        Build the status payload the kiosk page acts on from a recognition result.
+
+        Face encodings stay on the server: they are large, and the page never uses them.
+        """
+        serializable_result = {}
+        for key, value in result.items():
+            if key in ("face_encoding", "face_encodings"):
+                continue
+            # Convert numpy arrays to lists
+            if isinstance(value, np.ndarray):
+                serializable_result[key] = value.tolist()
+            # Ensure all values are JSON serializable
+            elif isinstance(value, (bool, int, float, str, list, dict)) or value is None:
+                serializable_result[key] = value
+            else:
+                # Convert other types to string
+                serializable_result[key] = str(value)
+
         response = {
-            "active": recognition_state.face_recognition_active,
-            "status": "not_started"
+            "active": False,
+            "status": "not_started",
+            "result": serializable_result
         }
-        
-        if not recognition_state.face_recognition_active and recognition_state.face_recognition_result:
-            # Create a serializable copy of the result
-            serializable_result = {}
-            for key, value in recognition_state.face_recognition_result.items():
-                # Convert numpy arrays to lists
-                if isinstance(value, np.ndarray):
-                    serializable_result[key] = value.tolist()
-                # Ensure all values are JSON serializable
-                elif isinstance(value, (bool, int, float, str, list, dict)) or value is None:
-                    serializable_result[key] = value
-                else:
-                    # Convert other types to string
-                    serializable_result[key] = str(value)
-            
-            response["result"] = serializable_result
-            
-            # Add explicit status based on result contents
-            if serializable_result.get("backend_error"):
-                response["status"] = "backend_error"
-            elif serializable_result.get("face_too_small"):
-                response["status"] = "face_too_small"
-            elif (serializable_result.get("face_detected") and 
-                  "is_live" in serializable_result and 
-                  serializable_result["is_live"] is False):
-                response["status"] = "liveness_failed"
-            elif serializable_result.get("registration_needed"):
-                response["registration_needed"] = True
-                response["status"] = "registration_needed"
-                
-                # Store the face encoding in the recognition state instead of session
-                if serializable_result.get("save_face_encoding") and ("face_encoding" in serializable_result or "face_encodings" in serializable_result):
-                    # Add detailed logging about the face encoding
-                    encoding_data = serializable_result.get("face_encoding") or serializable_result.get("face_encodings")
-                    if encoding_data is not None:
-                        try:
-                            # Generate a unique ID for this face data
-                            face_id = str(uuid.uuid4())[:20]
-                            logger.info(f"Storing face encoding in server memory for registration (type: {type(encoding_data)}, length: {len(encoding_data) if isinstance(encoding_data, list) else 'unknown'})")
-                            
-                            # Store in the recognition state
-                            recognition_state.store_face_encoding(encoding_data, face_id)
-                            
-                            # Also set a simple flag in the session that face data is available
-                            flask_session['has_valid_face_data'] = True
-                            flask_session['face_id'] = face_id
-                            
-                            logger.info(f"Successfully stored face encoding with ID: {face_id}")
-                        except Exception as storage_error:
-                            logger.error(f"Error storing face encoding: {storage_error}", exc_info=True)
-                    else:
-                        logger.error("Cannot store face encoding: encoding data is None")
-                else:
-                    logger.warning("No face encoding available to store or save_face_encoding flag not set")
-                
-                # Important - mark recognition as complete to stop the face recognition bg process
-                recognition_state.face_recognition_active = False
-            
-            elif serializable_result.get("recognized"):
-                # Check if the recognized user is approved
-                if serializable_result.get("is_allowed", False):
-                    response["status"] = "recognized"
-                    response["is_allowed"] = True
-                    
-                    # Ensure face_encodings is specifically preserved in the result
-                    if "face_encoding" in serializable_result and not "face_encodings" in recognition_state.face_recognition_result:
-                        # Store face_encoding as face_encodings to prevent the error
-                        logger.info("Ensuring face_encodings are available for process_face")
-                        recognition_state.face_recognition_result['face_encodings'] = recognition_state.face_recognition_result.get('face_encoding')
-                else:
-                    # User is recognized but not approved
-                    response["status"] = "pending_approval"
-                    response["is_allowed"] = False
-                    response["user_name"] = serializable_result.get("user_name", "Unknown User")
-                    logger.info(f"User recognized but pending approval: {response['user_name']}")
-            elif serializable_result.get("success"):
-                response["status"] = "complete"
-            
-            # Always perform camera cleanup when recognition is complete
-            # whether it's a success, failure, or needs registration
-            if not response["active"]:
-                logger.info(f"Recognition completed with status: {response.get('status', 'unknown')}")
+
+        # Add explicit status based on result contents
+        if serializable_result.get("cancelled"):
+            response["status"] = "cancelled"
+        elif serializable_result.get("timed_out"):
+            response["status"] = "timed_out"
+        elif serializable_result.get("backend_error"):
+            response["status"] = "backend_error"
+        elif serializable_result.get("face_too_small"):
+            response["status"] = "face_too_small"
+        elif (serializable_result.get("face_detected") and 
+              "is_live" in serializable_result and 
+              serializable_result["is_live"] is False):
+            response["status"] = "liveness_failed"
+        elif serializable_result.get("registration_needed"):
+            response["registration_needed"] = True
+            response["status"] = "registration_needed"
+        elif serializable_result.get("recognized"):
+            # Check if the recognized user is approved
+            if serializable_result.get("is_allowed", False):
+                response["status"] = "recognized"
+                response["is_allowed"] = True
+            else:
+                # User is recognized but not approved
+                response["status"] = "pending_approval"
+                response["is_allowed"] = False
+                response["user_name"] = serializable_result.get("user_name", "Unknown User")
+        elif serializable_result.get("success"):
+            response["status"] = "complete"
+        return response
+
+    def record_incident(kind, user, method, status, details):
+        """
+        Record an incident clip and log the event to the backend with a link to it.
+
+        Returns:
+            str: The clip's file name, or None if there were no recent frames to record
+        """
+        clip = incident_recorder.record(kind)
+        try:
+            backend_session.post(f"{API_URL}/log-door-access", json={
+                "user": user,
+                "method": method,
+                "status": status,
+                "details": details,
+                "clip_url": clip_url(clip)
+            }, timeout=5)
+        except Exception as e:
+            logger.error(f"Error logging {kind} incident: {e}")
+        return clip
+
+    def finish_recognition(job, result):
+        """Prepare the server-side follow-up of a finished attempt and publish its result"""
+        if result.get("registration_needed"):
+            # Store the face encoding in the recognition state for the registration page
+            encoding_data = result.get("face_encoding") if result.get("face_encoding") is not None else result.get("face_encodings")
+            if result.get("save_face_encoding") and encoding_data is not None:
                 try:
-                    # Clean up camera resources
-                    release_camera()
-                    
-                    # Wait a bit longer after release for better stability
+                    if isinstance(encoding_data, np.ndarray):
+                        encoding_data = encoding_data.tolist()
+                    # Generate a unique ID for this face data
+                    face_id = str(uuid.uuid4())[:20]
+                    logger.info(f"Storing face encoding in server memory for registration (type: {type(encoding_data)}, length: {len(encoding_data) if isinstance(encoding_data, list) else 'unknown'})")
+                    recognition_state.store_face_encoding(job.job_id, encoding_data, face_id)
+                    logger.info(f"Successfully stored face encoding with ID: {face_id}")
+                except Exception as storage_error:
+                    logger.error(f"Error storing face encoding: {storage_error}", exc_info=True)
+            else:
+                logger.warning("No face encoding available to store or save_face_encoding flag not set")
+        elif result.get("recognized") and result.get("is_allowed", False):
+            # Ensure face_encodings is specifically preserved in the result for process_face
+            if "face_encoding" in result and "face_encodings" not in result:
+                logger.info("Ensuring face_encodings are available for process_face")
+                result["face_encodings"] = result.get("face_encoding")
+        elif result.get("recognized"):
+            logger.info(f"User recognized but pending approval: {result.get('user_name', 'Unknown User')}")
+            # Logged by /log-pending-access once the page has shown the result
+            result["incident_clip"] = incident_recorder.record("pending_approval")
+
+        response = summarize_recognition_result(result)
+        logger.info(f"Recognition job {job.job_id} completed with status: {response.get('status', 'unknown')}")
+        job.publish_result(response)
+
+        if response.get("status") == "liveness_failed":
+            record_incident("liveness_failed", "Unknown", "Face Recognition", "Liveness Failed",
+                            "Face detected but the liveness check failed")
+
+    def cleanup_camera_after_recognition():
+        """Release the camera once an attempt is over; runs on the recognition thread"""
+        try:
+            release_camera()
+            
+            # Wait a bit longer after release for better stability
+            time.sleep(1.0)
+            
+            # Add an additional step to ensure camera is fully released
+            try:
+                logger.info("Performing additional cleanup to ensure camera is released")
+                
+                # Force reinitialize camera if needed
+                if platform.system() == 'Linux':
+                    logger.info("Forcing additional Linux camera cleanup")
+                    # Add a longer delay after release
                     time.sleep(1.0)
-                    
-                    # Add an additional step to ensure camera is fully released
-                    try:
-                        # Try to reset the video subsystem by opening and closing a temporary camera
-                        logger.info("Performing additional cleanup to ensure camera is released")
-                        
-                        # Force reinitialize camera if needed
-                        if platform.system() == 'Linux':
-                            logger.info("Forcing additional Linux camera cleanup")
-                            # Add a longer delay after release
-                            time.sleep(1.0)
-                        elif platform.system() == 'Windows':
-                            # Force Windows cleanup
-                            logger.info("Forcing additional Windows cleanup")
-                            cv2.destroyAllWindows()
-                            cv2.waitKey(1)
-                            # Force garbage collection
-                            gc.collect()
-                        
-                    except Exception as e:
-                        logger.error(f"Error during additional cleanup: {e}")
-                    
-                    logger.info("Camera cleanup completed after recognition")
-                except Exception as e:
-                    logger.error(f"Error during camera cleanup: {str(e)}")
-        elif recognition_state.face_recognition_active:
-            # Currently processing, get the progress if available
-            if hasattr(recognition_state, 'face_recognition_progress') and recognition_state.face_recognition_progress is not None:
-                response["progress"] = recognition_state.face_recognition_progress
-            response["status"] = "processing"
+                elif platform.system() == 'Windows':
+                    # Force Windows cleanup
+                    logger.info("Forcing Windows cleanup")
+                    cv2.destroyAllWindows()
+                    cv2.waitKey(1)
+                    # Force garbage collection
+                    gc.collect()
                 
+            except Exception as e:
+                logger.error(f"Error during additional cleanup: {e}")
+            
+            logger.info("Camera cleanup completed after recognition")
+        except Exception as e:
+            logger.error(f"Error during camera cleanup: {str(e)}")
+
+    def run_kiosk_recognition(job):
+        """Recognition thread for the kiosk: capture and run the attempt, publish the result, then clean up"""
+        with activate(job.trace_id), span("recognition", job_id=job.job_id):
+            try:
+                job.wait_for_previous()
+                frames = capture_kiosk_frames(job)
+                result = run_recognition_background(frames, job)
+            except RecognitionCancelled as e:
+                result = {"success": False, "cancelled": True, "error_message": str(e)}
+                job.set_result(result)
+            try:
+                finish_recognition(job, result)
+            finally:
+                job.finish()
+                # Whether it's a success, failure, or needs registration, the camera is released
+                # here rather than in a status request. A superseded job leaves it to its successor.
+                if not job.cancelled:
+                    cleanup_camera_after_recognition()
+
+    @app.route('/check-face-recognition-status', methods=['GET'])
+    def check_face_recognition_status():
+        """Check the status of the face recognition process (polling fallback for the event stream)."""
+        job = recognition_state.get_job(request.args.get('job_id') or flask_session.get('recognition_job_id'))
+        if job is None:
+            return jsonify({"active": False, "status": "not_started"})
+        if job.result_event is not None:
+            return jsonify(job.result_event)
+        
+        response = {
+            "active": True,
+            "status": "processing",
+            "job_id": job.job_id
+        }
+        # Currently processing, get the progress if available
+        if job.progress is not None:
+            response["progress"] = job.progress
         return jsonify(response)
+
+    @app.route('/face-recognition-events', methods=['GET'])
+    def face_recognition_events():
+        """Server-sent events stream of one attempt: progress updates, then one result"""
+        job = recognition_state.get_job(request.args.get('job_id') or flask_session.get('recognition_job_id'))
+        
+        def format_event(event, data):
+            return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+        def generate_events():
+            if job is None:
+                # Nothing to follow; the page falls back to polling when the stream ends
+                return
+            events = recognition_state.subscribe()
+            try:
+                # A result published before the page connected is replayed straight away
+                if job.result_event is not None:
+                    yield format_event("result", job.result_event)
+                    return
+                if job.progress is not None:
+                    yield format_event("progress", {"job_id": job.job_id, "progress": job.progress})
+                while True:
+                    try:
+                        event, data = events.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                    except queue.Empty:
+                        # Comment line keeps proxies and the browser from timing out the stream
+                        yield ": keepalive\n\n"
+                        continue
+                    if data.get("job_id") != job.job_id:
+                        continue
+                    yield format_event(event, data)
+                    if event == "result":
+                        return
+            finally:
+                recognition_state.unsubscribe(events)
+
+        return Response(generate_events(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/cancel-face-recognition', methods=['POST'])
+    def cancel_face_recognition():
+        """Cancel the session's recognition attempt, e.g. when the kiosk page is left"""
+        job_id = request.form.get('job_id') or flask_session.get('recognition_job_id')
+        cancelled = recognition_state.cancel_job(job_id, "kiosk page left") if job_id else False
+        return jsonify({"status": "success" if cancelled else "not_found"})
+
+    def session_recognition_result():
+        """Result of this session's recognition job, or None; never another session's result"""
+        job = recognition_state.get_job(flask_session.get('recognition_job_id'))
+        return job.result if job is not None else None
     
     @app.route('/process-face/<face_id>', methods=['POST'])
     def process_face(face_id):
@@ -822,44 +1016,45 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                 # Store in session for display in results
                 flask_session['debug_frame'] = debug_frame
             
-            if not recognition_state.face_recognition_result:
+            recognition_result = session_recognition_result()
+            if not recognition_result:
                 logger.warning("No face recognition results available")
                 flash('No face recognition results available', 'error')
                 return redirect(url_for('face_recognition_page'))
             
             try:
                 # Check if face was detected
-                if not recognition_state.face_recognition_result.get('face_detected', False):
+                if not recognition_result.get('face_detected', False):
                     logger.warning("No face detected in result")
                     flash('No face was detected. Please try again.', 'error')
                     return redirect(url_for('face_recognition_page'))
                 
                 # Verify liveness check passed before proceeding
-                if not recognition_state.face_recognition_result.get('is_live', False):
+                if not recognition_result.get('is_live', False):
                     logger.warning("Liveness check failed - rejecting registration attempt")
                     flash('Security check failed: Only live faces can be registered.', 'error')
                     return redirect(url_for('face_recognition_page'))
                 
                 # Check if face encodings are available
-                if 'face_encodings' not in recognition_state.face_recognition_result or not recognition_state.face_recognition_result['face_encodings']:
+                if 'face_encodings' not in recognition_result or not recognition_result['face_encodings']:
                     logger.warning("No face encodings found in result")
                     flash('No face encodings available', 'error')
                     return redirect(url_for('face_recognition_page'))
                 
                 # Instead of storing face encodings in the session, store in server memory
-                face_encodings = recognition_state.face_recognition_result['face_encodings']
+                face_encodings = recognition_result['face_encodings']
                 logger.info("Face encodings available for processing")
                 
                 # Store only a flag indicating we have valid face data
                 flask_session['has_valid_face_data'] = True
                 
                 # Store the face encodings in server memory
-                recognition_state.store_face_encoding(face_encodings, face_id)
+                recognition_state.store_face_encoding(flask_session.get('recognition_job_id'), face_encodings, face_id)
                 logger.info(f"Stored face encoding in server memory with ID: {face_id}")
                 
                 # Check if the face was recognized
-                if recognition_state.face_recognition_result.get('face_recognized', False) and recognition_state.face_recognition_result.get('matched_users'):
-                    matched_users = recognition_state.face_recognition_result.get('matched_users', [])
+                if recognition_result.get('face_recognized', False) and recognition_result.get('matched_users'):
+                    matched_users = recognition_result.get('matched_users', [])
                     if matched_users:
                         matched_user = matched_users[0]
                         matched_phone = matched_user.get('phone_number', matched_user.get('user_id', matched_user.get('name')))
@@ -881,7 +1076,7 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                         logger.error(f"Error logging face access: {e}")
                     
                     # Get low_security flag from recognition result
-                    low_security = recognition_state.face_recognition_result.get('low_security', False)
+                    low_security = recognition_result.get('low_security', False)
                     
                     # Store only essential recognition data for display
                     flask_session['recent_recognition'] = {
@@ -980,7 +1175,7 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                 return redirect(url_for('register_face'))
             
             # Get face encoding from server memory instead of session
-            face_encoding = recognition_state.get_face_encoding()
+            face_encoding = recognition_state.get_face_encoding(flask_session.get('recognition_job_id'))
             
             # Detailed logs to diagnose issues
             if face_encoding is None:
@@ -1002,8 +1197,8 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             # Verify list size if possible
             if isinstance(face_encoding, list):
                 logger.info(f"Face encoding list length: {len(face_encoding)}")
-                if len(face_encoding) != 128:
-                    logger.warning(f"Unexpected face encoding length: {len(face_encoding)} (expected 128)")
+                if len(face_encoding) != face_encoder.dimension:
+                    logger.warning(f"Unexpected face encoding length: {len(face_encoding)} (expected {face_encoder.dimension})")
             
             # Convert face encoding to base64 encoded JSON string
             try:
@@ -1025,7 +1220,8 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             user_data = {
                 'name': name,
                 'phone_number': phone,  # Updated to match backend API field name
-                'face_encoding': face_encoding_base64
+                'face_encoding': face_encoding_base64,
+                'encoder': face_encoder.name
             }
             
             try:
@@ -1051,7 +1247,7 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                             flask_session.pop('face_id', None)
                             
                         # Clear the face encoding from server memory
-                        recognition_state.clear_face_encoding()
+                        recognition_state.clear_face_encoding(flask_session.get('recognition_job_id'))
                         
                         flash('Registration successful!', 'success')
                         reset_recognition_state()
@@ -1089,14 +1285,14 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         liveness_failed = False
         
         # Check if there was a liveness check failure in the recognition result
-        if hasattr(recognition_state, 'face_recognition_result') and recognition_state.face_recognition_result:
-            result = recognition_state.face_recognition_result
+        result = session_recognition_result()
+        if result:
             if result.get("face_detected") and not result.get("is_live", True):
                 liveness_failed = True
                 logger.warning("Liveness check failed - showing liveness error in registration page")
         
         # Check if face encoding is available in server memory
-        if recognition_state.get_face_encoding() is not None:
+        if recognition_state.get_face_encoding(flask_session.get('recognition_job_id')) is not None:
             encoding_available = True
             logger.info("Face encoding available in server memory")
         # Also check for the flag in the session as a backup
@@ -1136,9 +1332,8 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         try:
             logger.info("Manually resetting camera resources")
             
-            # Reset recognition state
-            recognition_state.face_recognition_active = False
-            recognition_state.face_recognition_result = None
+            # Reset recognition state, stopping any attempt still in progress
+            recognition_state.reset()
             
             # Set cleanup flag
             camera_needs_cleanup = True
@@ -1220,10 +1415,6 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         try:
             logger.info("Capturing preview frame before facial recognition")
             
-            # Ensure debug frames directory exists
-            debug_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static', 'debug_frames')
-            os.makedirs(debug_dir, exist_ok=True)
-            
             # Generate timestamp for the frame
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
             
@@ -1244,22 +1435,42 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                 logger.error("Failed to capture preview frame")
                 return jsonify({"success": False, "error": "Failed to capture frame"}), 500
             
-            # Save the frame
-            filename = f"{debug_dir}/preview_{timestamp}.jpg"
-            cv2.imwrite(filename, frame)
-            logger.info(f"Preview frame saved to {filename}")
+            # Keep the frame in memory; it is only shown once, while recognition runs
+            filename = f"preview_{timestamp}.jpg"
+            if not preview_store.put(filename, frame):
+                return jsonify({"success": False, "error": "Failed to encode frame"}), 500
+            logger.info(f"Preview frame stored as {filename}")
             
             # Return success with timestamp
             return jsonify({
                 "success": True, 
                 "timestamp": timestamp,
-                "filename": f"preview_{timestamp}.jpg"
+                "filename": filename,
+                "url": url_for('preview_frame', filename=filename)
             })
             
         except Exception as e:
             logger.error(f"Error capturing preview frame: {e}", exc_info=True)
             return jsonify({"success": False, "error": str(e)}), 500
     
+    @app.route('/preview-frame/<filename>', methods=['GET'])
+    def preview_frame(filename):
+        """Serve a preview frame from memory"""
+        data = preview_store.get(filename)
+        if data is None:
+            return jsonify({"error": "Preview frame not found"}), 404
+        return Response(data, mimetype='image/jpeg', headers={'Cache-Control': 'no-store'})
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Per-stage latency quantiles in the Prometheus text format"""
+        return Response(stage_metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/incident-clips/<filename>', methods=['GET'])
+    def incident_clip(filename):
+        """Serve a recorded incident clip (linked from the access log)"""
+        return send_from_directory(INCIDENT_CLIPS_DIR, filename, mimetype='video/x-msvideo')
+    
     @app.route('/log-pending-access', methods=['POST'])
     def log_pending_access():
         """Log access attempts by users who are recognized but awaiting approval"""
@@ -1270,13 +1481,15 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             
             logger.info(f"Pending access attempt logged for user: {user_name} (ID: {user_id})")
             
-            # Log the pending access attempt to the backend
+            # Log the pending access attempt to the backend, with the clip recorded when it finished
+            result = session_recognition_result() or {}
             try:
                 backend_session.post(f"{API_URL}/log-door-access", json={
                     "user": user_name,
                     "method": "Face Recognition",
                     "status": "Pending Approval",
-                    "details": f"User recognized but pending admin approval"
+                    "details": f"User recognized but pending admin approval",
+                    "clip_url": clip_url(result.get("incident_clip"))
                 }, timeout=5)
                 logger.info(f"Successfully logged pending access attempt to backend")
             except Exception as e:
@@ -1344,11 +1557,25 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         logger.info("Resource cleanup completed")
 
     # Define the run_recognition_background function inside setup_routes
-    def run_recognition_background(frames):
-        """Run face recognition in the background."""
+    def run_recognition_background(frames, job):
+        """
+        Run face recognition in the background.
+        
+        Frames are evaluated as they arrive, starting with the frames captured by
+        the request. The first frame that yields a live face matching the gallery
+        within the strict early-exit distance ends the attempt; otherwise the
+        best-quality face of the whole burst is matched as before.
+        
+        Progress milestones are job checkpoints: a cancelled job stops at the
+        next one (or between captured frames) with a "cancelled" result.
+        Every stage takes its time budget from the job's deadline; an attempt
+        that can't finish in time ends with a "timed_out" result.
+        """
+        nonlocal camera
+        deadline = job.deadline
+        gallery_executor = ThreadPoolExecutor(max_workers=1)
         try:
             logger.info("Starting face recognition in background thread")
-            max_retry_attempts = 3  # Maximum number of retries for backend connection
             
             # Initialize result structure
             result = {
@@ -1361,110 +1588,206 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             }
             
             # Set initial progress
-            recognition_state.face_recognition_progress = 10
+            job.checkpoint(10)
+            
+            # Fetch the gallery concurrently so it is ready when the first good face is encoded
+            gallery_future = gallery_executor.submit(bind(fetch_gallery), API_URL, face_encoder, deadline=deadline)
+            
+            # The live feed's blink verdict and face tracks belong to the kiosk; hands-free
+            # attempts keep their own tracks in the monitor and never use them
+            from_kiosk = job.kind == "kiosk"
+            
+            # A face that blinked on the live feed just before the button was pressed is
+            # already known to be live; if that is the face recognized below, the attempt
+            # skips the burst liveness checks
+            blink_verdict = blink_detector.take_verdict() if from_kiosk else None
+            if blink_verdict is not None:
+                logger.info(f"Using blink liveness verdict from {blink_verdict['verdict_age']:.1f} seconds ago")
             
             # Try to get camera (with retry mechanism built in)
             start_time = time.time()
-            camera = get_camera()
+            with stage_metrics.time("camera_acquire"):
+                camera = get_camera(deadline)
             camera_setup_time = time.time() - start_time
             logger.info(f"Camera setup completed in {camera_setup_time:.2f} seconds")
             
-            if camera is None or not camera.isOpened():
+            camera_ready = camera is not None and camera.isOpened()
+            if not camera_ready and not frames:
                 logger.error("Failed to open camera")
                 result["error_message"] = "Could not open camera"
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
 
+            # Stop capturing early enough to encode, check and match within the deadline
+            capture_deadline = deadline.reserve(DEADLINE_ANALYSIS_RESERVE)
+            
+            # Frames already captured by the kiosk are evaluated before live ones,
+            # whatever is left of the capture budget; only new camera reads are gated on it
+            pending_frames = list(frames or [])
+            
+            def read_frame():
+                if pending_frames:
+                    return pending_frames.pop(0)
+                if not camera_ready or capture_deadline.expired:
+                    pipeline.stop()
+                    return None
+                # The camera is shared with the live feed and the hands-free reader
+                with camera_lock:
+                    if camera is None:
+                        return None
+                    with stage_metrics.time("capture"):
+                        ret, frame = camera.read()
+                if not ret or frame is None:
+                    logger.warning("Failed to capture frame")
+                    return None
+                incident_recorder.add_frame(frame)
+                return frame
+            
             # Capture frames with timeout to prevent infinite loops
             start_time = time.time()
             frames = []
             face_locations = []
-            max_frames = 30  # Maximum number of frames to process
+            frame_positions = {}  # pipeline frame index -> position in frames
             frame_timeout = 6  # Reduced from 10 to 6 seconds
             
             # Update progress - capturing frames
-            recognition_state.face_recognition_progress = 20
+            job.checkpoint(20)
             
             # Set a fixed number of frames to capture
             target_frames = 4  # Reduced from 8 to 4 frames for faster processing
             
-            while len(frames) < target_frames:
-                if time.time() - start_time > frame_timeout:
-                    logger.warning(f"Frame capture timeout after {time.time() - start_time:.2f} seconds")
-                    break
+            from face_recognition_process import LivenessDetector
+            liveness_detector = LivenessDetector()
+            
+            # Encodings and liveness results per (frame, face), so no face is analysed twice
+            analyses = {}
+            early_match = None
+            
+            # Capture, detection and encoding/liveness run as concurrent stages; good
+            # faces are analysed while later frames are still being captured and detected
+            pipeline = StagedRecognitionPipeline(face_detector, face_encoder, liveness_detector)
+            pipeline.start(read_frame, EARLY_EXIT_MAX_ATTEMPTS, EARLY_EXIT_MIN_QUALITY)
+            try:
+                while True:
+                    job.checkpoint()
+                    # Past the capture deadline read_frame stops the capture stage, and the
+                    # frames already read still go through detection and analysis
+                    remaining = min(frame_timeout - (time.time() - start_time), deadline.remaining())
+                    if remaining <= 0:
+                        logger.warning(f"Frame capture timeout after {time.time() - start_time:.2f} seconds")
+                        break
+                    if len(frames) >= target_frames and not pending_frames:
+                        # Enough frames; let queued work finish so it can be reused below
+                        pipeline.stop()
+                    try:
+                        event = pipeline.events.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+                    if event is None:
+                        break
                     
-                ret, frame = camera.read()
-                if not ret or frame is None:
-                    logger.warning("Failed to capture frame")
-                    continue
+                    if isinstance(event, DetectionEvent):
+                        frame_positions[event.frame_index] = len(frames)
+                        # Keep the frame's context so encoding, liveness and debug
+                        # drawing reuse the views computed during detection
+                        frames.append(event.context)
+                        face_locations.append(event.locations)
+                        continue
                     
-                # Add frame to collection
-                frames.append(frame)
-                
-                # Get face locations for this frame
-                try:
-                    locations = face_recog.face_locations(frame)
-                    face_locations.append(locations if locations else [])
-                except Exception as e:
-                    logger.error(f"Error during face detection: {e}")
-                    face_locations.append([])
-                
-                # Enforce minimum processing time between frames to prevent overload
-                time.sleep(0.1)
+                    position = frame_positions[event.frame_index]
+                    analysis = event.analysis
+                    analyses[(position, event.quality.face_index)] = analysis
+                    blinked = verdict_matches(blink_verdict, event.quality.location)
+                    if (analysis.is_live or blinked) and analysis.encoding is not None:
+                        try:
+                            gallery = gallery_future.result(timeout=capture_deadline.remaining())
+                        except FutureTimeoutError:
+                            # Gallery not there yet; the burst path below waits for it
+                            continue
+                        index, distance = gallery.best_match(analysis.encoding)
+                        if index is not None and distance <= face_encoder.tolerance * EARLY_EXIT_TOLERANCE_RATIO:
+                            # Confirm liveness over the frames seen so far before trusting one frame
+                            quality = event.quality._replace(frame_index=position)
+                            liveness, is_live = (blink_verdict, True) if blinked else (None, False)
+                            if not is_live:
+                                burst_faces = select_fusion_faces(frames, face_locations, quality, len(frames))
+                                liveness = check_burst(frames, burst_faces, liveness_detector, analyses)
+                                is_live = liveness["is_live"] and liveness["frames_checked"] >= 2
+                            if is_live:
+                                logger.info(f"Early exit on frame {position + 1} with match distance {distance:.3f}")
+                                early_match = (position, quality, analysis._replace(liveness=liveness), gallery, index, distance)
+                                break
+                            logger.info("Burst liveness not confirmed yet, continuing")
+            finally:
+                # The capture thread may be inside camera.read(); wait for it before releasing
+                capture_stopped = pipeline.stop(PIPELINE_STOP_TIMEOUT)
+            logger.info(f"Pipeline stats: {pipeline.stats()}")
             
             capture_time = time.time() - start_time
             logger.info(f"Captured {len(frames)} frames in {capture_time:.2f} seconds")
+            logger.info(f"Face detection timing: {face_detector.timing_stats()}")
             
-            # Release camera
-            camera.release()
+            # Release camera; the hands-free monitor keeps reading it between attempts
+            if from_kiosk and camera_ready:
+                if capture_stopped:
+                    release_camera()
+                else:
+                    logger.warning("Capture thread still reading after stop, leaving the camera to the cleanup")
             
             # Update progress - looking for faces
-            recognition_state.face_recognition_progress = 30
+            job.checkpoint(30)
             
             if not frames:
                 logger.error("No frames captured")
                 result["error_message"] = "Failed to capture any frames"
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
             
-            # Find the best frame with the largest face
+            if early_match is not None:
+                frame_index, candidate, analysis, gallery, index, distance = early_match
+                result["face_detected"] = True
+                result["early_exit"] = True
+                result["frame_quality"] = round(candidate.score, 3)
+                result["encoder"] = face_encoder.name
+                result["face_encoding"] = analysis.encoding.tolist()
+                result["face_encodings"] = analysis.encoding.tolist()
+                for key, value in analysis.liveness.items():
+                    result[f"liveness_{key}"] = value
+                result["liveness_check"] = True
+                result["is_live"] = True
+                apply_match(result, gallery, index, distance)
+                result["success"] = True
+                job.checkpoint(100)
+                job.set_result(result)
+                if from_kiosk:
+                    attach_recognition(result)
+                logger.info(f"Face recognition completed from a single frame: recognized={result.get('recognized', False)}")
+                return result
+            
+            # Pick the face with the best quality score (sharpness, exposure, size, centering)
+            # so encoding and liveness both run on the same, best frame
+            best = None
             best_frame_index = None
             best_face_index = 0  # Default to first face
-            max_face_area = 0
-            
-            for i, (frame, locations) in enumerate(zip(frames, face_locations)):
-                if not locations:
-                    continue
-                
-                # Check all faces in this frame
-                for face_idx, face_loc in enumerate(locations):
-                    try:
-                        # Calculate face dimensions
-                        top, right, bottom, left = face_loc
-                        face_width = right - left
-                        face_height = bottom - top
-                        face_area = face_width * face_height
-                        
-                        if face_area > max_face_area:
-                            max_face_area = face_area
-                            best_frame_index = i
-                            best_face_index = face_idx
-                    except Exception as e:
-                        logger.error(f"Error calculating face area: {e}")
-                        continue
+            ranked_faces = rank_faces(frames, face_locations, top_k=1)
+            if ranked_faces:
+                best = ranked_faces[0]
+                best_frame_index = best.frame_index
+                best_face_index = best.face_index
+                result["frame_quality"] = round(best.score, 3)
+                logger.info(f"Best face in frame {best.frame_index}: quality={best.score:.2f} "
+                            f"(sharpness={best.sharpness:.2f}, exposure={best.exposure:.2f}, "
+                            f"size={best.size:.2f}, centering={best.centering:.2f})")
             
             # No faces found in any frame
             if best_frame_index is None:
                 logger.info("No faces detected in any frame")
                 result["error_message"] = "No face detected"
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
             
             # Update progress - face found, processing encoding
-            recognition_state.face_recognition_progress = 40
+            job.checkpoint(40)
             
             # Get the best frame and the corresponding face location
             best_frame = frames[best_frame_index]
@@ -1498,242 +1821,108 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                 
                 # Save debug frame with face rectangle and text for small face
                 try:
-                    debug_frame = best_frame.copy()
+                    debug_frame = best_frame.debug_canvas()
                     cv2.rectangle(debug_frame, (left, top), (right, bottom), (0, 0, 255), 2)
                     cv2.putText(debug_frame, f"TOO SMALL: {face_width}x{face_height}", 
                                 (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
                     
-                    # Save to debug file with timestamp
-                    debug_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static', 'debug_frames')
-                    os.makedirs(debug_dir, exist_ok=True)
+                    # Save to debug file with timestamp, in the background
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = os.path.join(debug_dir, f"small_face_{timestamp}.jpg")
-                    cv2.imwrite(filename, debug_frame)
-                    logger.info(f"Saved debug frame for small face to {filename}")
+                    get_debug_writer().save(debug_frame, f"small_face_{timestamp}.jpg")
                 except Exception as debug_error:
                     logger.error(f"Error saving debug frame: {debug_error}")
                 
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
             
             # Face is big enough, proceed with recognition
             result["face_detected"] = True
             
             # Update progress - processing face encoding
-            recognition_state.face_recognition_progress = 50
-            
-            # Get the face encoding
+            job.checkpoint(50)
+            
+            # Encode the best face together with the same person's best faces from other
+            # frames in parallel and fuse them into one embedding, while liveness is
+            # checked on every frame showing that person. Faces already analysed during
+            # early-exit attempts are reused.
+            fusion_faces = select_fusion_faces(frames, face_locations, best, FUSION_FRAMES)
+            if blink_verdict is not None and not verdict_matches(blink_verdict, best_face_location):
+                logger.info("Blink verdict was for another face, checking liveness on the burst")
+                blink_verdict = None
+            liveness_faces = None
+            if blink_verdict is None:
+                liveness_faces = select_fusion_faces(frames, face_locations, best, len(frames))
             start_time = time.time()
-            try:
-                face_encoding = face_recog.face_encodings(best_frame, [best_face_location])[0]
-                encoding_time = time.time() - start_time
-                logger.info(f"Face encoding completed in {encoding_time:.2f} seconds")
-                
-                # Store both face_encoding and face_encodings for consistency
-                result["face_encoding"] = face_encoding.tolist()
-                result["face_encodings"] = face_encoding.tolist()
-            except Exception as e:
-                logger.error(f"Error during face encoding: {e}")
+            analysis, fused_count = analyse_fused(frames, fusion_faces, face_encoder, liveness_detector, analyses,
+                                                  liveness_faces=liveness_faces, deadline=deadline)
+            if blink_verdict is not None:
+                analysis = analysis._replace(liveness=blink_verdict, is_live=True)
+            result["fused_frames"] = fused_count
+            logger.info(f"Encoded and fused {fused_count} of {len(fusion_faces)} faces in {time.time() - start_time:.2f} seconds")
+            
+            if analysis.encoding is None:
                 result["error_message"] = "Error encoding face"
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
             
-            # Update progress - checking liveness
-            recognition_state.face_recognition_progress = 60
+            face_encoding = analysis.encoding
+            result["encoder"] = face_encoder.name
+            # Store both face_encoding and face_encodings for consistency
+            result["face_encoding"] = face_encoding.tolist()
+            result["face_encodings"] = face_encoding.tolist()
             
-            # Check for liveness using enhanced detection
-            start_time = time.time()
-            try:
-                is_live = False
-                from face_recognition_process import LivenessDetector
-                liveness_detector = LivenessDetector()
-                if len(face_locations) > 0 and frames:
-                    logger.info(f"Performing enhanced liveness detection with gradient analysis and LBP")
-                    best_frame_idx = len(frames) // 2
-                    best_frame = frames[best_frame_idx]
-                    best_face_loc = face_locations[best_frame_idx][0] if len(face_locations[best_frame_idx]) > 0 else None
-                    if best_face_loc:
-                        liveness_result = liveness_detector.check_face_liveness(best_frame, best_face_loc)
-                        is_live = liveness_result.get("is_live", False)
-                        confidence_score = liveness_result.get("confidence_score", 0.0)
-                        for key, value in liveness_result.items():
-                            result[f"liveness_{key}"] = value
-                        logger.info(f"Enhanced liveness check completed with confidence {confidence_score:.2f}, is_live={is_live}")
-                    else:
-                        logger.warning("No suitable face location found for liveness check")
-                else:
-                    logger.warning("No faces detected for liveness analysis")
-                result["liveness_check"] = is_live
-                result["is_live"] = is_live
-                liveness_time = time.time() - start_time
-                logger.info(f"Liveness check completed in {liveness_time:.2f} seconds")
-            except Exception as e:
-                logger.error(f"Error during liveness check: {e}")
-                result["liveness_check"] = False
-                result["is_live"] = False
+            # Update progress - checking liveness
+            job.checkpoint(60)
+            
+            is_live = analysis.is_live
+            for key, value in analysis.liveness.items():
+                result[f"liveness_{key}"] = value
+            logger.info(f"Enhanced liveness check completed with confidence {analysis.liveness.get('confidence_score', 0.0):.2f}, is_live={is_live}")
+            result["liveness_check"] = is_live
+            result["is_live"] = is_live
 
             # Return early if liveness failed
             if not result["is_live"]:
                 result["status"] = "liveness_failed"
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
             
             # Update progress - retrieving known user encodings
-            recognition_state.face_recognition_progress = 70
-            
-            # Attempt to get known encodings from backend
-            known_encodings = []
-            known_names = []
-            known_user_ids = []
-            known_approval_status = []
-            known_user_data = []  # Store full user data objects
-            
-            retry_count = 0
-            max_retries = 2  # Reduced from 3 to 2 for faster failure response
+            job.checkpoint(70)
             
-            while retry_count < max_retries:
-                try:
-                    logger.info(f"Attempt {retry_count+1} to get known encodings from backend")
-                    response = requests.get(f"{API_URL}/get-user-encodings", timeout=10)
-                    
-                    if response.status_code == 200:
-                        response_data = response.json()
-                        logger.info(f"Successfully retrieved {len(response_data.get('users', []))} known face encodings")
-                        
-                        # Update progress - processing response
-                        recognition_state.face_recognition_progress = 80
-                        
-                        # Extract encodings, names, and user IDs from the 'users' array
-                        users = response_data.get('users', [])
-                        known_encodings = [user['face_encoding'] for user in users]
-                        known_names = [user['name'] for user in users]
-                        known_user_ids = [user['id'] for user in users]
-                        known_approval_status = [user.get('is_allowed', False) for user in users]
-                        known_user_data = users  # Store the full user objects
-                        
-                        logger.info(f"Processed {len(known_encodings)} face encodings")
-                        break  # Successfully got the encodings, exit the loop
-                    elif response.status_code == 404:
-                        # No registered users with face encodings in the system
-                        logger.info("No users with registered faces found in the system")
-                        known_encodings = []
-                        known_names = []
-                        known_user_ids = []
-                        known_approval_status = []
-                        
-                        # Set registration needed flag when no users exist
-                        result["registration_needed"] = True
-                        result["save_face_encoding"] = True
-                        result["is_live"] = True  # Set to true to allow registration
-                        logger.info("Setting registration_needed flag as no users exist in the system")
-                        break  # Exit the loop, no need to retry
-                    else:
-                        logger.error(f"Failed to get known encodings: {response.status_code}, {response.text}")
-                        retry_count += 1
-                        if retry_count < max_retries:
-                            sleep_time = retry_count * 2  # progressive backoff
-                            logger.info(f"Retrying in {sleep_time} seconds...")
-                            time.sleep(sleep_time)
-                except Exception as e:
-                    logger.error(f"Error getting known encodings: {str(e)}")
-                    retry_count += 1
-                    if retry_count < max_retries:
-                        sleep_time = retry_count * 2
-                        logger.info(f"Retrying in {sleep_time} seconds...")
-                        time.sleep(sleep_time)
+            # The gallery has been loading since the attempt started
+            try:
+                gallery = gallery_future.result(timeout=deadline.remaining())
+            except FutureTimeoutError:
+                logger.warning("Face gallery not loaded before the recognition deadline")
+                gallery = Gallery(Gallery.ERROR, error="Backend did not respond before the recognition deadline")
             
             # Update progress - comparing faces
-            recognition_state.face_recognition_progress = 90
+            job.checkpoint(90)
             
-            if retry_count >= max_retries and not known_encodings:
-                logger.error("Failed to get known encodings after maximum retries")
+            if gallery.status == Gallery.ERROR:
                 result = {
                     "success": False,
-                    "error": "Failed to get known encodings from backend",
+                    "error": gallery.error,
+                    "backend_error": True,
                     "face_detected": result["face_detected"],
                     "face_too_small": is_too_small,
                     "liveness_check": {
                         "success": result["liveness_check"],
-                        "error": result["error_message"]
+                        "error": result.get("error_message")
                     }
                 }
-                recognition_state.face_recognition_result = result
-                recognition_state.face_recognition_active = False
+                job.set_result(result)
                 return result
             
             # Compare face with known encodings
             face_recognized = False
-            if known_encodings:
+            if gallery.status == Gallery.OK:
                 try:
-                    # Convert encodings to numpy arrays if they aren't already
-                    np_known_encodings = []
-                    for encoding in known_encodings:
-                        try:
-                            if isinstance(encoding, list):
-                                np_known_encodings.append(np.array(encoding))
-                            elif isinstance(encoding, np.ndarray):
-                                np_known_encodings.append(encoding)
-                            else:
-                                logger.warning(f"Unexpected encoding type: {type(encoding)}")
-                                continue
-                        except Exception as conversion_error:
-                            logger.error(f"Error converting encoding: {conversion_error}")
-                            continue
-                    
-                    # Check if we have any valid encodings after conversion
-                    if not np_known_encodings:
-                        logger.error("No valid known encodings after conversion")
-                        raise ValueError("No valid known encodings after conversion")
-                    
-                    # Log encoding formats for debugging
-                    logger.info(f"Known encoding type: {type(np_known_encodings[0]) if np_known_encodings else 'None'}")
-                    logger.info(f"Face encoding type: {type(face_encoding)}")
-                    
-                    # Ensure face_encoding is also a numpy array
-                    if isinstance(face_encoding, list):
-                        face_encoding = np.array(face_encoding)
-                    
-                    # Compare faces with tolerance
-                    matches = face_recog.compare_faces(np_known_encodings, face_encoding, tolerance=0.6)
-                    
-                    if True in matches:
-                        # Find the match with minimum distance
-                        face_distances = face_recog.face_distance(np_known_encodings, face_encoding)
-                        best_match_index = np.argmin(face_distances)
-                        
-                        if matches[best_match_index]:
-                            recognized_name = known_names[best_match_index]
-                            user_id = known_user_ids[best_match_index]
-                            is_approved = known_approval_status[best_match_index]
-                            # Get low_security status from response
-                            low_security = False
-                            if isinstance(known_user_data, list) and len(known_user_data) > best_match_index:
-                                low_security = known_user_data[best_match_index].get('low_security', False)
-                            
-                            result["recognized"] = True
-                            result["user_name"] = recognized_name
-                            result["user_id"] = user_id
-                            result["is_allowed"] = is_approved
-                            result["low_security"] = low_security
-                            result["confidence"] = float(1 - face_distances[best_match_index])
-                            
-                            # Store the matched user data in the result
-                            matched_user = {
-                                'name': recognized_name,
-                                'confidence': float(1 - face_distances[best_match_index]),
-                                'user_id': user_id,
-                                'phone_number': known_user_data[best_match_index].get('phone_number', user_id),
-                                'is_allowed': is_approved,
-                                'low_security': low_security
-                            }
-                            result['matched_users'] = [matched_user]
-                            result['face_recognized'] = True
-                            
-                            logger.info(f"Face recognized as {recognized_name} (ID: {user_id}) with confidence {result['confidence']:.2f}, approved: {is_approved}, low_security: {low_security}")
-                            face_recognized = True
+                    index, distance = gallery.best_match(face_encoding)
+                    if index is not None and distance <= face_encoder.tolerance:
+                        apply_match(result, gallery, index, distance)
+                        face_recognized = True
                 except Exception as e:
                     logger.error(f"Error during face comparison: {str(e)}", exc_info=True)
                     result["error_message"] = f"Face comparison error: {str(e)}"
@@ -1741,24 +1930,20 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                     
                     # Save debug frame with the detected face and error info
                     try:
-                        debug_frame = best_frame.copy()
+                        debug_frame = best_frame.debug_canvas()
                         top, right, bottom, left = best_face_location
                         cv2.rectangle(debug_frame, (left, top), (right, bottom), (0, 0, 255), 2)
                         cv2.putText(debug_frame, f"COMPARISON ERROR", 
                                    (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
                         
-                        # Save to debug file with timestamp
-                        debug_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'static', 'debug_frames')
-                        os.makedirs(debug_dir, exist_ok=True)
+                        # Save to debug file with timestamp, in the background
                         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = os.path.join(debug_dir, f"face_comparison_error_{timestamp}.jpg")
-                        cv2.imwrite(filename, debug_frame)
-                        logger.info(f"Saved debug frame for face comparison error to {filename}")
+                        get_debug_writer().save(debug_frame, f"face_comparison_error_{timestamp}.jpg")
                     except Exception as debug_error:
                         logger.error(f"Error saving debug frame: {debug_error}")
             
-            # Set registration needed flag if face wasn't recognized but users exist
-            if not face_recognized and known_encodings:
+            # Set registration needed flag if nobody can be matched or the face wasn't recognized
+            if not face_recognized:
                 result["registration_needed"] = True
                 result["save_face_encoding"] = True
                 result["is_live"] = True  # Set to true to allow registration
@@ -1768,17 +1953,37 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             result["success"] = True
             
             # Update progress to 100%
-            recognition_state.face_recognition_progress = 100
+            job.checkpoint(100)
             
             # Store the final result
-            recognition_state.face_recognition_result = result
+            job.set_result(result)
             
-            # Important - explicitly set face recognition as complete
-            recognition_state.face_recognition_active = False
+            if from_kiosk:
+                attach_recognition(result)
             logger.info(f"Face recognition completed: recognition_needed={result.get('registration_needed', False)}, recognized={result.get('recognized', False)}")
             
             return result
             
+        except DeadlineExceeded as e:
+            logger.warning(f"Face recognition job {job.job_id} ran out of time after {deadline.elapsed():.2f} seconds: {e}")
+            result = {
+                "success": False,
+                "timed_out": True,
+                "error_message": str(e),
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            job.set_result(result)
+            return result
+        except RecognitionCancelled as e:
+            logger.info(f"Face recognition job {job.job_id} stopped: {e}")
+            result = {
+                "success": False,
+                "cancelled": True,
+                "error_message": str(e),
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            }
+            job.set_result(result)
+            return result
         except Exception as e:
             logger.error(f"Unexpected error in face recognition: {e}")
             traceback.print_exc()
@@ -1787,10 +1992,12 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
                 "error_message": str(e),
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
-            # Make sure to set the result and mark as inactive even if there's an error
-            recognition_state.face_recognition_result = result
-            recognition_state.face_recognition_active = False
+            # Make sure to set the result even if there's an error
+            job.set_result(result)
             return result
+        finally:
+            # Don't wait for a gallery fetch nobody needs any more
+            gallery_executor.shutdown(wait=False)
 
     def reset_recognition_state():
         """Reset all recognition state variables"""
@@ -1805,6 +2012,8 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
         cmd = data.get('command', 'unlock_door')
         if cmd == 'unlock_door':
             door_controller.unlock_door()
+            record_incident("forced_unlock", "Unknown", "Forced Unlock", "Door Unlocked",
+                            "Door unlocked through the /unlock endpoint")
             return jsonify({"status": "success", "message": "Door unlocked"}), 200
         elif cmd == 'lock_door':
             door_controller.lock_door()
@@ -1843,4 +2052,69 @@ def setup_routes(app, door_controller, mqtt_handler, backend_session, backend_ur
             logger.error(f"Error in test-mqtt endpoint: {e}")
             return jsonify({"error": str(e)}), 500
 
+    # Hands-free mode (HANDS_FREE_ENABLED): recognition without the kiosk button
+
+    def read_hands_free_frame():
+        """Read a frame from the shared camera for the hands-free monitor"""
+        nonlocal camera
+        with camera_lock:
+            if camera is None or not hasattr(camera, 'isOpened') or not camera.isOpened():
+                camera = get_camera()
+            if camera is None:
+                return None
+            ret, frame = camera.read()
+        if not ret:
+            return None
+        incident_recorder.add_frame(frame)
+        return frame
+
+    def recognize_hands_free(frames):
+        """Run a recognition attempt for the hands-free monitor and act on its result"""
+        # Never take over from a kiosk attempt
+        job = recognition_state.start_job("hands_free", supersede=False)
+        if job is None:
+            return None
+        with activate(job.trace_id), span("recognition", job_id=job.job_id, mode="hands_free"):
+            try:
+                result = run_recognition_background(frames, job)
+            finally:
+                job.finish()
+
+            # Without the kiosk there's nobody to enter an OTP, so only approved
+            # low-security users are let in directly, as in process_face
+            if (result.get("recognized") and result.get("is_allowed") and result.get("low_security")
+                    and result.get("is_live")):
+                user = result['matched_users'][0]
+                matched_phone = user.get('phone_number', user.get('user_id'))
+                logger.info(f"Hands-free: unlocking door for {user.get('name')}")
+                try:
+                    backend_session.post(f"{API_URL}/log-door-access", json={
+                        "user": matched_phone,
+                        "method": "Face Recognition (Hands-free)",
+                        "status": "Door Unlocked",
+                        "details": f"Hands-free access with confidence {result.get('confidence', 0):.2f}"
+                    })
+                except Exception as e:
+                    logger.error(f"Error logging hands-free door access: {e}")
+                door_controller.unlock_door()
+            elif result.get("recognized"):
+                logger.info(f"Hands-free: {result.get('user_name')} recognized; entry continues at the kiosk")
+            elif result.get("face_detected") and result.get("is_live") is False:
+                record_incident("liveness_failed", "Unknown", "Face Recognition (Hands-free)", "Liveness Failed",
+                                "Face detected but the liveness check failed")
+            return result
+
+    # Remote unlocks over MQTT get a clip like the /unlock endpoint
+    mqtt_handler.on_remote_unlock = lambda: record_incident(
+        "remote_unlock", "Unknown", "Remote Unlock", "Door Unlocked", "Door unlocked by an MQTT door command")
+
+    hands_free_monitor = HandsFreeMonitor(
+        read_hands_free_frame,
+        FaceTracker(face_detector),
+        recognize_hands_free,
+        lambda: recognition_state.recognition_running
+    )
+    if HANDS_FREE_ENABLED:
+        hands_free_monitor.start()
+
     return app 
\ No newline at end of file
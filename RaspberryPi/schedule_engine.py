@@ -0,0 +1,186 @@
+"""
+Schedule engine for the door controller.
+Compiles the weekly schedule received over MQTT into open/close transitions and
+drives the door controller when each transition is reached, so web routes only
+read the precomputed state instead of evaluating the schedule per visitor.
+"""
+import logging
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+logger = logging.getLogger("ScheduleEngine")
+
+DAYS_OF_WEEK = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+SECONDS_PER_DAY = 24 * 60 * 60
+SECONDS_PER_WEEK = 7 * SECONDS_PER_DAY
+
+# Upper bound on a single sleep so wall-clock adjustments (NTP, DST) are picked up
+MAX_SLEEP_SECONDS = 300
+
+
+def compile_schedule(schedule):
+    """
+    Compile a schedule into sorted open/close transitions.
+
+    Args:
+        schedule: Dict mapping day name to an entry with open_time, close_time
+                  ("HH:MM" strings) and forceUnlocked, as stored by MQTTHandler
+
+    Returns:
+        list: (seconds_since_monday, is_open, detail) tuples sorted by time
+    """
+    intervals = []
+    for day_index, day in enumerate(DAYS_OF_WEEK):
+        entry = schedule.get(day)
+        if not entry:
+            continue
+        base = day_index * SECONDS_PER_DAY
+
+        if entry.get("forceUnlocked", False):
+            intervals.append((base, base + SECONDS_PER_DAY, f"{day} force unlocked"))
+            continue
+
+        open_time_str = entry.get("open_time")
+        close_time_str = entry.get("close_time")
+        if not open_time_str or not close_time_str:
+            continue
+        try:
+            open_time = datetime.strptime(open_time_str, "%H:%M")
+            close_time = datetime.strptime(close_time_str, "%H:%M")
+        except ValueError as ve:
+            logger.error(f"Schedule time format error for {day}: {ve}")
+            continue
+
+        open_s = open_time.hour * 3600 + open_time.minute * 60
+        # The closing minute is inclusive, so the door stays open until it ends
+        close_s = close_time.hour * 3600 + close_time.minute * 60 + 60
+        if open_s < close_s:
+            intervals.append((base + open_s, base + close_s, f"{day} {open_time_str}-{close_time_str}"))
+
+    # Merge touching intervals (e.g. a force-unlocked day followed by an early opening)
+    merged = []
+    for start, end, detail in intervals:
+        if merged and merged[-1][1] >= start:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end, detail])
+
+    transitions = []
+    for start, end, detail in merged:
+        transitions.append((start, True, detail))
+        transitions.append((end, False, None))
+    return transitions
+
+
+class ScheduleEngine:
+    """Background scheduler that keeps the door state in line with the weekly schedule"""
+
+    def __init__(self, door_controller):
+        self.door_controller = door_controller
+        self._transitions = []
+        self._boundaries = []
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Precomputed state read by the web routes
+        self.is_open = None
+        self.detail = None
+        self.next_transition = None
+        # Set when the door is locked by hand during open hours: it stays locked until then
+        self.locked_until = None
+        door_controller.on_hold_ended = self.manual_lock
+
+    def update(self, schedule):
+        """Recompile the schedule and wake the engine so it re-evaluates immediately"""
+        transitions = compile_schedule(schedule)
+        with self._lock:
+            self._transitions = transitions
+            self._boundaries = [t[0] for t in transitions]
+        logger.info(f"Compiled schedule into {len(transitions)} transitions")
+        self._wake_event.set()
+
+    def manual_lock(self):
+        """The door was locked by hand while held open; keep it locked until the next transition"""
+        logger.info(f"Door locked manually during open hours; staying locked until {self.next_transition}")
+        self.locked_until = self.next_transition
+        self.is_open = False
+        self.detail = None
+        self._wake_event.set()
+
+    def current_state(self):
+        """Return (is_open, detail) as last applied by the engine"""
+        return bool(self.is_open), self.detail
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ScheduleEngine", daemon=True)
+        self._thread.start()
+        logger.info("Schedule engine started")
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        logger.info("Schedule engine stopped")
+
+    def _evaluate(self, now):
+        """Return (is_open, detail, next_transition_datetime) for the given local time"""
+        with self._lock:
+            transitions = self._transitions
+            boundaries = self._boundaries
+        if not transitions:
+            return False, None, None
+
+        week_start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        offset = (now - week_start).total_seconds()
+
+        index = bisect_right(boundaries, offset)
+        if index > 0:
+            _, is_open, detail = transitions[index - 1]
+        else:
+            # Before the first transition of the week; the week always ends closed
+            is_open, detail = False, None
+
+        if index < len(transitions):
+            next_at = week_start + timedelta(seconds=transitions[index][0])
+        else:
+            next_at = week_start + timedelta(seconds=SECONDS_PER_WEEK + transitions[0][0])
+        return is_open, detail, next_at
+
+    def _apply(self, is_open, detail):
+        if is_open == self.is_open:
+            return
+        try:
+            if is_open:
+                logger.info(f"Schedule transition: unlocking door ({detail})")
+                self.door_controller.hold_open()
+            else:
+                logger.info("Schedule transition: locking door")
+                self.door_controller.release_hold()
+        except Exception as e:
+            logger.error(f"Error actuating door for schedule transition: {e}")
+        self.is_open = is_open
+        self.detail = detail
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            now = datetime.now()
+            is_open, detail, next_at = self._evaluate(now)
+            if self.locked_until is not None and now < self.locked_until:
+                is_open, detail = False, None
+            else:
+                self.locked_until = None
+            self._apply(is_open, detail)
+            self.next_transition = next_at
+
+            timeout = MAX_SLEEP_SECONDS
+            if next_at is not None:
+                timeout = min(max((next_at - now).total_seconds(), 0.0), MAX_SLEEP_SECONDS)
+            self._wake_event.wait(timeout)
+            self._wake_event.clear()
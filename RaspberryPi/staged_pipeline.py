@@ -0,0 +1,253 @@
+"""
+Staged capture -> detect -> encode/liveness pipeline for recognition attempts.
+Each stage runs on its own worker(s) and hands work to the next stage through a
+small bounded queue. When a queue is full the oldest item is dropped, so the
+pipeline always works on the freshest frames and latency tracks the slowest
+stage rather than the sum of all stages.
+
+Detection and encoding run either on threads in this process (OpenCV and most
+of dlib's heavy lifting release the GIL) or on worker processes, selected by
+PIPELINE_EXECUTOR in camera_config.py.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from camera_config import (
+    PIPELINE_EXECUTOR, PIPELINE_DETECT_WORKERS, PIPELINE_ANALYSIS_WORKERS, PIPELINE_QUEUE_SIZE, PIPELINE_CAPTURE_FPS
+)
+from frame_context import FrameContext
+from frame_quality import rank_faces, is_usable_size
+from recognition_pipeline import analyse_face
+from metrics import stage_metrics
+from tracing import bind
+
+logger = logging.getLogger("StagedPipeline")
+
+# Events emitted to the caller
+DetectionEvent = namedtuple("DetectionEvent", ["frame_index", "context", "locations"])
+AnalysisEvent = namedtuple("AnalysisEvent", ["frame_index", "quality", "analysis"])
+
+
+class DropOldestQueue:
+    """Bounded queue that discards its oldest item instead of blocking the producer"""
+
+    def __init__(self, maxsize):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout):
+        return self._queue.get(timeout=timeout)
+
+
+## Worker-process side: each process builds its own models once
+
+_worker_models = {}
+
+
+def _init_worker():
+    from face_detection import create_face_detector
+    from face_encoding import create_face_encoder
+    from face_recognition_process import LivenessDetector
+    _worker_models["detector"] = create_face_detector()
+    _worker_models["encoder"] = create_face_encoder()
+    _worker_models["liveness"] = LivenessDetector()
+
+
+def _detect_in_worker(frame):
+    return _worker_models["detector"].detect(frame)
+
+
+def _analyse_in_worker(frame, location):
+    # The worker's stage timings are returned so the parent process can record them
+    with stage_metrics.capture() as samples:
+        analysis = analyse_face(frame, location, _worker_models["encoder"], _worker_models["liveness"])
+    return analysis, samples
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool():
+    """Create the shared worker processes on first use; model loading is paid once"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PIPELINE_DETECT_WORKERS + PIPELINE_ANALYSIS_WORKERS,
+                initializer=_init_worker
+            )
+        return _process_pool
+
+
+class StagedRecognitionPipeline:
+    """
+    Runs one recognition attempt through the capture, detection and
+    encoding/liveness stages and reports results as events.
+    """
+
+    def __init__(self, detector, encoder, liveness_detector, executor=PIPELINE_EXECUTOR,
+                 detect_workers=PIPELINE_DETECT_WORKERS, analysis_workers=PIPELINE_ANALYSIS_WORKERS,
+                 queue_size=PIPELINE_QUEUE_SIZE):
+        self.detector = detector
+        self.encoder = encoder
+        self.liveness_detector = liveness_detector
+        self.detect_workers = detect_workers
+        self.analysis_workers = analysis_workers
+        self.process_pool = _get_process_pool() if executor == "process" else None
+
+        self.capture_queue = DropOldestQueue(queue_size)
+        self.analysis_queue = DropOldestQueue(queue_size)
+        self.events = queue.Queue()
+        self._stop_event = threading.Event()
+        self._capture_done = threading.Event()
+        self._detect_done = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._analyses_left = 0
+        self._min_quality = 0.0
+
+    def start(self, read_frame, max_analyses, min_quality):
+        """
+        Start all stages.
+
+        Args:
+            read_frame: Callable returning the next BGR frame, or None on a failed read
+            max_analyses: Maximum number of faces sent to the encoding/liveness stage
+            min_quality: Minimum quality score for a face to be analysed
+        """
+        self._analyses_left = max_analyses
+        self._min_quality = min_quality
+        self._spawn("capture", self._capture_stage, 1, read_frame)
+        detect_threads = self._spawn("detect", self._detect_stage, self.detect_workers)
+        analysis_threads = self._spawn("analyse", self._analysis_stage, self.analysis_workers)
+        # Downstream stages finish once their upstream is done and their queue is drained
+        threading.Thread(target=self._mark_done, args=(detect_threads, self._detect_done), daemon=True).start()
+        threading.Thread(target=self._mark_done, args=(analysis_threads, None), daemon=True).start()
+
+    def stop(self, timeout=None):
+        """
+        Stop capturing new frames; frames already queued still finish their stages.
+
+        Args:
+            timeout: If given, wait up to this many seconds for the capture stage to
+                     exit, so the caller can release the camera once it returns True
+
+        Returns:
+            bool: True if the capture stage has exited
+        """
+        self._stop_event.set()
+        if timeout is not None:
+            self._capture_done.wait(timeout)
+        return self._capture_done.is_set()
+
+    def _spawn(self, name, target, count, *args):
+        threads = []
+        for i in range(count):
+            thread = threading.Thread(target=bind(target), args=args, name=f"Pipeline-{name}-{i}", daemon=True)
+            thread.start()
+            threads.append(thread)
+        self._threads.extend(threads)
+        return threads
+
+    def _mark_done(self, threads, done_event):
+        for thread in threads:
+            thread.join()
+        if done_event is not None:
+            done_event.set()
+        else:
+            # Last stage finished: tell the consumer nothing else is coming
+            self.events.put(None)
+
+    def _run_in_process(self, function, *args):
+        return self.process_pool.submit(function, *args).result()
+
+    def _capture_stage(self, read_frame):
+        frame_index = 0
+        # Pace reads so sources that never block (buffered frames, fake camera) don't spin
+        interval = 1.0 / PIPELINE_CAPTURE_FPS
+        next_read = time.monotonic()
+        try:
+            while not self._stop_event.is_set():
+                delay = next_read - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_read = max(next_read + interval, time.monotonic())
+                frame = read_frame()
+                if frame is None:
+                    continue
+                # Every later stage works on the same context, so each view is computed once
+                self.capture_queue.put((frame_index, FrameContext(frame)))
+                frame_index += 1
+        except Exception as e:
+            logger.error(f"Capture stage failed: {e}")
+        finally:
+            self._capture_done.set()
+
+    def _detect_stage(self):
+        while True:
+            try:
+                frame_index, context = self.capture_queue.get(timeout=0.05)
+            except queue.Empty:
+                if self._capture_done.is_set():
+                    return
+                continue
+            try:
+                with stage_metrics.time("detect"):
+                    if self.process_pool is not None:
+                        locations = self._run_in_process(_detect_in_worker, context.frame)
+                    else:
+                        locations = self.detector.detect(context)
+            except Exception as e:
+                logger.error(f"Error during face detection: {e}")
+                locations = []
+            self.events.put(DetectionEvent(frame_index, context, locations or []))
+
+            # Forward the frame's best face to the encoding stage if it's worth analysing
+            candidates = rank_faces([context], [locations or []], top_k=1)
+            if candidates and is_usable_size(candidates[0]) and candidates[0].score >= self._min_quality:
+                with self._lock:
+                    if self._analyses_left <= 0:
+                        continue
+                    self._analyses_left -= 1
+                self.analysis_queue.put((frame_index, context, candidates[0]))
+
+    def _analysis_stage(self):
+        while True:
+            try:
+                frame_index, context, quality = self.analysis_queue.get(timeout=0.05)
+            except queue.Empty:
+                if self._detect_done.is_set():
+                    return
+                continue
+            try:
+                if self.process_pool is not None:
+                    analysis, samples = self._run_in_process(_analyse_in_worker, context.frame, quality.location)
+                    stage_metrics.merge(samples)
+                else:
+                    analysis = analyse_face(context, quality.location, self.encoder, self.liveness_detector)
+            except Exception as e:
+                logger.error(f"Error analysing face: {e}")
+                continue
+            self.events.put(AnalysisEvent(frame_index, quality, analysis))
+
+    def stats(self):
+        return {
+            "dropped_captures": self.capture_queue.dropped,
+            "dropped_analyses": self.analysis_queue.dropped
+        }
@@ -0,0 +1,221 @@
+"""
+End-to-end tracing of door entries.
+A trace id is generated when an entry starts (kiosk tap, phone entry, hands-free
+attempt) and carried along every hop: the X-Trace-Id header on backend requests,
+a "trace_id" field in MQTT payloads, and the Flask session for the kiosk's
+follow-up requests. Each hop records a span, and spans are appended to a local
+file in the Chrome trace event format, which chrome://tracing and Perfetto load
+as a timeline. The backend writes its spans the same way; merge both files with
+
+    python tracing.py pi_trace.json backend_trace.json --trace <id> > entry.json
+
+to see one entry across the Pi, the backend, SMS and MQTT.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+from camera_config import TRACE_ENABLED, TRACE_MAX_BYTES
+
+logger = logging.getLogger("Tracing")
+
+TRACE_HEADER = "X-Trace-Id"
+TRACE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'traces', 'pi_trace.json')
+
+# Process ids in the trace file; the backend uses 2, so merged files show one row per app
+TRACE_PID = 1
+TRACE_PROCESS_NAME = "Raspberry Pi"
+
+_local = threading.local()
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    """Trace id active on this thread, or None"""
+    return getattr(_local, "trace_id", None)
+
+
+def set_trace_id(trace_id):
+    """Make trace_id the active trace on this thread (None clears it)"""
+    _local.trace_id = trace_id
+
+
+def start_trace():
+    """
+    Start a new trace on this thread, e.g. when a door entry begins.
+
+    Returns:
+        str: The new trace id
+    """
+    trace_id = new_trace_id()
+    set_trace_id(trace_id)
+    return trace_id
+
+
+@contextmanager
+def activate(trace_id):
+    """Make trace_id the active trace for the body of a with-block"""
+    previous = current_trace_id()
+    set_trace_id(trace_id)
+    try:
+        yield trace_id
+    finally:
+        set_trace_id(previous)
+
+
+def bind(function):
+    """
+    Bind a callable to the trace active now, for running on another thread.
+
+    Threads don't inherit the active trace, so work handed to a thread or pool
+    is wrapped with bind() to keep its spans in the entry's trace.
+    """
+    trace_id = current_trace_id()
+
+    @wraps(function)
+    def bound(*args, **kwargs):
+        with activate(trace_id):
+            return function(*args, **kwargs)
+    return bound
+
+
+def trace_headers():
+    """HTTP headers carrying the active trace (empty without one)"""
+    trace_id = current_trace_id()
+    return {TRACE_HEADER: trace_id} if trace_id else {}
+
+
+class TraceWriter:
+    """Appends complete ("X") events to a Chrome trace file"""
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._file = open(self.path, 'a', buffering=1)
+        if new_file:
+            # JSON array format: the closing bracket is optional, so events can be appended
+            self._file.write("[\n")
+            self._write_event({"name": "process_name", "ph": "M", "pid": TRACE_PID,
+                               "args": {"name": TRACE_PROCESS_NAME}})
+
+    def _write_event(self, event):
+        self._file.write(json.dumps(event) + ",\n")
+
+    def write(self, event):
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open()
+                self._write_event(event)
+                if self._file.tell() > self.max_bytes:
+                    # Keep one previous file, so a busy door can't fill the card
+                    self._file.close()
+                    self._file = None
+                    os.replace(self.path, self.path + ".1")
+            except Exception as e:
+                logger.error(f"Error writing trace event: {e}")
+                self._file = None
+
+
+_writer = TraceWriter()
+
+
+def record_span(name, category, start, end, trace_id=None, **args):
+    """
+    Record a finished span.
+
+    Args:
+        name: Span name, e.g. "encode" or "POST /check-verification-RPI"
+        category: Hop the span belongs to ("pi", "stage", "http", "mqtt")
+        start: Start time (time.time())
+        end: End time (time.time())
+        trace_id: Trace the span belongs to; defaults to the active trace
+        **args: Extra details shown with the span
+    """
+    trace_id = trace_id or current_trace_id()
+    if not TRACE_ENABLED or trace_id is None:
+        return
+    _writer.write({
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": int(start * 1e6),
+        "dur": max(int((end - start) * 1e6), 1),
+        "pid": TRACE_PID,
+        "tid": threading.get_ident(),
+        "args": dict(args, trace_id=trace_id)
+    })
+
+
+@contextmanager
+def span(name, category="pi", **args):
+    """Record the body of a with-block as a span of the active trace (if any)"""
+    start = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, category, start, time.time(), **args)
+
+
+class TracingSession(requests.Session):
+    """requests.Session that sends the active trace id and records each call as a span"""
+
+    def request(self, method, url, *args, **kwargs):
+        if current_trace_id() is None:
+            return super().request(method, url, *args, **kwargs)
+        kwargs["headers"] = dict(kwargs.get("headers") or {}, **trace_headers())
+        with span(f"{method.upper()} {urlparse(url).path}", "http"):
+            return super().request(method, url, *args, **kwargs)
+
+
+def read_trace_events(path):
+    """Events of a trace file, tolerating the missing closing bracket"""
+    with open(path) as trace_file:
+        text = trace_file.read().strip()
+    if not text.endswith("]"):
+        text = text.rstrip(",") + "]"
+    return json.loads(text)
+
+
+def merge_traces(paths, trace_id=None):
+    """
+    Merge trace files, optionally keeping only one trace.
+
+    Args:
+        paths: Trace files written by the Pi and the backend
+        trace_id: Optional trace id to keep
+
+    Returns:
+        list: Trace events, loadable as a JSON array by chrome://tracing or Perfetto
+    """
+    events = []
+    for path in paths:
+        for event in read_trace_events(path):
+            if trace_id is None or event.get("ph") == "M" or event.get("args", {}).get("trace_id") == trace_id:
+                events.append(event)
+    return events
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge Pi and backend trace files into one timeline")
+    parser.add_argument("files", nargs="+", help="Trace files to merge")
+    parser.add_argument("--trace", help="Only keep spans of this trace id")
+    options = parser.parse_args()
+    json.dump(merge_traces(options.files, options.trace), sys.stdout)
@@ -7,6 +7,8 @@ import requests
 import logging
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from metrics import stage_metrics
+from tracing import TracingSession
 
 # Configure logging
 logger = logging.getLogger("Utils")
@@ -40,7 +42,8 @@ def create_backend_session(max_retries=3, backoff_factor=0.3):
 
     # Create session with retry adapter
     adapter = HTTPAdapter(max_retries=retry_strategy)
-    session = requests.Session()
+    # Sends the active trace id with every request (see tracing)
+    session = TracingSession()
     
     # We do not present a client cert for HTTP(S) calls
     # session.cert can be configured if you enforce HTTP mTLS in future
@@ -109,7 +112,8 @@ def verify_otp_rest(session, backend_url, phone_number, otp_code):
         print(f"[DEBUG] Sending OTP verification request to backend: {payload}")
         
         # Send the request to the backend
-        response = session.post(f"{backend_url}/check-verification-RPI", json=payload)
+        with stage_metrics.time("backend_call"):
+            response = session.post(f"{backend_url}/check-verification-RPI", json=payload)
         print(f"[DEBUG] Backend response: {response.status_code} - {response.text}")
         
         if response.status_code == 200: